@@ -0,0 +1,310 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from telemetry import get_logger, metrics, warning
+
+ROOT_PATH = Path(__file__).parent.parent
+
+DEFAULT_BATCHING_SETTINGS = {
+    "enabled": True,
+    "state_path": "data/db/batch_stats.json",
+    "window": 100,
+    "min_samples": 5,
+    "min_gain": 0.1,
+    "save_every_seconds": 30,
+}
+
+STATE_VERSION = 1
+
+logger = get_logger("agents.batching")
+
+
+def get_batching_settings(settings: dict) -> dict:
+
+    batching_settings = dict(DEFAULT_BATCHING_SETTINGS)
+    batching_settings.update((settings or {}).get("batching", {}))
+
+    return batching_settings
+
+
+def expected_seconds(stats: dict, items: int, size: int, slots: int) -> float:
+    """Expected wall time of ``items`` items sent ``size`` at a time with
+    ``slots`` requests in flight, re-asking the batches that fail to parse."""
+
+    batches = math.ceil(items / size)
+    size = math.ceil(items / batches)
+    waves = math.ceil(batches / max(1, slots))
+    batch_s = stats["first_chunk_s"] + size * stats["item_s"]
+    failure_rate = 1 - (1 - stats["item_failure_rate"]) ** size
+
+    return waves * batch_s * (1 + failure_rate)
+
+
+class BatchTuner:
+    """Learns how a model's batched requests behave and sizes the next ones.
+
+    Every request is kept per model in a rolling window of ``window``
+    samples: its size, its time to first chunk, its total time and whether
+    the reply failed to parse. From them a batch of ``n`` items is expected
+    to take the median time to first chunk plus ``n`` times the median time
+    per item, and to fail with the chance that any of its items does. The
+    chosen size minimises the expected wall time of all pending items over
+    the available slots; a larger size within ``min_gain`` of the best wins,
+    since every extra request resends the prompt. The samples are saved to
+    ``state_path`` (a small JSON file) so a restart keeps them.
+    """
+
+    def __init__(self, path: Path = None):
+
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._saved = time.monotonic()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Read the saved samples; a missing or broken file starts empty."""
+
+        if self.path is None or not self.path.exists():
+
+            return
+
+        try:
+
+            state = json.loads(self.path.read_text(encoding="utf-8"))
+
+            if state.get("version") != STATE_VERSION:
+
+                raise ValueError(f"unknown state version {state.get('version')}")
+
+            samples = {
+                model: deque((tuple(sample) for sample in rows), maxlen=len(rows) or 1)
+                for model, rows in state["models"].items()
+            }
+
+        except Exception as e:
+
+            warning(logger, e, f"Failed to load {self.path.name}; starting empty")
+            return
+
+        with self._lock:
+
+            self._samples = samples
+
+    def save(self, force: bool = True, every: float = 0.0):
+        """Write the samples to ``path`` if they changed, at most every
+        ``every`` seconds unless ``force``-d."""
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            if self.path is None or not self._dirty:
+
+                return
+
+            if not force and now - self._saved < every:
+
+                return
+
+            state = {
+                "version": STATE_VERSION,
+                "models": {
+                    model: [list(sample) for sample in samples]
+                    for model, samples in self._samples.items()
+                },
+            }
+            self._dirty = False
+            self._saved = now
+
+        try:
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            partial = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            partial.write_text(json.dumps(state), encoding="utf-8")
+            os.replace(partial, self.path)
+
+        except Exception as e:
+
+            warning(logger, e, f"Failed to save {self.path.name}")
+
+    def record(
+        self,
+        model: str,
+        size: int,
+        seconds: float,
+        first_chunk_s: float,
+        failed: bool,
+        settings: dict = None,
+    ):
+
+        batching_settings = get_batching_settings(settings)
+        window = int(batching_settings["window"])
+
+        with self._lock:
+
+            samples = self._samples.get(model)
+
+            if samples is None or samples.maxlen != window:
+
+                samples = self._samples[model] = deque(samples or (), maxlen=window)
+
+            samples.append(
+                (int(size), round(seconds, 4), round(first_chunk_s, 4), bool(failed))
+            )
+            self._dirty = True
+
+        every = float(batching_settings["save_every_seconds"])
+
+        # Written on a thread: aiter_batch records from the event loop.
+        if self.path is not None and time.monotonic() - self._saved >= every:
+
+            threading.Thread(
+                target=self.save,
+                kwargs={"force": False, "every": every},
+                name="batch-state-save",
+                daemon=True,
+            ).start()
+
+    def stats(self, model: str) -> dict:
+        """``{"samples", "first_chunk_s", "item_s", "item_failure_rate"}``
+        of ``model``'s window."""
+
+        with self._lock:
+
+            samples = list(self._samples.get(model, ()))
+
+        ok = [sample for sample in samples if not sample[3]]
+        items = sum(size for size, *_ in samples)
+        failures = sum(1 for sample in samples if sample[3])
+
+        def median(values):
+
+            values = sorted(values)
+            return values[len(values) // 2] if values else 0.0
+
+        first_chunk_s = median(first for _, _, first, _ in ok)
+
+        return {
+            "samples": len(samples),
+            "first_chunk_s": first_chunk_s,
+            "item_s": median(
+                max(0.0, seconds - first_chunk_s) / size
+                for size, seconds, _, _ in ok
+                if size
+            ),
+            "item_failure_rate": min(0.99, failures / items) if items else 0.0,
+        }
+
+    def choose(
+        self,
+        model: str,
+        items: int,
+        slots: int,
+        low: int,
+        high: int,
+        settings: dict = None,
+    ):
+        """The batch size between ``low`` and ``high`` for ``items`` items, or
+        ``None`` while ``model`` has fewer than ``min_samples`` samples."""
+
+        batching_settings = get_batching_settings(settings)
+        stats = self.stats(model)
+
+        if (
+            not batching_settings["enabled"]
+            or items <= 0
+            or stats["samples"] < int(batching_settings["min_samples"])
+        ):
+
+            return None
+
+        low = max(1, min(low, items))
+        high = max(low, min(high, items))
+        expected = {
+            size: expected_seconds(stats, items, size, slots)
+            for size in range(low, high + 1)
+        }
+        best = min(expected.values())
+        size = max(
+            size
+            for size, seconds in expected.items()
+            if seconds <= best * (1 + float(batching_settings["min_gain"]))
+        )
+
+        return math.ceil(items / math.ceil(items / size))
+
+    def models(self) -> list:
+
+        with self._lock:
+
+            return list(self._samples)
+
+    def reset(self):
+
+        with self._lock:
+
+            self._samples = {}
+            self._dirty = True
+
+
+_tuner = None
+_tuner_lock = threading.Lock()
+
+
+def get_tuner(settings: dict = None) -> BatchTuner:
+    """The shared tuner, reading ``batching.state_path`` on first use (an
+    empty path keeps the samples in memory only)."""
+
+    global _tuner
+
+    if _tuner is None:
+
+        with _tuner_lock:
+
+            if _tuner is None:
+
+                state_path = get_batching_settings(settings)["state_path"]
+                _tuner = BatchTuner(ROOT_PATH / state_path if state_path else None)
+
+    return _tuner
+
+
+def save():
+
+    if _tuner is not None:
+
+        _tuner.save()
+
+
+atexit.register(save)
+
+
+def batch_estimates() -> dict:
+
+    if _tuner is None:
+
+        return {}
+
+    return {
+        (model, kind): value
+        for model in _tuner.models()
+        for kind, value in _tuner.stats(model).items()
+        if kind != "samples"
+    }
+
+
+metrics.REGISTRY.callback(
+    "llm_batch_estimate",
+    "What batch sizes are chosen from, per model: median seconds to first "
+    "chunk, median seconds per item and the share of items in failed replies.",
+    batch_estimates,
+    labelnames=("model", "kind"),
+)
@@ -0,0 +1,198 @@
+import math
+import threading
+from collections import deque
+
+from agents import resilience
+from agents.transport import estimate_tokens
+from telemetry import metrics
+
+DEFAULT_BUDGET_SETTINGS = {
+    "enabled": True,
+    "latency_target_seconds": 30,
+    "completion_tokens_per_item": 700,
+    "output_tokens_per_second": 150,
+    "max_tokens_per_item": 2048,
+    "min_batch": 1,
+    "max_batch": 5,
+    "window": 50,
+}
+
+
+def get_budget_settings(settings: dict) -> dict:
+
+    budget_settings = dict(DEFAULT_BUDGET_SETTINGS)
+    budget_settings.update((settings or {}).get("budget", {}))
+
+    return budget_settings
+
+
+def prompt_tokens(body: dict) -> int:
+    """Estimated tokens of the messages in ``body``."""
+
+    return sum(
+        estimate_tokens(message["content"])
+        for message in body.get("messages", [])
+        if isinstance(message.get("content"), str)
+    )
+
+
+class TokenBudget:
+    """Sizes an agent's batched requests from what its replies cost.
+
+    Each answered batch adds its completion tokens per item and, when the
+    reply was streamed, its output rate (tokens after the first chunk over
+    the time they took) to a rolling window per agent. The batch size is the
+    most items whose expected time, the median time to first chunk plus
+    their tokens at the median rate, fits ``latency_target_seconds``; the
+    settings' estimates stand in until there are samples.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def _window(self, agent: str, kind: str, window: int) -> deque:
+
+        samples = self._samples.get((agent, kind))
+
+        if samples is None or samples.maxlen != window:
+
+            samples = deque(samples or (), maxlen=window)
+            self._samples[(agent, kind)] = samples
+
+        return samples
+
+    def record(
+        self,
+        agent: str,
+        body: dict,
+        items: int,
+        chunks: list,
+        chunk_times: list,
+        settings: dict = None,
+    ):
+        """Account for one reply of ``chunks`` (received at ``chunk_times``,
+        ``time.perf_counter()`` values) answering ``items`` items."""
+
+        if items <= 0 or not chunks:
+
+            return
+
+        window = int(get_budget_settings(settings)["window"])
+        completion = sum(estimate_tokens(chunk) for chunk in chunks)
+        streamed = len(chunks) > 1 and chunk_times[-1] > chunk_times[0]
+
+        metrics.LLM_TOKENS_PER_ITEM.observe(
+            prompt_tokens(body) / items, agent=agent, kind="prompt"
+        )
+        metrics.LLM_TOKENS_PER_ITEM.observe(
+            completion / items, agent=agent, kind="completion"
+        )
+
+        with self._lock:
+
+            self._window(agent, "tokens_per_item", window).append(completion / items)
+
+            if streamed:
+
+                rate = (completion - estimate_tokens(chunks[0])) / (
+                    chunk_times[-1] - chunk_times[0]
+                )
+                self._window(agent, "tokens_per_second", window).append(rate)
+
+    def median(self, agent: str, kind: str):
+
+        with self._lock:
+
+            samples = sorted(self._samples.get((agent, kind), ()))
+
+        return samples[len(samples) // 2] if samples else None
+
+    def estimates(self, agent: str, settings: dict = None) -> dict:
+        """``{"tokens_per_item", "tokens_per_second", "first_chunk_s"}`` the
+        next batch of ``agent`` is sized with."""
+
+        budget_settings = get_budget_settings(settings)
+        per_item = self.median(agent, "tokens_per_item")
+        rate = self.median(agent, "tokens_per_second")
+
+        return {
+            "tokens_per_item": per_item
+            or float(budget_settings["completion_tokens_per_item"]),
+            "tokens_per_second": rate
+            or float(budget_settings["output_tokens_per_second"]),
+            "first_chunk_s": resilience.latencies.percentile(agent, 50) or 0.0,
+        }
+
+    def batch_size(self, agent: str, pending: int, settings: dict = None) -> int:
+        """Items per request for ``pending`` items, spread evenly over the
+        fewest requests that each fit the latency target."""
+
+        budget_settings = get_budget_settings(settings)
+        low = max(1, int(budget_settings["min_batch"]))
+        high = max(low, int(budget_settings["max_batch"]))
+
+        if not budget_settings["enabled"]:
+
+            return high
+
+        estimates = self.estimates(agent, settings)
+        seconds = float(budget_settings["latency_target_seconds"])
+        seconds -= estimates["first_chunk_s"]
+        fits = int(
+            seconds * estimates["tokens_per_second"] / estimates["tokens_per_item"]
+        )
+        size = min(high, max(low, fits))
+
+        if pending <= 0:
+
+            return size
+
+        return math.ceil(pending / math.ceil(pending / size))
+
+    def max_tokens(self, items: int, settings: dict = None, ceiling=None):
+        """The completion limit of a request for ``items`` items, at most
+        ``ceiling`` (the body's own ``max_tokens``), or ``ceiling`` when the
+        budget is off."""
+
+        budget_settings = get_budget_settings(settings)
+
+        if not budget_settings["enabled"]:
+
+            return ceiling
+
+        limit = items * int(budget_settings["max_tokens_per_item"])
+
+        return min(limit, int(ceiling)) if ceiling else limit
+
+    def reset(self):
+
+        with self._lock:
+
+            self._samples = {}
+
+
+budget = TokenBudget()
+
+
+def budget_estimates() -> dict:
+
+    with budget._lock:
+
+        agents = {agent for agent, _ in budget._samples}
+
+    return {
+        (agent, kind): value
+        for agent in agents
+        for kind, value in budget.estimates(agent).items()
+    }
+
+
+metrics.REGISTRY.callback(
+    "llm_budget_estimate",
+    "What each agent's next batch is sized with: completion tokens per item, "
+    "output tokens per second and median seconds to first chunk.",
+    budget_estimates,
+    labelnames=("agent", "kind"),
+)
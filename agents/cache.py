@@ -0,0 +1,352 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from agents import resilience
+from telemetry import metrics
+
+ROOT_PATH = Path(__file__).parent.parent
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": True,
+    "path": "data/db/llm_cache.sqlite3",
+    "ttl_seconds": 604800,
+    "max_entries": 5000,
+}
+
+# Fields of the request body that do not change what the model answers.
+IGNORED_BODY_KEYS = ("stream",)
+
+
+def cache_key(body: dict) -> str:
+    """Hash of the model, messages and sampling params of a request body."""
+
+    keyed = {k: v for k, v in body.items() if k not in IGNORED_BODY_KEYS}
+    canonical = json.dumps(
+        keyed, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent, content-addressed store of chat-completion contents.
+
+    Entries live in a SQLite file shared by every worker process. They expire
+    after ``ttl_seconds`` and the least recently used ones are evicted once
+    there are more than ``max_entries``.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float = 604800, max_entries=5000):
+
+        self.path = Path(path)
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access"
+                " ON responses (last_access)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None or self._local.pid != os.getpid():
+
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def _count(self, name: str, amount: int = 1):
+
+        with self._stats_lock:
+
+            self._stats[name] += amount
+
+    def get(self, key: str):
+
+        now = time.time()
+        conn = self._connect()
+
+        row = conn.execute(
+            "SELECT content, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+
+            self._count("misses")
+            return None
+
+        content, created_at = row
+
+        with conn:
+
+            if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count("expired")
+                self._count("misses")
+                return None
+
+            conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (now, key),
+            )
+
+        self._count("hits")
+
+        return content
+
+    def put(self, key: str, content: str, model: str = ""):
+
+        now = time.time()
+        conn = self._connect()
+
+        with conn:
+
+            conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, model, content, created_at, last_access, hits)"
+                " VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model, content, now, now),
+            )
+
+            overflow = (
+                conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                - self.max_entries
+            )
+
+            if self.max_entries > 0 and overflow > 0:
+
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN"
+                    " (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._count("evictions", overflow)
+
+        self._count("stores")
+
+    def discard(self, key: str):
+
+        with self._connect() as conn:
+
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def counts(self) -> dict:
+
+        with self._stats_lock:
+
+            return dict(self._stats)
+
+    def stats(self) -> dict:
+
+        stats = self.counts()
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = (
+            self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        )
+
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_settings(settings: dict) -> dict:
+
+    cache_settings = dict(DEFAULT_CACHE_SETTINGS)
+    cache_settings.update((settings or {}).get("cache", {}))
+
+    return cache_settings
+
+
+def get_cache(settings: dict = None) -> ResponseCache:
+
+    global _cache
+
+    if _cache is None:
+
+        with _cache_lock:
+
+            if _cache is None:
+
+                cache_settings = get_cache_settings(settings)
+
+                _cache = ResponseCache(
+                    ROOT_PATH / cache_settings["path"],
+                    ttl_seconds=cache_settings["ttl_seconds"],
+                    max_entries=cache_settings["max_entries"],
+                )
+
+    return _cache
+
+
+def is_bypassed(settings: dict = None, bypass: bool = False) -> bool:
+
+    if bypass or os.environ.get("LLM_CACHE_BYPASS", "") not in ("", "0"):
+
+        return True
+
+    return not get_cache_settings(settings)["enabled"]
+
+
+def lookup(body: dict, settings: dict = None, bypass=False, info: dict = None):
+    """``(cache, key, content)`` for ``body``: the stored content on a hit,
+    ``None`` on a miss, and no cache at all when it is bypassed."""
+
+    if info is not None:
+
+        info["cached"] = False
+
+    if is_bypassed(settings, bypass):
+
+        return None, None, None
+
+    cache = get_cache(settings)
+    key = cache_key(body)
+    content = cache.get(key)
+
+    if content is not None and info is not None:
+
+        info["cached"] = True
+
+    return cache, key, content
+
+
+def store(cache, key: str, body: dict, received: list):
+    """Keep a reply that was read to the end, unless the cache is bypassed."""
+
+    if cache is not None:
+
+        cache.put(key, "".join(received), model=body.get("model", ""))
+
+
+def iter_completion(
+    url: str,
+    headers: dict,
+    body: dict,
+    settings: dict = None,
+    bypass=False,
+    agent: str = "",
+    info: dict = None,
+):
+    """Cached front of ``resilience.iter_completion``.
+
+    A hit yields the stored content as a single chunk. A miss streams the
+    chunks from the API (with ``agent``'s retries and hedging) and stores the
+    content once it has been read to the end. Set ``bypass`` (or
+    ``LLM_CACHE_BYPASS=1``, or ``cache.enabled`` to false) to go straight to
+    the API. If an ``info`` dict is given, ``info["cached"]`` is set to
+    whether the reply came from the cache and, for a miss, ``info["model"]``
+    to the model that answered.
+    """
+
+    cache, key, content = lookup(body, settings, bypass, info)
+
+    if content is not None:
+
+        yield content
+        return
+
+    received = []
+
+    for chunk in resilience.iter_completion(url, headers, body, settings, agent, info):
+
+        received.append(chunk)
+        yield chunk
+
+    store(cache, key, body, received)
+
+
+async def aiter_completion(
+    url: str,
+    headers: dict,
+    body: dict,
+    settings: dict = None,
+    bypass=False,
+    agent: str = "",
+    info: dict = None,
+):
+    """Async form of ``iter_completion``; the cache is read and written on a
+    worker thread, as every worker shares its database."""
+
+    cache, key, content = await asyncio.to_thread(lookup, body, settings, bypass, info)
+
+    if content is not None:
+
+        yield content
+        return
+
+    received = []
+
+    async for chunk in resilience.aiter_completion(
+        url, headers, body, settings, agent, info
+    ):
+
+        received.append(chunk)
+        yield chunk
+
+    await asyncio.to_thread(store, cache, key, body, received)
+
+
+def discard(body: dict, settings: dict = None):
+    """Drop the cached reply for ``body``, e.g. after it failed to parse."""
+
+    if not is_bypassed(settings):
+
+        get_cache(settings).discard(cache_key(body))
+
+
+def stats() -> dict:
+
+    if _cache is None:
+
+        return {}
+
+    return _cache.stats()
+
+
+metrics.REGISTRY.callback(
+    "llm_cache_events_total",
+    "LLM response cache hits, misses, stores, evictions and expired entries.",
+    lambda: _cache.counts() if _cache is not None else {},
+    kind="counter",
+    labelnames=("event",),
+)
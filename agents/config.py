@@ -0,0 +1,401 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from types import MappingProxyType
+
+from telemetry import get_logger, warning
+
+ROOT_PATH = Path(__file__).parent.parent
+SETTING_PATH = ROOT_PATH / "agents" / "common_settings.json"
+
+# How often a read of the settings looks at the file's mtime for changes.
+RELOAD_CHECK_SECONDS = 2.0
+
+# JSON values ``thaw`` can hand out as they are.
+SCALARS = frozenset((str, int, float, bool, type(None)))
+
+logger = get_logger("agents.config")
+
+
+def freeze(value):
+    """A read-only copy of a JSON value: dicts become mapping proxies and
+    lists tuples, all the way down."""
+
+    if isinstance(value, Mapping):
+
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+
+    if isinstance(value, (list, tuple)):
+
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+def thaw(value):
+    """A fresh, mutable copy of a ``freeze``-d value."""
+
+    kind = type(value)
+
+    if kind is MappingProxyType:
+
+        return {
+            key: item if type(item) in SCALARS else thaw(item)
+            for key, item in value.items()
+        }
+
+    if kind is tuple:
+
+        return [item if type(item) in SCALARS else thaw(item) for item in value]
+
+    return value
+
+
+def build_body(settings: dict, agent_name: str) -> dict:
+    """The agent's request body: the default body, its ``raw`` overrides and
+    an empty message for each of its ``roles`` the default lacks."""
+
+    default = settings["ai_api"]["body"]["default"]
+    specific = settings["ai_api"]["body"]["specific"][agent_name]
+    body = json.loads(json.dumps(default))
+    body.update(json.loads(json.dumps(specific["raw"])))
+
+    present = [message["role"] for message in body["messages"]]
+
+    for role in specific.get("roles", []):
+
+        if role not in present:
+
+            body["messages"].append({"role": role, "content": ""})
+
+    return body
+
+
+class Config:
+    """``common_settings.json``, parsed once and shared by every agent.
+
+    Nothing is read until the settings are first used. After that, a read
+    at most every ``RELOAD_CHECK_SECONDS`` compares the file's mtime and
+    parses it again when it has changed; a file that no longer parses keeps
+    the previous settings. A reload swaps in a new dict, so a caller holding
+    the old one never sees it change half-way. Request body templates are
+    built once per load and frozen; ``new_body`` hands out deep copies.
+    """
+
+    def __init__(self, path: Path = SETTING_PATH):
+
+        self.path = Path(path)
+        self.version = 0
+        self._lock = threading.RLock()
+        self._settings = None
+        self._stamp = None
+        self._checked = 0.0
+        self._templates = {}
+        self._env_loaded = False
+
+    def _file_stamp(self):
+
+        try:
+
+            stat = self.path.stat()
+
+        except OSError:
+
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_env(self, settings: dict):
+        """Load the ``.env`` file named by ``env.path``, once per process."""
+
+        if self._env_loaded:
+
+            return
+
+        self._env_loaded = True
+
+        try:
+
+            env_path = ROOT_PATH / settings["env"]["path"]
+
+        except Exception as e:
+
+            env_path = ROOT_PATH / "env"
+            warning(logger, e, "Failed to set ENV_PATH; assuming path")
+
+        try:
+
+            from dotenv import load_dotenv
+
+            load_dotenv(env_path)
+
+        except Exception as e:
+
+            warning(
+                logger,
+                e,
+                "Failed to load .env file(You may not have dotenv installed) | Do it by 'pip install python-dotenv'",
+            )
+
+    def apply_env_overrides(self, settings: dict):
+
+        # AI_API_BASE_URL points the agents at another proxy, e.g. a local stub.
+        base_url = os.environ.get("AI_API_BASE_URL")
+
+        if not base_url:
+
+            return
+
+        try:
+
+            settings["ai_api"]["urls"]["base_api_url"] = base_url.rstrip("/") + "/"
+
+        except Exception as e:
+
+            warning(logger, e, "Failed to apply AI_API_BASE_URL; keeping base_api_url")
+
+    def reload(self) -> dict:
+        """Parse the settings file now and make it the current settings."""
+
+        with self._lock:
+
+            stamp = self._file_stamp()
+
+            try:
+
+                with open(self.path, "r", encoding="utf-8") as f:
+
+                    settings = json.load(f)
+
+            except Exception as e:
+
+                if self._settings is not None:
+
+                    warning(logger, e, "Failed to reload settings; keeping the last")
+                    self._stamp = stamp
+                    return self._settings
+
+                settings = {}
+                warning(logger, e, "Failed to load settings; using empty settings")
+
+            self.load_env(settings)
+            self.apply_env_overrides(settings)
+
+            self._settings = settings
+            self._stamp = stamp
+            self._templates = {}
+            self.version += 1
+
+            if self.version > 1:
+
+                logger.info(f"Reloaded {self.path.name}")
+
+            return settings
+
+    @property
+    def settings(self) -> dict:
+
+        now = time.monotonic()
+
+        if self._settings is not None and now - self._checked < RELOAD_CHECK_SECONDS:
+
+            return self._settings
+
+        with self._lock:
+
+            self._checked = now
+
+            if self._settings is None or self._file_stamp() != self._stamp:
+
+                return self.reload()
+
+            return self._settings
+
+    def body_template(self, agent_name: str):
+        """The agent's frozen request body for the current settings."""
+
+        settings = self.settings
+
+        with self._lock:
+
+            template = self._templates.get(agent_name)
+
+            if template is None or template[0] is not settings:
+
+                template = (settings, freeze(build_body(settings, agent_name)))
+                self._templates[agent_name] = template
+
+        return template[1]
+
+    def new_body(self, agent_name: str) -> dict:
+        """A private, mutable copy of the agent's request body."""
+
+        return thaw(self.body_template(agent_name))
+
+
+config = Config()
+
+
+class AgentSettings:
+    """One agent's view of the shared ``config``: its body, headers, URL and
+    logger. Creating one reads nothing; the settings load on first use."""
+
+    def __init__(self, agent_name: str, log: bool = False, shared: Config = None):
+
+        self.agent_name = agent_name
+        self.debug = log
+        self.config = shared or config
+        self.module_name = self.__class__.__name__
+        self.logger = get_logger(f"agents.{agent_name}")
+        self.root_path = ROOT_PATH
+        self.settings_path = self.config.path
+        self._checked_version = None
+
+    @property
+    def settings(self) -> dict:
+
+        settings = self.config.settings
+
+        if self._checked_version != self.config.version:
+
+            self.check_agent(settings)
+            self._checked_version = self.config.version
+
+        return settings
+
+    @property
+    def env(self):
+
+        self.config.settings
+        return os.environ
+
+    @property
+    def env_available_keys(self) -> list:
+
+        try:
+
+            return self.settings["env"]["available_keys"]
+
+        except Exception as e:
+
+            self.warn(e, "Failed to get available_keys; using empty list")
+            return []
+
+    def check_agent(self, settings: dict):
+
+        try:
+
+            agent_in_list = settings["agents"]["available_agents"]
+
+        except Exception as e:
+
+            agent_in_list = []
+            self.warn(e, "Failed to get available_agents; using empty list")
+
+        if self.agent_name not in agent_in_list:
+
+            self.warn(
+                Exception("Agent not in available_agents"),
+                f"Agent '{self.agent_name}' not found in available_agents",
+            )
+
+            raise Exception(f"Agent '{self.agent_name}' not found in available_agents")
+
+    def replace_prompts_in_body_with_custom(
+        self, body, user: str, system=None, assistant=None
+    ):
+
+        if "messages" in body:
+
+            for message in body["messages"]:
+
+                if message["role"] == "user" and user is not None:
+
+                    message["content"] = user
+
+                if message["role"] == "system" and system is not None:
+
+                    message["content"] = system
+
+                if message["role"] == "assistant" and assistant is not None:
+
+                    message["content"] = assistant
+
+        return body
+
+    def get_headers(self, api_key="use_env", key_name="AI_API_KEY"):
+
+        if api_key == "use_env":
+
+            available_keys = self.env_available_keys
+
+            if key_name not in available_keys:
+
+                self.warn(
+                    Exception("Key not in available_keys"),
+                    f"Key '{key_name}' not found in available_keys; will use first available key",
+                )
+
+                if available_keys:
+
+                    key_name = available_keys[0]
+
+            api_key = self.env.get(key_name) or ""
+
+        try:
+
+            headers = dict(self.settings["ai_api"]["default_headers"])
+
+        except Exception as e:
+
+            headers = {}
+            self.warn(e, "Failed to get default_headers; using empty dict")
+
+        for header_key, header_value in headers.items():
+
+            if "{AI_API_KEY}" in header_value:
+
+                headers[header_key] = header_value.replace("{AI_API_KEY}", api_key)
+
+        return headers
+
+    def get_body(self) -> dict:
+        """A fresh copy of the agent's request body, safe to fill in."""
+
+        self.settings
+        return self.config.new_body(self.agent_name)
+
+    def get_chat_completion_url(self):
+
+        try:
+
+            url = (
+                self.settings["ai_api"]["urls"]["base_api_url"]
+                + self.settings["ai_api"]["urls"]["chat_completion_endpoint"]
+            )
+
+        except Exception as e:
+
+            self.warn(e, "Failed to get chat_completion_url; returning empty string")
+            url = ""
+
+        return url
+
+    def warn(self, e: Exception, extra: str = ""):
+
+        warning(self.logger, e, extra)
+
+    def log(self, message: str):
+
+        # Shown by default for an agent built with log=True, else only with
+        # LOG_LEVEL=DEBUG.
+        if self.debug:
+
+            self.logger.info(message)
+
+        else:
+
+            self.logger.debug(message)
@@ -1,323 +1,347 @@
 import json
+import time
 from pathlib import Path
 
+import requests
+
+from agents import cache as llm_cache
+from agents import config, resilience, transport
+from agents.parsing import iter_json_items
+from agents.streaming import aiter_json_list, iter_json_list
+from telemetry import metrics, quote
+
 ROOT_PATH = Path(__file__).parent.parent.parent
-SETTING_PATH = ROOT_PATH / "agents" / "common_settings.json"
 EXAMPLE_PATH = ROOT_PATH / "agents" / "examples"
 EXAMPLE_OUTPUT_PATH = EXAMPLE_PATH / "diversifier_output.json"
 
-class common_settings:
+common_settings_instance = config.AgentSettings("diversifier")
 
-    def __init__(self, agent_name: str):
 
-        import json
-        from pathlib import Path
+class DiversificationFailed(Exception):
 
-        self.module_name = self.__class__.__name__
+    pass
 
-        try:
 
-            self.root_path = ROOT_PATH
+def build_request(input_text: str):
+    """Return the ``(url, headers, body)`` of the diversification request."""
 
-        except Exception as e:
-
-            self.root_path = Path(__file__).parent.parent.parent
-            self.warn(e, "Failed to set ROOT_PATH; assuming path")
+    SYSTEM_PROMPT = """You are a culinary anthropologist who finds cultural and regional variations of a given dish concept.
 
-        try:
+Goal:
+- Return dishes from different regions, countries, or ethnic communities that are structurally or culturally similar.
+- Each result must correspond to a concrete, cookable dish that has actual recipes available online (not vague concepts).
 
-            self.settings_path = SETTING_PATH
+Output format (important):
+- Return ONLY valid JSON (no extra text, no markdown).
+- JSON must be a list of objects with exactly these keys:
 
-        except Exception as e:
+[
+  {
+    "dish_name": "Pad Thai",
+    "local_name": "ผัดไทย",
+    "region": "Thailand",
+    "culture_or_ethnicity": "Thai",
+    "similarity_score": 0.92,
+    "recipe_search_prompt": "pad thai",
+    "coordinates": [12.9716, 100.5018] # Latitude and Longitude of the dish's region
+  }
+]
 
-            self.settings_path = (
-                Path(__file__).parent.parent.parent / "agents" / "common_settings.json"
-            )
-            self.warn(e, "Failed to set SETTING_PATH; assuming path")
+Field rules:
+- "dish_name": Name the dish as it’s most commonly known in global food media; it can be the same as local_name.
+- "local_name": Local or native name (can include non-Latin script); if unknown, repeat dish_name.
+- "region": Country and/or notable region/city (e.g. "Italy", "Sichuan, China", "Yucatán, Mexico").
+- "culture_or_ethnicity": The cultural or ethnic group most associated with the dish (e.g. "Turkish", "Punjabi", "Cantonese").
+- "similarity_score": Float 0.0–1.0 for how close it is to the input dish concept. Be critical and evaluate both the differences and similarities.
+- "recipe_search_prompt":
+  - A short, realistic query that should return recipes from a database like Spoonacular.
+  - Use common English transliteration + optional region, e.g. "pad thai", "sicilian arancini", "punjabi chole bhature".
+  - Do NOT include explanations, adjectives like "authentic", or extra description; just the dish search phrase.
+- "coordinates": Latitude and Longitude of the dish's primary region of origin as a list of two floats.
+  
+Behavior:
+- Make them only dishes- not ingredients. If the input is an ingredient, find dishes that primarily feature that ingredient (for example: if the input is "rice", find dishes like "paella" or "risotto" rather than just "rice").
+- Focus ONLY on culturally rooted dishes, not minor ingredient tweaks or brand variants.
+- Prefer dishes with many existing online recipes over obscure or hyper-niche items.
+- Aim for diversity across countries and food cultures.
+- Sort results from highest to lowest similarity_score.
+"""
 
-        try:
+    USER_PROMPT = f"""Given this dish concept:
 
-            with open(self.settings_path, "r") as f:
+    {input_text}
 
-                self.settings = json.load(f)
+    Identify 8–15 cultural or regional variations:
+    - Each variation must be a specific named dish that has real recipes available online.
+    - Dishes should be structurally or culturally similar (similar dish idea and/or similar role in the meal).
 
-        except Exception as e:
+    Return ONLY a JSON list of objects using exactly the schema and field rules defined in the system prompt."""
 
-            self.settings = {}
-            self.warn(e, "Failed to load settings; using empty settings")
+    body = common_settings_instance.get_body()
+    body = common_settings_instance.replace_prompts_in_body_with_custom(
+        body, user=USER_PROMPT, system=SYSTEM_PROMPT
+    )
+    header = common_settings_instance.get_headers()
 
-        self.agent_name = agent_name
+    url = common_settings_instance.get_chat_completion_url()
 
-        try:
+    return url, header, body
 
-            agent_in_list = self.settings["agents"]["available_agents"]
 
-        except Exception as e:
+def reask_attempts() -> int:
 
-            agent_in_list = []
-            self.warn(e, "Failed to get available_agents; using empty list")
+    return int(
+        resilience.get_retry_settings(common_settings_instance.settings)[
+            "reask_attempts"
+        ]
+    )
 
-        if self.agent_name not in agent_in_list:
 
-            self.warn(
-                Exception("Agent not in available_agents"),
-                f"Agent '{self.agent_name}' not found in available_agents",
-            )
+class Diversification:
+    """The re-ask loop of ``iter_diversification`` and
+    ``aiter_diversification`` apart from fetching each reply: the request,
+    the dishes already yielded, and what follows a reply that does not parse
+    or a failed API call.
 
-            raise Exception(f"Agent '{self.agent_name}' not found in available_agents")
+    The ``diversifier_request`` stage runs from the first request until the
+    reply that parses has been read, less the time the caller spends on the
+    dishes yielded meanwhile (``handed_over``)."""
 
-        try:
+    def __init__(self, input_text: str, bypass: bool = False):
 
-            self.env_path = self.root_path / self.settings["env"]["path"]
+        self.url, self.header, self.body = build_request(input_text)
+        self.bypass = bypass
+        self.reasks = reask_attempts()
+        self.seen = set()
+        self.received = []
+        self.started = time.perf_counter()
+        self.handed_over = 0.0
 
-        except Exception as e:
+    def fetch(self, completion):
+        """The reply's chunks from ``llm_cache.iter_completion`` or
+        ``llm_cache.aiter_completion``."""
 
-            self.env_path = self.root_path / "env"
-            self.warn(e, "Failed to set ENV_PATH; assuming path")
+        self.received = []
 
-        self.load_env()
-        self.load_env_available_keys()
+        return completion(
+            self.url,
+            self.header,
+            self.body,
+            settings=common_settings_instance.settings,
+            bypass=self.bypass,
+            agent="diversifier",
+        )
 
-    def replace_prompts_in_body_with_custom(
-        self, body, user: str, system=None, assistant=None
-    ):
+    def chunk(self, chunk: str) -> str:
 
-        if "messages" in body:
+        self.received.append(chunk)
 
-            for message in body["messages"]:
+        return chunk
 
-                if message["role"] == "user" and user is not None:
+    def observe(self):
+        """Record the ``diversifier_request`` stage up to now."""
 
-                    message["content"] = user
+        metrics.observe(
+            "diversifier_request",
+            time.perf_counter() - self.started - self.handed_over,
+        )
 
-                if message["role"] == "system" and system is not None:
+    def failed(self):
 
-                    message["content"] = system
+        metrics.STAGE_FAILURES.inc(stage="diversifier_request")
+        self.observe()
 
-                if message["role"] == "assistant" and assistant is not None:
+    def is_new(self, dish: dict) -> bool:
 
-                    message["content"] = assistant
+        name = str(dish.get("dish_name", "")).casefold()
 
-        return body
+        if name in self.seen:
 
-    def get_headers(self, api_key="use_env", key_name="AI_API_KEY"):
+            return False
 
-        if api_key == "use_env":
+        self.seen.add(name)
 
-            try:
+        return True
 
-                if key_name in self.env_available_keys:
+    def parse_failed(self, e: ValueError):
+        """Ask again with a correction, or raise ``DiversificationFailed``
+        once the re-asks are spent."""
 
-                    pass
+        metrics.LLM_FAILURES.inc(agent="diversifier", reason="parse")
+        llm_cache.discard(self.body, settings=common_settings_instance.settings)
+        text = "".join(self.received)
 
-                else:
+        if self.reasks <= 0:
 
-                    self.warn(
-                        Exception("Key not in available_keys"),
-                        f"Key '{key_name}' not found in available_keys; will use first available key",
-                    )
+            common_settings_instance.warn(e, f"Unparseable reply {quote(text)}")
+            self.failed()
+            raise DiversificationFailed(f"Unparseable reply: {e}")
 
-                    key_name = self.env_available_keys[0]
+        self.reasks -= 1
+        metrics.LLM_RETRIES.inc(agent="diversifier", reason="parse")
+        common_settings_instance.warn(
+            e, f"Unparseable reply {quote(text)}; asking again"
+        )
+        self.body = resilience.reask_body(self.body, e, text)
 
-            except Exception as e:
+    def refused(self, e: transport.CompletionFailed) -> DiversificationFailed:
 
-                self.warn(
-                    e,
-                    "Failed to check if key_name is in env_available_keys; assuming not in list",
-                )
+        metrics.LLM_FAILURES.inc(agent="diversifier", reason=e.status_code)
+        common_settings_instance.warn(e, f"Response: {e.text}")
+        self.failed()
 
-            try:
+        return DiversificationFailed(str(e))
 
-                api_key = self.env.get(f"{key_name}")
+    def transport_failed(self, e: Exception) -> DiversificationFailed:
 
-            except Exception as e:
-                api_key = ""
-                self.warn(
-                    e,
-                    f"Failed to get API key from env for key_name '{key_name}'; using empty string",
-                )
+        metrics.LLM_FAILURES.inc(agent="diversifier", reason=type(e).__name__)
+        common_settings_instance.warn(e, "API request failed")
+        self.failed()
 
-        try:
+        return DiversificationFailed(str(e))
 
-            self.default_headers = self.settings["ai_api"]["default_headers"]
 
-        except Exception as e:
+def iter_reply(diversification: Diversification):
+    """Yield the dishes of one reply."""
 
-            self.default_headers = {}
-            self.warn(e, "Failed to get default_headers; using empty dict")
+    chunks = (
+        diversification.chunk(chunk)
+        for chunk in diversification.fetch(llm_cache.iter_completion)
+    )
 
-        headers = self.default_headers.copy()
+    if diversification.body.get("stream"):
 
-        for header_key, header_value in headers.items():
+        yield from iter_json_list(chunks)
 
-            if "{AI_API_KEY}" in header_value:
+    else:
 
-                headers[header_key] = header_value.replace("{AI_API_KEY}", api_key)
+        yield from iter_json_items("".join(chunks))
 
-        return headers
 
-    def load_env_available_keys(self):
+def iter_diversification(input_text: str, bypass: bool = False):
+    """Yield each diversified dish as soon as it has been parsed.
 
-        try:
+    With ``"stream": true`` in the agent body, dishes are parsed out of the
+    server-sent-event stream while the model is still generating; otherwise
+    the full completion is parsed once it arrives. A reply that does not
+    parse is asked for again (``retry.reask_attempts`` times) without
+    yielding a dish twice; after that, or once the API call has failed its
+    retries, ``DiversificationFailed`` is raised. ``bypass`` skips the
+    response cache.
+    """
 
-            self.env_available_keys = self.settings["env"]["available_keys"]
+    diversification = Diversification(input_text, bypass)
 
-        except Exception as e:
+    try:
 
-            self.env_available_keys = []
-            self.warn(e, "Failed to get available_keys; using empty list")
+        while True:
 
-    def load_env(self):
+            try:
 
-        import os
+                for dish in iter_reply(diversification):
 
-        try:
+                    if diversification.is_new(dish):
 
-            from dotenv import load_dotenv
+                        paused = time.perf_counter()
+                        yield dish
+                        diversification.handed_over += time.perf_counter() - paused
 
-        except Exception as e:
+                diversification.observe()
+                return
 
-            self.warn(
-                e,
-                "Failed to load .env file(You may not have dotenv installed) | Do it by 'pip install python-dotenv'",
-            )
+            except ValueError as e:
 
-        try:
+                diversification.parse_failed(e)
 
-            load_dotenv(self.env_path)
+    except transport.CompletionFailed as e:
 
-        except Exception as e:
+        raise diversification.refused(e)
 
-            self.warn(e, "Failed to load .env file from ENV_PATH; skipping")
+    except requests.RequestException as e:
 
-        self.env = os.environ
+        raise diversification.transport_failed(e)
 
-    def get_body(self):
 
-        self.default_body = self.settings["ai_api"]["body"]["default"]
-        self.specific = self.settings["ai_api"]["body"]["specific"][self.agent_name]
-        self.body = self.default_body.copy()
-        self.specific_body = self.specific["raw"]
-        self.specific_roles = self.specific.get("roles", {})
+def process_diversification(input_text: str) -> list:
 
-        for key, value in self.specific_body.items():
+    try:
 
-            self.body[key] = value
+        return list(iter_diversification(input_text))
 
-        already_present_roles = []
+    except DiversificationFailed:
 
-        for message in self.body["messages"]:
+        return []
 
-            already_present_roles.append(message["role"])
 
-        for message in self.specific_roles:
+async def aiter_reply(diversification: Diversification):
+    """Async form of ``iter_reply``."""
 
-            if message not in already_present_roles:
+    chunks = (
+        diversification.chunk(chunk)
+        async for chunk in diversification.fetch(llm_cache.aiter_completion)
+    )
 
-                self.body["messages"].append({"role": message, "content": ""})
+    if diversification.body.get("stream"):
 
-        return self.body
+        async for dish in aiter_json_list(chunks):
 
-    def warn(self, e: Exception, extra: str = ""):
+            yield dish
 
-        print(f"| FROM {self.module_name} | WARNING: {e} | {extra}")
+    else:
 
-    def get_chat_completion_url(self):
+        text = "".join([chunk async for chunk in chunks])
 
-        try:
+        for dish in iter_json_items(text):
 
-            url = (
-                self.settings["ai_api"]["urls"]["base_api_url"]
-                + self.settings["ai_api"]["urls"]["chat_completion_endpoint"]
-            )
+            yield dish
 
-        except Exception as e:
 
-            self.warn(e, "Failed to get chat_completion_url; returning empty string")
-            url = ""
+async def aiter_diversification(input_text: str, bypass: bool = False):
+    """Async form of ``iter_diversification``."""
 
-        return url
+    import httpx
 
+    diversification = Diversification(input_text, bypass)
 
-common_settings_instance = common_settings(agent_name="diversifier")
+    try:
 
+        while True:
 
-def process_diversification(input_text: str) -> str:
+            try:
 
-    SYSTEM_PROMPT = """You are a culinary anthropologist who finds cultural and regional variations of a given dish concept.
+                async for dish in aiter_reply(diversification):
 
-Goal:
-- Return dishes from different regions, countries, or ethnic communities that are structurally or culturally similar.
-- Each result must correspond to a concrete, cookable dish that has actual recipes available online (not vague concepts).
+                    if diversification.is_new(dish):
 
-Output format (important):
-- Return ONLY valid JSON (no extra text, no markdown).
-- JSON must be a list of objects with exactly these keys:
+                        paused = time.perf_counter()
+                        yield dish
+                        diversification.handed_over += time.perf_counter() - paused
 
-[
-  {
-    "dish_name": "Pad Thai",
-    "local_name": "ผัดไทย",
-    "region": "Thailand",
-    "culture_or_ethnicity": "Thai",
-    "similarity_score": 0.92,
-    "recipe_search_prompt": "pad thai",
-    "coordinates": [12.9716, 100.5018] # Latitude and Longitude of the dish's region
-  }
-]
+                diversification.observe()
+                return
 
-Field rules:
-- "dish_name": Name the dish as it’s most commonly known in global food media; it can be the same as local_name.
-- "local_name": Local or native name (can include non-Latin script); if unknown, repeat dish_name.
-- "region": Country and/or notable region/city (e.g. "Italy", "Sichuan, China", "Yucatán, Mexico").
-- "culture_or_ethnicity": The cultural or ethnic group most associated with the dish (e.g. "Turkish", "Punjabi", "Cantonese").
-- "similarity_score": Float 0.0–1.0 for how close it is to the input dish concept. Be critical and evaluate both the differences and similarities.
-- "recipe_search_prompt":
-  - A short, realistic query that should return recipes from a database like Spoonacular.
-  - Use common English transliteration + optional region, e.g. "pad thai", "sicilian arancini", "punjabi chole bhature".
-  - Do NOT include explanations, adjectives like "authentic", or extra description; just the dish search phrase.
-- "coordinates": Latitude and Longitude of the dish's primary region of origin as a list of two floats.
-  
-Behavior:
-- Make them only dishes- not ingredients. If the input is an ingredient, find dishes that primarily feature that ingredient (for example: if the input is "rice", find dishes like "paella" or "risotto" rather than just "rice").
-- Focus ONLY on culturally rooted dishes, not minor ingredient tweaks or brand variants.
-- Prefer dishes with many existing online recipes over obscure or hyper-niche items.
-- Aim for diversity across countries and food cultures.
-- Sort results from highest to lowest similarity_score.
-"""
+            except ValueError as e:
 
-    USER_PROMPT = f"""Given this dish concept:
+                diversification.parse_failed(e)
 
-    {input_text}
+    except transport.CompletionFailed as e:
 
-    Identify 8–15 cultural or regional variations:
-    - Each variation must be a specific named dish that has real recipes available online.
-    - Dishes should be structurally or culturally similar (similar dish idea and/or similar role in the meal).
+        raise diversification.refused(e)
 
-    Return ONLY a JSON list of objects using exactly the schema and field rules defined in the system prompt."""
+    except httpx.HTTPError as e:
 
-    body = common_settings_instance.get_body()
-    body = common_settings_instance.replace_prompts_in_body_with_custom(
-        body, user=USER_PROMPT, system=SYSTEM_PROMPT
-    )
-    header = common_settings_instance.get_headers()
+        raise diversification.transport_failed(e)
 
-    url = common_settings_instance.get_chat_completion_url()
 
-    import requests
+async def aprocess_diversification(input_text: str) -> list:
 
-    response = requests.post(url, headers=header, json=body)
+    try:
 
-    if response.status_code == 200:
+        return [dish async for dish in aiter_diversification(input_text)]
 
-        return json.loads(response.json()["choices"][0]["message"]["content"].replace("`json", "").replace('\n', '').replace('`', ''))
-    else:
+    except DiversificationFailed:
 
-        common_settings_instance.warn(
-            Exception(f"API request failed with status code {response.status_code}"),
-            f"Response: {response.text}",
-        )
-        return ""
+        return []
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import json
+import re
+import time
+
+from agents.streaming import repair_json
+from telemetry import metrics
+
+# strict=False lets strings hold raw newlines and tabs, as models write them.
+DECODER = json.JSONDecoder(strict=False)
+
+# A fence opens a line: models escape the newlines inside JSON strings.
+OPENING_FENCE = re.compile(r"(?:^|\n)[ \t]*```[\w-]*")
+PAYLOAD_START = re.compile(r"[\[{]")
+STRUCTURE = re.compile(r'["\[\]{}]')
+STRING_SPECIAL = re.compile(r'["\\]')
+WHITESPACE = re.compile(r"\s*")
+
+MISSING = object()
+
+
+def payload_start(text: str):
+    """Index of the ``[``/``{`` that opens the reply's JSON, or ``None``.
+
+    That is the first bracket, unless prose comes before it and a code fence
+    follows; then it is the first bracket inside the fence, so brackets in
+    the prose are passed over.
+    """
+
+    first = PAYLOAD_START.search(text)
+
+    if first is None:
+
+        return None
+
+    if text[: first.start()].strip():
+
+        fence = OPENING_FENCE.search(text)
+        inside = fence and PAYLOAD_START.search(text, fence.end())
+
+        if inside:
+
+            return inside.start()
+
+    return first.start()
+
+
+def string_end(text: str, pos: int):
+    """Index just past the string whose body starts at ``pos``, or ``None``
+    if the text ends inside it."""
+
+    while True:
+
+        match = STRING_SPECIAL.search(text, pos)
+
+        if match is None:
+
+            return None
+
+        if match.group() == '"':
+
+            return match.end()
+
+        # A backslash: skip the character it escapes.
+        pos = match.end() + 1
+
+
+def value_end(text: str, pos: int):
+    """Index just past the array or object opening at ``pos``, or ``None``
+    if the text ends first."""
+
+    depth = 0
+    match = STRUCTURE.search(text, pos)
+
+    while match is not None:
+
+        char = match.group()
+        pos = match.end()
+
+        if char == '"':
+
+            pos = string_end(text, pos)
+
+            if pos is None:
+
+                return None
+
+        elif char in "[{":
+
+            depth += 1
+
+        else:
+
+            depth -= 1
+
+            if depth == 0:
+
+                return pos
+
+        match = STRUCTURE.search(text, pos)
+
+    return None
+
+
+def decode_at(text: str, pos: int) -> tuple:
+    """``(value, end)`` of the JSON value at ``pos``; an array or object that
+    does not decode as it is gets ``repair_json``. Raises ``ValueError``."""
+
+    try:
+
+        return DECODER.raw_decode(text, pos)
+
+    except ValueError:
+
+        end = value_end(text, pos) if text[pos] in "[{" else None
+
+        if end is None:
+
+            raise
+
+        return json.loads(repair_json(text[pos:end]), strict=False), end
+
+
+def salvage_list(text: str, start: int):
+    """Yield the elements of the array at ``start`` one by one, up to the
+    first that is cut off or broken, which raises ``ValueError``."""
+
+    count = 0
+    pos = WHITESPACE.match(text, start + 1).end()
+
+    while True:
+
+        if pos >= len(text):
+
+            raise ValueError(
+                f"The reply ended inside the JSON list, after {count} elements"
+            )
+
+        char = text[pos]
+
+        if char == "]":
+
+            return
+
+        if char == ",":
+
+            pos = WHITESPACE.match(text, pos + 1).end()
+            continue
+
+        try:
+
+            value, pos = decode_at(text, pos)
+
+        except ValueError as e:
+
+            raise ValueError(
+                f"Unparseable element {count} of the JSON list: {e}"
+            ) from None
+
+        count += 1
+        yield value
+        pos = WHITESPACE.match(text, pos).end()
+
+
+def iter_items(text: str):
+
+    start = payload_start(text)
+
+    if start is None:
+
+        raise ValueError("No JSON in the reply")
+
+    try:
+
+        value, _ = DECODER.raw_decode(text, start)
+
+    except ValueError:
+
+        if text[start] == "{":
+
+            value, _ = decode_at(text, start)
+
+        else:
+
+            yield from salvage_list(text, start)
+            return
+
+    if isinstance(value, list):
+
+        yield from value
+
+    else:
+
+        yield value
+
+
+def iter_json_items(text: str):
+    """Yield each element of the JSON array in a model's whole reply.
+
+    The reply is scanned once, in place: code fences and prose around the
+    JSON are skipped, strings keep their newlines and backticks, and a
+    single object counts as a one-element array. If the array is cut off or
+    an element is broken beyond ``repair_json``, every element before it is
+    still yielded before ``ValueError`` is raised, so the caller can ask
+    again for only the rest. The time spent is recorded as the
+    ``json_parse`` stage.
+    """
+
+    items = iter_items(text)
+    parse_seconds = 0.0
+
+    try:
+
+        while True:
+
+            started = time.perf_counter()
+
+            try:
+
+                item = next(items, MISSING)
+
+            finally:
+
+                parse_seconds += time.perf_counter() - started
+
+            if item is MISSING:
+
+                return
+
+            yield item
+
+    except ValueError:
+
+        metrics.STAGE_FAILURES.inc(stage="json_parse")
+        raise
+
+    finally:
+
+        metrics.observe("json_parse", parse_seconds)
+
+
+def parse_reply(text: str):
+    """The JSON value in a model's whole reply, with fences and prose around
+    it ignored. Raises ``ValueError`` if there is none or it is cut off."""
+
+    start = payload_start(text)
+
+    if start is None:
+
+        raise ValueError("No JSON in the reply")
+
+    return decode_at(text, start)[0]
@@ -1,417 +1,761 @@
+import asyncio
 import json
 from pathlib import Path
+import threading
 import time
 
+import requests
+
+from agents import cache as llm_cache
+from agents import batching, config, resilience, transport
+from agents.budget import budget, get_budget_settings
+from agents.router import router
+from agents.scheduler import BatchScheduler, make_batches
+from agents.parsing import iter_json_items
+from agents.streaming import aiter_json_list, iter_json_list
+from telemetry import metrics, quote
+
 ROOT_PATH = Path(__file__).parent.parent.parent
-SETTING_PATH = ROOT_PATH / "agents" / "common_settings.json"
 EXAMPLE_PATH = ROOT_PATH / "agents" / "examples"
 EXAMPLE_OUTPUT_PATH = EXAMPLE_PATH / "recipes_output.json"
 
+common_settings_instance = config.AgentSettings("recipes", log=False)
+
+SYSTEM_PROMPT = """You are a recipe retrieval and structuring assistant.
+The user sends a JSON list of dishes, each with a dish_name, a local_name and a
+recipe_search_prompt (a query against a recipe database like Spoonacular).
+Return a JSON list with ONE structured recipe per input item, in input order.
+
+Rules:
+- Use the given dish/local name as the identity of the dish.
+- Use the best-matching recipe for the search prompt; do NOT invent obviously fake ingredients.
+- Be concise and practical: focus on what a cook needs (ingredients, equipment, steps, time).
+- Normalize ingredient quantities and units; estimate total_time_minutes if only prep/cook times are given.
+- image_url: a direct, reachable URL of an image of the actual dish. source_url: the canonical recipe URL, else "".
+- Return ONLY valid JSON (no extra text, no markdown).
+
+Item schema (# comments are not part of the output):
+{"matched_recipe_title": string, "summary": string, "servings": int, "total_time_minutes": int,
+"materials": {"ingredients": [{"name": string, "quantity": string, "unit": string, "notes": string}], "equipment": [string]},
+"steps": [string], "image_url": string, "source_url": string, "source": string}
+# quantity e.g. "2", "1/2", "to taste"; unit e.g. "tbsp", "g", "" if none; notes: prep notes or "";
+# equipment e.g. "wok"; steps in order; source e.g. "spoonacular"."""
 
-class common_settings:
+_scheduler = None
+_scheduler_lock = threading.Lock()
 
-    def __init__(self, agent_name: str, log: bool = False):
 
-        import json
-        from pathlib import Path
+def max_concurrency() -> int:
 
-        self.debug = log
+    try:
 
-        self.module_name = self.__class__.__name__
+        return int(common_settings_instance.settings["scheduler"]["max_concurrency"])
 
-        try:
+    except Exception as e:
 
-            self.root_path = ROOT_PATH
+        common_settings_instance.warn(
+            e, "Failed to get scheduler.max_concurrency; using 4"
+        )
+        return 4
 
-        except Exception as e:
 
-            self.root_path = Path(__file__).parent.parent.parent
-            self.warn(e, "Failed to set ROOT_PATH; assuming path")
+def get_scheduler() -> BatchScheduler:
+    """The shared batch pool, sized from ``scheduler.max_concurrency`` on
+    first use (a later change to the setting needs a restart)."""
 
-        try:
+    global _scheduler
 
-            self.settings_path = SETTING_PATH
+    with _scheduler_lock:
 
-        except Exception as e:
+        if _scheduler is None:
 
-            self.settings_path = (
-                Path(__file__).parent.parent.parent / "agents" / "common_settings.json"
+            _scheduler = BatchScheduler(
+                max_concurrency=max_concurrency(), name="recipes-batch"
             )
-            self.warn(e, "Failed to set SETTING_PATH; assuming path")
 
-        try:
+    return _scheduler
 
-            with open(self.settings_path, "r") as f:
 
-                self.settings = json.load(f)
+def build_batch_request(input_data: list):
+    """Return the ``(url, headers, body)`` of the request for one batch."""
 
-        except Exception as e:
+    list_of_inputs = []
 
-            self.settings = {}
-            self.warn(e, "Failed to load settings; using empty settings")
+    for i in input_data:
 
-        self.agent_name = agent_name
+        dish_name = i.get("dish_name", "")
+        local_name = i.get("local_name", "")
+        recipe_search_prompt = i.get("recipe_search_prompt", "")
 
-        try:
+        list_of_inputs.append(
+            {
+                "dish_name": dish_name,
+                "local_name": local_name,
+                "recipe_search_prompt": recipe_search_prompt,
+            }
+        )
 
-            agent_in_list = self.settings["agents"]["available_agents"]
+    # The instructions live in the system prompt, identical for every batch;
+    # the user message is only the batch's dishes.
+    input_into = json.dumps(list_of_inputs, ensure_ascii=False, separators=(",", ":"))
 
-        except Exception as e:
+    common_settings_instance.log(f"Input JSON for API(length): {len(input_into)}")
 
-            agent_in_list = []
-            self.warn(e, "Failed to get available_agents; using empty list")
+    body = common_settings_instance.get_body()
+    body = common_settings_instance.replace_prompts_in_body_with_custom(
+        body, user=input_into, system=SYSTEM_PROMPT
+    )
+    max_tokens = budget.max_tokens(
+        len(input_data), common_settings_instance.settings, body.get("max_tokens")
+    )
 
-        if self.agent_name not in agent_in_list:
+    if max_tokens:
 
-            self.warn(
-                Exception("Agent not in available_agents"),
-                f"Agent '{self.agent_name}' not found in available_agents",
-            )
+        body["max_tokens"] = max_tokens
+
+    header = common_settings_instance.get_headers()
+
+    url = common_settings_instance.get_chat_completion_url()
+
+    return url, header, body
 
-            raise Exception(f"Agent '{self.agent_name}' not found in available_agents")
 
-        try:
+def reask_attempts() -> int:
 
-            self.env_path = self.root_path / self.settings["env"]["path"]
+    return int(
+        resilience.get_retry_settings(common_settings_instance.settings)[
+            "reask_attempts"
+        ]
+    )
+
+
+def planned_model() -> str:
+    """The model the next recipes request is expected to go to."""
+
+    settings = common_settings_instance.settings
+    candidates = router.candidates("recipes", settings)
+
+    if candidates:
+
+        return candidates[0]
 
-        except Exception as e:
+    return common_settings_instance.config.body_template("recipes").get("model", "")
 
-            self.env_path = self.root_path / "env"
-            self.warn(e, "Failed to set ENV_PATH; assuming path")
 
-        self.load_env()
-        self.load_env_available_keys()
+def record_batch(planned, size, started, received_at, served, failed):
+    """Add one request to the batch tuner's samples, for the model that
+    answered it (``planned`` if none did), unless the cache answered."""
+
+    if served.get("cached"):
+
+        return
+
+    elapsed = time.perf_counter() - started
+    first_chunk_s = received_at[0] - started if received_at else elapsed
+
+    batching.get_tuner(common_settings_instance.settings).record(
+        served.get("model") or planned,
+        size,
+        elapsed,
+        first_chunk_s,
+        failed,
+        common_settings_instance.settings,
+    )
 
-    def replace_prompts_in_body_with_custom(
-        self, body, user: str, system=None, assistant=None
+
+class BatchRequest:
+    """One request for a recipes batch and everything around it except the
+    fetch itself, which ``iter_batch`` and ``aiter_batch`` make in their own
+    way: labelling each recipe with its dish, recording the budget and batch
+    tuner samples, and deciding what to ask for again after a reply that
+    does not parse."""
+
+    def __init__(
+        self,
+        input_data: list,
+        reasks: int = None,
+        parse_error=None,
+        previous_text: str = "",
+        bypass: bool = False,
     ):
 
-        if "messages" in body:
+        self.input_data = input_data
+        self.bypass = bypass
+        self.reasks = reask_attempts() if reasks is None else reasks
+        self.url, self.header, self.body = build_batch_request(input_data)
+
+        if parse_error is not None:
+
+            self.body = resilience.reask_body(self.body, parse_error, previous_text)
+
+        self.streaming = bool(self.body.get("stream"))
+        self.received = []
+        self.received_at = []
+        self.served = {}
+        self.count = 0
+        self.model = planned_model()
+        self.started = time.perf_counter()
+
+    def fetch(self, completion):
+        """The reply's chunks from ``llm_cache.iter_completion`` or
+        ``llm_cache.aiter_completion``."""
+
+        return completion(
+            self.url,
+            self.header,
+            self.body,
+            settings=common_settings_instance.settings,
+            bypass=self.bypass,
+            agent="recipes",
+            info=self.served,
+        )
 
-            for message in body["messages"]:
+    def chunk(self, chunk: str) -> str:
 
-                if message["role"] == "user" and user is not None:
+        self.received_at.append(time.perf_counter())
+        self.received.append(chunk)
 
-                    message["content"] = user
+        return chunk
 
-                if message["role"] == "system" and system is not None:
+    @property
+    def answered(self) -> bool:
 
-                    message["content"] = system
+        return self.count >= len(self.input_data)
 
-                if message["role"] == "assistant" and assistant is not None:
+    def label(self, recipe: dict) -> dict:
+        """``recipe`` with the fields of the dish it answers laid over it."""
 
-                    message["content"] = assistant
+        if not isinstance(recipe, dict):
 
-        return body
+            raise ValueError(f"Expected a recipe object, got {type(recipe).__name__}")
 
-    def get_headers(self, api_key="use_env", key_name="AI_API_KEY"):
+        for key, value in self.input_data[self.count].items():
 
-        if api_key == "use_env":
+            recipe[key] = value
 
-            try:
+        self.count += 1
 
-                if key_name in self.env_available_keys:
+        return recipe
 
-                    pass
+    def succeeded(self):
 
-                else:
+        budget.record(
+            "recipes",
+            self.body,
+            self.count,
+            self.received,
+            self.received_at,
+            common_settings_instance.settings,
+        )
+        record_batch(
+            self.model,
+            len(self.input_data),
+            self.started,
+            self.received_at,
+            self.served,
+            False,
+        )
+        common_settings_instance.log(f"Received {self.count} results from API")
 
-                    self.warn(
-                        Exception("Key not in available_keys"),
-                        f"Key '{key_name}' not found in available_keys; will use first available key",
-                    )
+    def refused(self, e: transport.CompletionFailed):
 
-                    key_name = self.env_available_keys[0]
+        metrics.LLM_FAILURES.inc(agent="recipes", reason=e.status_code)
+        common_settings_instance.warn(e, f"Response: {e.text}")
 
-            except Exception as e:
+    def transport_failed(self, e: Exception):
 
-                self.warn(
-                    e,
-                    "Failed to check if key_name is in env_available_keys; assuming not in list",
-                )
+        metrics.LLM_FAILURES.inc(agent="recipes", reason=type(e).__name__)
+
+    def parse_failed(self, e: ValueError):
+        """Record a reply that stopped parsing; return the ``(input_data,
+        reasks, parse_error, previous_text, bypass)`` to ask again with, or
+        ``None``."""
+
+        metrics.LLM_FAILURES.inc(agent="recipes", reason="parse")
+        record_batch(
+            self.model,
+            len(self.input_data),
+            self.started,
+            self.received_at,
+            self.served,
+            True,
+        )
+        llm_cache.discard(self.body, settings=common_settings_instance.settings)
+
+        reply = quote("".join(self.received))
+        remaining = self.input_data[self.count :]
+
+        if not remaining:
+
+            return None
+
+        if self.reasks <= 0:
+
+            common_settings_instance.warn(
+                e, f"Unparseable reply {reply}; dropping {len(remaining)} dishes"
+            )
+            return None
+
+        metrics.LLM_RETRIES.inc(agent="recipes", reason="parse")
+        common_settings_instance.warn(
+            e, f"Unparseable reply {reply}; asking again for {len(remaining)} dishes"
+        )
+
+        return remaining, self.reasks - 1, e, "".join(self.received), self.bypass
+
+
+def iter_batch(
+    input_data: list,
+    reasks: int = None,
+    parse_error=None,
+    previous_text: str = "",
+    bypass: bool = False,
+):
+    """Yield the structured recipe for each dish of one batch.
+
+    With ``"stream": true`` in the agent body, recipes are yielded while the
+    model is still generating the rest of the batch. If the reply stops
+    parsing, the dishes it has not answered yet are asked for again, up to
+    ``retry.reask_attempts`` times, following ``previous_text``, the reply that
+    failed, with a correction quoting ``parse_error``. ``bypass`` skips the
+    response cache.
+    """
+
+    batch = BatchRequest(input_data, reasks, parse_error, previous_text, bypass)
+
+    try:
+
+        chunks = (
+            batch.chunk(chunk) for chunk in batch.fetch(llm_cache.iter_completion)
+        )
+
+        if batch.streaming:
+
+            recipes = iter_json_list(chunks)
+
+        else:
+
+            recipes = iter_json_items("".join(chunks))
+
+        for recipe in recipes:
+
+            if batch.answered:
+
+                break
+
+            yield batch.label(recipe)
+
+        batch.succeeded()
+
+    except transport.CompletionFailed as e:
+
+        batch.refused(e)
+
+    except requests.RequestException as e:
+
+        batch.transport_failed(e)
+        raise
+
+    except ValueError as e:
+
+        again = batch.parse_failed(e)
+
+        if again is not None:
+
+            yield from iter_batch(*again)
+
+
+def split_stored(dishes: list, lookup=None):
+    """Split ``dishes`` into ``(index, recipe)`` pairs for those ``lookup``
+    finds a stored recipe for, and ``(index, dish)`` pairs still to fetch."""
+
+    stored = []
+    pending = []
+
+    for index, dish in enumerate(dishes):
+
+        recipe = None
+
+        if lookup is not None:
 
             try:
 
-                api_key = self.env.get(f"{key_name}")
+                recipe = lookup(dish)
 
             except Exception as e:
-                api_key = ""
-                self.warn(
-                    e,
-                    f"Failed to get API key from env for key_name '{key_name}'; using empty string",
+
+                common_settings_instance.warn(
+                    e, f"Recipe lookup failed for '{dish.get('dish_name', '')}'"
                 )
 
-        try:
+        if recipe is None:
+
+            pending.append((index, dish))
+            continue
+
+        recipe = dict(recipe)
 
-            self.default_headers = self.settings["ai_api"]["default_headers"]
+        for key, value in dish.items():
 
-        except Exception as e:
+            recipe[key] = value
 
-            self.default_headers = {}
-            self.warn(e, "Failed to get default_headers; using empty dict")
+        stored.append((index, recipe))
 
-        headers = self.default_headers.copy()
+    return stored, pending
 
-        for header_key, header_value in headers.items():
 
-            if "{AI_API_KEY}" in header_value:
+def batch_size(at_a_time, pending: int) -> int:
+    """``at_a_time``, or if it is ``None`` the size the batch tuner expects
+    to fetch ``pending`` dishes fastest in, no larger than the token budget
+    allows (the budget alone decides until the tuner has samples)."""
 
-                headers[header_key] = header_value.replace("{AI_API_KEY}", api_key)
+    if at_a_time is not None:
 
-        return headers
+        return at_a_time
 
-    def load_env_available_keys(self):
+    settings = common_settings_instance.settings
+    budget_settings = get_budget_settings(settings)
+    size = batching.get_tuner(settings).choose(
+        planned_model(),
+        pending,
+        max_concurrency(),
+        int(budget_settings["min_batch"]),
+        budget.batch_size("recipes", 0, settings),
+        settings,
+    )
 
-        try:
+    if size is None:
 
-            self.env_available_keys = self.settings["env"]["available_keys"]
+        size = budget.batch_size("recipes", pending, settings)
 
-        except Exception as e:
+    common_settings_instance.log(f"Sending {size} dishes per request")
 
-            self.env_available_keys = []
-            self.warn(e, "Failed to get available_keys; using empty list")
+    return size
 
-    def load_env(self):
 
-        import os
+def batch_logger(timings=None):
+    """Return an ``on_done(batch_index, timing)`` callback that logs each
+    finished batch, records it as a ``recipes_batch`` span and appends its
+    timing to ``timings``."""
 
-        try:
+    def batch_done(batch_index, timing):
 
-            from dotenv import load_dotenv
+        metrics.observe("recipes_batch", timing["elapsed_s"])
 
-        except Exception as e:
+        if timing["error"] is not None:
 
-            self.warn(
-                e,
-                "Failed to load .env file(You may not have dotenv installed) | Do it by 'pip install python-dotenv'",
+            metrics.STAGE_FAILURES.inc(stage="recipes_batch")
+            common_settings_instance.warn(
+                Exception(timing["error"]), f"Batch {batch_index} failed"
             )
 
-        try:
+        common_settings_instance.log(
+            f"Batch {batch_index} ({timing['size']} items) took {timing['elapsed_s']:.2f}s"
+        )
 
-            load_dotenv(self.env_path)
+        if timings is not None:
 
-        except Exception as e:
+            timings.append(timing)
 
-            self.warn(e, "Failed to load .env file from ENV_PATH; skipping")
+    return batch_done
 
-        self.env = os.environ
 
-    def get_body(self):
+def iter_process_list(
+    input_data: list,
+    at_a_time=None,
+    max_num=10,
+    timings=None,
+    lookup=None,
+    bypass: bool = False,
+):
+    """Fetch recipes for the ``max_num`` most similar dishes, yielding
+    ``(index, recipe)`` pairs as soon as each recipe is parsed.
 
-        self.default_body = self.settings["ai_api"]["body"]["default"]
-        self.specific = self.settings["ai_api"]["body"]["specific"][self.agent_name]
-        self.body = self.default_body.copy()
-        self.specific_body = self.specific["raw"]
-        self.specific_roles = self.specific.get("roles", {})
+    If ``lookup`` is given it is called with each dish first; a stored recipe
+    it returns is yielded straight away (with the dish's fields laid over it)
+    and the dish is not sent to the API. The remaining dishes are split into
+    batches of ``at_a_time`` (by default, the size ``batch_size`` expects to
+    fetch them all fastest in) and every batch is sent at once on the shared
+    scheduler pool. ``index`` is the dish's position in similarity order, so
+    callers can restore that order. If a ``timings`` list is given, one timing
+    dict per batch is appended to it as batches finish. ``bypass`` skips the
+    response cache.
+    """
 
-        for key, value in self.specific_body.items():
+    t0 = time.perf_counter()
 
-            self.body[key] = value
+    if not input_data:
 
-        already_present_roles = []
+        return
 
-        for message in self.body["messages"]:
+    input_data.sort(reverse=True, key=lambda x: x.get("similarity_score", 0))
 
-            already_present_roles.append(message["role"])
+    common_settings_instance.log(f"Running process_list on {len(input_data)} items")
 
-        for message in self.specific_roles:
+    stored, pending = split_stored(input_data[:max_num], lookup)
+    total = len(stored)
 
-            if message not in already_present_roles:
+    yield from stored
 
-                self.body["messages"].append({"role": message, "content": ""})
+    common_settings_instance.log(
+        f"Reused {total} stored recipes; requesting {len(pending)} from the API"
+    )
 
-        return self.body
+    batches = make_batches(
+        pending, at_a_time=batch_size(at_a_time, len(pending)), max_num=len(pending)
+    )
 
-    def warn(self, e: Exception, extra: str = ""):
+    def run_batch(batch):
 
-        print(f"| FROM {self.module_name} | WARNING: {e} | {extra}")
+        return iter_batch([dish for _, dish in batch], bypass=bypass)
 
-    def get_chat_completion_url(self):
+    for batch_index, offset, recipe in get_scheduler().iter_items(
+        batches, run_batch, on_done=batch_logger(timings)
+    ):
 
-        try:
+        total += 1
+        yield batches[batch_index][offset][0], recipe
 
-            url = (
-                self.settings["ai_api"]["urls"]["base_api_url"]
-                + self.settings["ai_api"]["urls"]["chat_completion_endpoint"]
-            )
+    common_settings_instance.log(f"process_list completed with {total} total results")
 
-        except Exception as e:
+    elapsed = time.perf_counter() - t0
+    common_settings_instance.log(f"Elapsed time for process_list: {elapsed:.2f}")
 
-            self.warn(e, "Failed to get chat_completion_url; returning empty string")
-            url = ""
 
-        return url
+def process_list(
+    input_data: list,
+    at_a_time=None,
+    max_num=10,
+    timings=None,
+    lookup=None,
+    bypass: bool = False,
+) -> list:
+    """Blocking form of ``iter_process_list``; returns recipes in similarity order."""
+
+    results = sorted(
+        iter_process_list(
+            input_data,
+            at_a_time=at_a_time,
+            max_num=max_num,
+            timings=timings,
+            lookup=lookup,
+            bypass=bypass,
+        ),
+        key=lambda pair: pair[0],
+    )
 
-    def log(self, message: str):
+    if timings is not None:
 
-        if self.log:
+        timings.sort(key=lambda timing: timing["batch"])
 
-            print(f"| FROM {self.module_name} | LOG: {message}")
+    return [recipe for _, recipe in results]
 
 
-common_settings_instance = common_settings(agent_name="recipes", log=False)
+async def _aiter(items):
 
+    if hasattr(items, "__aiter__"):
 
-def process_list(input_data: list, at_a_time=5, max_num=10) -> str:
+        async for item in items:
 
-    t0 = time.perf_counter()
+            yield item
 
-    recursion_needed = False
-    input_data.sort(reverse=True, key=lambda x: x.get("similarity_score", 0))
+    else:
 
-    common_settings_instance.log(f"Running process_list on {len(input_data)} items")
+        for item in items:
 
-    if len(input_data) > at_a_time:
+            yield item
 
-        recursion_needed = True
-        recursion_list = input_data[at_a_time:max_num]
 
-    input_data = input_data[:at_a_time]
+async def aiter_batch(
+    input_data: list,
+    reasks: int = None,
+    parse_error=None,
+    previous_text: str = "",
+    bypass: bool = False,
+):
+    """Async form of ``iter_batch``."""
 
-    results = []
-    list_of_inputs = []
+    import httpx
 
-    for i in input_data:
+    batch = BatchRequest(input_data, reasks, parse_error, previous_text, bypass)
 
-        dish_name = i.get("dish_name", "")
-        local_name = i.get("local_name", "")
-        recipe_search_prompt = i.get("recipe_search_prompt", "")
+    try:
 
-        list_of_inputs.append(
-            {
-                "dish_name": dish_name,
-                "local_name": local_name,
-                "recipe_search_prompt": recipe_search_prompt,
-            }
+        chunks = (
+            batch.chunk(chunk)
+            async for chunk in batch.fetch(llm_cache.aiter_completion)
         )
 
-    input_into = json.dumps(list_of_inputs)
+        if batch.streaming:
 
-    common_settings_instance.log(f"Input JSON for API(length): {len(input_into)}")
-    SYSTEM_PROMPT = """You are a recipe retrieval and structuring assistant.
-Given a dish name, local name, and a recipe search prompt (used against a database like Spoonacular),
-you return a clean, structured recipe object.
+            recipes = aiter_json_list(chunks)
 
-Rules:
-- Use the given dish/local name as the identity of the dish.
-- Assume the search prompt already matched a real recipe; do NOT invent obviously fake ingredients.
-- Be concise and practical: focus on what a cook needs (ingredients, equipment, steps, time).
-- Return ONLY valid JSON (no extra text, no markdown).
-- There should only be ONE recipe per list item in the input.
-
-Output schema (single JSON object):
-[
-{
-"matched_recipe_title": string,
-"summary": string,
-"servings": int,
-"total_time_minutes": int,
-"materials": {
-    "ingredients": [
-    {
-        "name": string,
-        "quantity": string,   # e.g. "2", "1/2", "to taste"
-        "unit": string,       # e.g. "tbsp", "g", "cup", "" if none
-        "notes": string       # optional prep notes, can be ""
-    }
-    ],
-    "equipment": [string]     # e.g. ["wok", "large pot", "baking tray"]
-},
-"steps": [string],          # ordered, clear, numbered implicitly
-"image_url": string,        # direct URL to a representative image - Make sure this is an image URL. It should exist and be accessible. Double check the link to see if the image exists, reachable, and has meaningful content. Make sure it is the actual dish.
-"source_url": string,       # canonical recipe/source URL if available, else ""
-"source": string            # e.g. "spoonacular"
-}
-]"""
-
-    USER_PROMPT = f"""Build a structured recipe for the following dish(es) using my recipe database result.
-
-    Input:
-    {input_into}
-
-    Tasks:
-    - Use the best-matching recipe from the database result for this search prompt.
-    - Normalize and clean up ingredient quantities and units.
-    - Extract a reasonable total_time_minutes (estimate if only prep/cook times are given).
-    - Write clear, step-by-step cooking instructions in "steps".
-    - Fill in image_url and source_url from the recipe data if available.
-
-    Use exactly the schema and field names defined in the system prompt."""
+        else:
 
-    body = common_settings_instance.get_body()
-    body = common_settings_instance.replace_prompts_in_body_with_custom(
-        body, user=USER_PROMPT, system=SYSTEM_PROMPT
-    )
-    header = common_settings_instance.get_headers()
+            recipes = iter_json_items("".join([chunk async for chunk in chunks]))
 
-    url = common_settings_instance.get_chat_completion_url()
+        async for recipe in _aiter(recipes):
 
-    import requests
+            if batch.answered:
 
-    response = requests.post(url, headers=header, json=body)
+                break
 
-    results = []
+            yield batch.label(recipe)
 
-    if response.status_code == 200:
+        batch.succeeded()
 
-        common_settings_instance.log("API request successful")
+    except transport.CompletionFailed as e:
 
-        try:
+        batch.refused(e)
 
-            ayy = json.loads(
-                response.json()["choices"][0]["message"]["content"]
-                .replace("`json", "")
-                .replace("\n", "")
-                .replace("`", "")
-            )
+    except httpx.HTTPError as e:
 
-            common_settings_instance.log(f"Received {len(ayy)} results from API")
+        batch.transport_failed(e)
+        raise
 
-            for res in range(len(ayy)):
+    except ValueError as e:
 
-                addition = ayy[res]
+        again = batch.parse_failed(e)
 
-                for key, value in input_data[res].items():
+        if again is not None:
 
-                    addition[key] = value
+            async for recipe in aiter_batch(*again):
 
-                results.append(addition)
+                yield recipe
 
-            if recursion_needed:
 
-                results += process_list(
-                    recursion_list, at_a_time=at_a_time, max_num=max_num
-                )
+async def aiter_process_list(
+    input_data: list,
+    at_a_time=None,
+    max_num=10,
+    timings=None,
+    lookup=None,
+    bypass: bool = False,
+):
+    """Async form of ``iter_process_list``.
 
-                common_settings_instance.log(
-                    f"Recursion needed; total results now {len(results)} after processing remaining items"
-                )
+    Batches run as tasks on the event loop instead of the scheduler pool; at
+    most ``scheduler.max_concurrency`` of one call's batches are in flight at a time.
+    """
 
-        except Exception as e:
+    t0 = time.perf_counter()
 
-            with open(
-                EXAMPLE_PATH / "recipes_debug_response.txt", "w", encoding="utf-8"
-            ) as f:
+    if not input_data:
 
-                f.write(response.json()["choices"][0]["message"]["content"])
+        return
 
-                results = []
+    input_data.sort(reverse=True, key=lambda x: x.get("similarity_score", 0))
 
-    else:
+    common_settings_instance.log(f"Running process_list on {len(input_data)} items")
 
-        common_settings_instance.warn(
-            Exception(f"API request failed with status code {response.status_code}"),
-            f"Response: {response.text}",
-        )
+    stored, pending = split_stored(input_data[:max_num], lookup)
+    total = len(stored)
+
+    for pair in stored:
+
+        yield pair
 
     common_settings_instance.log(
-        f"process_list completed with {len(results)} total results"
+        f"Reused {total} stored recipes; requesting {len(pending)} from the API"
+    )
+
+    batches = make_batches(
+        pending, at_a_time=batch_size(at_a_time, len(pending)), max_num=len(pending)
     )
+    batch_done = batch_logger(timings)
+    limit = asyncio.Semaphore(max_concurrency())
+    events = asyncio.Queue()
+
+    async def pump(batch_index, batch, submitted):
+
+        async with limit:
+
+            started = time.perf_counter()
+            timing = {"queued_s": started - submitted, "error": None}
+            offset = 0
+
+            try:
+
+                async for recipe in aiter_batch(
+                    [dish for _, dish in batch], bypass=bypass
+                ):
+
+                    events.put_nowait(("item", batch_index, offset, recipe))
+                    offset += 1
+
+            except Exception as e:
+
+                timing["error"] = f"{type(e).__name__}: {e}"
+
+            timing["elapsed_s"] = time.perf_counter() - started
+            timing["batch"] = batch_index
+            timing["size"] = len(batch)
+
+        events.put_nowait(("done", batch_index, offset, timing))
+
+    tasks = [
+        asyncio.create_task(pump(batch_index, batch, time.perf_counter()))
+        for batch_index, batch in enumerate(batches)
+    ]
+
+    try:
+
+        remaining = len(batches)
+
+        while remaining:
+
+            kind, batch_index, offset, payload = await events.get()
+
+            if kind == "done":
+
+                remaining -= 1
+                batch_done(batch_index, payload)
+                continue
+
+            total += 1
+            yield batches[batch_index][offset][0], payload
+
+    finally:
+
+        # The consumer may stop early (e.g. the client went away).
+        for task in tasks:
+
+            task.cancel()
+
+    common_settings_instance.log(f"process_list completed with {total} total results")
 
     elapsed = time.perf_counter() - t0
     common_settings_instance.log(f"Elapsed time for process_list: {elapsed:.2f}")
 
-    return results
+
+async def aprocess_list(
+    input_data: list,
+    at_a_time=None,
+    max_num=10,
+    timings=None,
+    lookup=None,
+    bypass: bool = False,
+) -> list:
+    """Async form of ``process_list``."""
+
+    results = [
+        pair
+        async for pair in aiter_process_list(
+            input_data,
+            at_a_time=at_a_time,
+            max_num=max_num,
+            timings=timings,
+            lookup=lookup,
+            bypass=bypass,
+        )
+    ]
+    results.sort(key=lambda pair: pair[0])
+
+    if timings is not None:
+
+        timings.sort(key=lambda timing: timing["batch"])
+
+    return [recipe for _, recipe in results]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,631 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+
+from agents import transport
+from agents.router import router
+from telemetry import metrics
+
+DEFAULT_RETRY_SETTINGS = {
+    "max_attempts": 3,
+    "backoff_base_seconds": 0.5,
+    "backoff_max_seconds": 8.0,
+    "retry_statuses": [429, 500, 502, 503, 504],
+    "reask_attempts": 1,
+}
+
+DEFAULT_HEDGE_SETTINGS = {
+    "enabled": False,
+    "percentile": 95,
+    "min_samples": 20,
+    "window": 200,
+}
+
+REASK_PROMPT = (
+    "Your previous reply could not be parsed as JSON ({error}). Reply again "
+    "with ONLY the valid JSON, no markdown and no other text."
+)
+
+
+def get_retry_settings(settings: dict) -> dict:
+
+    retry_settings = dict(DEFAULT_RETRY_SETTINGS)
+    retry_settings.update((settings or {}).get("retry", {}))
+
+    return retry_settings
+
+
+def get_hedge_settings(settings: dict) -> dict:
+
+    hedge_settings = dict(DEFAULT_HEDGE_SETTINGS)
+    hedge_settings.update((settings or {}).get("hedge", {}))
+
+    return hedge_settings
+
+
+def failure_reason(e: Exception) -> str:
+    """Label of a failed request in ``llm_failures_total``/``llm_retries_total``."""
+
+    if isinstance(e, transport.CompletionFailed):
+
+        return str(e.status_code)
+
+    return type(e).__name__
+
+
+def is_retryable(e: Exception, retry_settings: dict) -> bool:
+    """429/5xx replies (as configured), timeouts and dropped connections."""
+
+    if isinstance(e, transport.CompletionFailed):
+
+        return e.status_code in retry_settings["retry_statuses"]
+
+    if isinstance(e, (requests.Timeout, requests.ConnectionError)):
+
+        return True
+
+    try:
+
+        import httpx
+
+    except ImportError:
+
+        return False
+
+    return isinstance(
+        e, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+    )
+
+
+def backoff_delay(attempt: int, retry_settings: dict, retry_after=None) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt`` (from 1),
+    at least the server's ``Retry-After`` but never above the cap."""
+
+    cap = float(retry_settings["backoff_max_seconds"])
+    ceiling = min(
+        cap, float(retry_settings["backoff_base_seconds"]) * 2 ** (attempt - 1)
+    )
+    delay = random.uniform(0, ceiling)
+
+    if retry_after is not None:
+
+        delay = max(delay, min(cap, retry_after))
+
+    return delay
+
+
+def reask_body(body: dict, error: Exception, previous_text: str) -> dict:
+    """``body`` followed by the reply that did not parse and a user message
+    asking for valid JSON again."""
+
+    body = dict(body)
+    body["messages"] = list(body.get("messages", [])) + [
+        {"role": "assistant", "content": previous_text},
+        {"role": "user", "content": REASK_PROMPT.format(error=error)},
+    ]
+
+    return body
+
+
+class LatencyTracker:
+    """Rolling time-to-first-chunk samples of recent requests, per agent."""
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, agent: str, seconds: float, window: int = 200):
+
+        with self._lock:
+
+            samples = self._samples.get(agent)
+
+            if samples is None or samples.maxlen != window:
+
+                samples = self._samples[agent] = deque(samples or (), maxlen=window)
+
+            samples.append(seconds)
+
+    def percentile(self, agent: str, p: float, min_samples: int = 1):
+        """The ``p``th percentile, or ``None`` with fewer than ``min_samples``."""
+
+        with self._lock:
+
+            samples = sorted(self._samples.get(agent, ()))
+
+        if not samples or len(samples) < min_samples:
+
+            return None
+
+        return samples[min(len(samples) - 1, max(0, round(p / 100 * len(samples)) - 1))]
+
+    def reset(self):
+
+        with self._lock:
+
+            self._samples = {}
+
+
+latencies = LatencyTracker()
+
+
+def hedge_delay(agent: str, settings: dict):
+    """Seconds to wait for a first chunk before hedging, or ``None``."""
+
+    hedge_settings = get_hedge_settings(settings)
+
+    if not hedge_settings["enabled"]:
+
+        return None
+
+    return latencies.percentile(
+        agent, float(hedge_settings["percentile"]), int(hedge_settings["min_samples"])
+    )
+
+
+def _pump(source, tag: str, events: queue.Queue, race: "HedgeRace"):
+
+    started = time.perf_counter()
+
+    try:
+
+        for chunk in source:
+
+            if race.winner not in (None, tag):
+
+                # The other request won, or nobody reads on: drop our reply.
+                return
+
+            events.put((tag, "chunk", chunk, time.perf_counter() - started))
+
+        events.put((tag, "end", None, time.perf_counter() - started))
+
+    except Exception as e:
+
+        events.put((tag, "error", e, time.perf_counter() - started))
+
+    finally:
+
+        source.close()
+
+
+def record_slow_primary(
+    bodies: dict, winner: str, errors: dict, started: float, settings: dict
+):
+    """Count a primary request the hedge overtook as at least this slow."""
+
+    if winner == "hedge" and "primary" not in errors:
+
+        router.record(
+            bodies["primary"].get("model"),
+            True,
+            time.perf_counter() - started,
+            settings,
+        )
+
+
+def hedge_body(body: dict, settings: dict, agent: str) -> dict:
+    """``body`` for a duplicate request, on the agent's next model if routed."""
+
+    model = body.get("model")
+    hedge_model = router.choose(agent, settings, model, [model], reason="hedge")
+
+    return body if hedge_model == model else dict(body, model=hedge_model)
+
+
+class HedgeRace:
+    """The bookkeeping of ``iter_hedged``/``aiter_hedged``, which only run the
+    requests: when the hedge is due, which reply wins and what is recorded
+    for each request's model and the agent's time to first chunk. The model
+    that answered is set as ``info["model"]`` if an ``info`` dict is given."""
+
+    def __init__(self, body: dict, settings: dict, agent: str, info: dict = None):
+
+        self.settings = settings
+        self.agent = agent
+        self.info = info
+        self.window = int(get_hedge_settings(settings)["window"])
+        self.delay = hedge_delay(agent, settings)
+        self.started = time.perf_counter()
+        self.winner = None
+        self.errors = {}
+        self.bodies = {"primary": body}
+
+    def body(self, tag: str) -> dict:
+        """The body of the ``primary`` or ``hedge`` request, about to start."""
+
+        if tag not in self.bodies:
+
+            self.bodies[tag] = hedge_body(
+                self.bodies["primary"], self.settings, self.agent
+            )
+
+        return self.bodies[tag]
+
+    def timeout(self):
+        """Seconds to wait for the next event before hedging, or ``None``."""
+
+        if self.winner is not None or len(self.bodies) > 1:
+
+            return None
+
+        return max(0.0, self.delay - (time.perf_counter() - self.started))
+
+    def first_chunk(self, tag: str, elapsed: float):
+
+        self.winner = tag
+
+        if self.info is not None:
+
+            self.info["model"] = self.bodies[tag].get("model")
+
+        latencies.record(self.agent, elapsed, self.window)
+        router.record(self.bodies[tag].get("model"), True, elapsed, self.settings)
+
+    def plain_chunk(self):
+        """A chunk of the request sent without a hedge."""
+
+        if self.winner is None:
+
+            self.first_chunk("primary", time.perf_counter() - self.started)
+
+    def plain_failed(self):
+
+        if self.winner is None:
+
+            elapsed = time.perf_counter() - self.started
+            router.record(
+                self.bodies["primary"].get("model"), False, elapsed, self.settings
+            )
+
+    def accept(self, tag: str, kind: str, payload, elapsed: float) -> bool:
+        """Whether an event of a raced request is the caller's to act on.
+        Raises the primary's error once no request is left to win."""
+
+        if self.winner is None:
+
+            if kind == "error":
+
+                self.errors[tag] = payload
+                router.record(
+                    self.bodies[tag].get("model"), False, elapsed, self.settings
+                )
+
+                # Before the hedge is due the failure is left to retries;
+                # after, the other request may still succeed.
+                if len(self.bodies) == 1 or len(self.errors) == 2:
+
+                    raise self.errors["primary"]
+
+                return False
+
+            self.first_chunk(tag, elapsed)
+
+            if len(self.bodies) == 2:
+
+                metrics.LLM_HEDGES.inc(agent=self.agent, winner=tag)
+                record_slow_primary(
+                    self.bodies, tag, self.errors, self.started, self.settings
+                )
+
+        return tag == self.winner
+
+
+def iter_hedged(
+    url: str, headers: dict, body: dict, settings: dict, agent: str, info=None
+):
+    """``transport.iter_completion`` that sends a duplicate request when the
+    first has sent nothing after the agent's p95 time to first chunk, and
+    keeps whichever reply starts first.
+
+    Until hedging is enabled and the agent has ``hedge.min_samples`` timings,
+    this is a plain request that only records its time to first chunk. Each
+    request's outcome is also recorded for its model in the router.
+    """
+
+    race = HedgeRace(body, settings, agent, info)
+
+    if race.delay is None:
+
+        try:
+
+            for chunk in transport.iter_completion(url, headers, body, settings):
+
+                race.plain_chunk()
+                yield chunk
+
+        except Exception:
+
+            race.plain_failed()
+            raise
+
+        return
+
+    events = queue.Queue()
+
+    def start(tag):
+
+        threading.Thread(
+            target=_pump,
+            args=(
+                transport.iter_completion(url, headers, race.body(tag), settings),
+                tag,
+                events,
+                race,
+            ),
+            name=f"llm-{tag}",
+            daemon=True,
+        ).start()
+
+    start("primary")
+
+    try:
+
+        while True:
+
+            try:
+
+                tag, kind, payload, elapsed = events.get(timeout=race.timeout())
+
+            except queue.Empty:
+
+                start("hedge")
+                continue
+
+            if not race.accept(tag, kind, payload, elapsed):
+
+                continue
+
+            if kind == "chunk":
+
+                yield payload
+
+            elif kind == "end":
+
+                return
+
+            else:
+
+                raise payload
+
+    finally:
+
+        # Whether or not a request won, nobody reads on: both pumps stop and
+        # close their replies at their next chunk.
+        race.winner = "closed"
+
+
+def route(body: dict, settings: dict, agent: str, tried: list) -> dict:
+    """``body`` on the router's model for this attempt, added to ``tried``."""
+
+    model = router.choose(agent, settings, body.get("model"), tried)
+    tried.append(model)
+
+    return body if model == body.get("model") else dict(body, model=model)
+
+
+class Retries:
+    """The attempts of ``iter_completion``/``aiter_completion``: the body of
+    each one, and whether and how long to wait before the next."""
+
+    def __init__(self, body: dict, settings: dict, agent: str):
+
+        self.body = body
+        self.settings = settings
+        self.agent = agent
+        self.retry_settings = get_retry_settings(settings)
+        self.attempt = 1
+        self.tried = []
+
+    def next_body(self) -> dict:
+
+        return route(self.body, self.settings, self.agent, self.tried)
+
+    def backoff(self, e: Exception, delivered: bool):
+        """Seconds to wait before retrying after ``e``, or ``None`` to give up."""
+
+        if (
+            delivered
+            or self.attempt >= int(self.retry_settings["max_attempts"])
+            or not is_retryable(e, self.retry_settings)
+        ):
+
+            return None
+
+        metrics.LLM_RETRIES.inc(agent=self.agent, reason=failure_reason(e))
+        delay = backoff_delay(
+            self.attempt, self.retry_settings, getattr(e, "retry_after", None)
+        )
+        self.attempt += 1
+
+        return delay
+
+
+def iter_completion(
+    url: str,
+    headers: dict,
+    body: dict,
+    settings: dict = None,
+    agent: str = "",
+    info: dict = None,
+):
+    """``transport.iter_completion`` with retries and optional hedging.
+
+    A 429/5xx reply, a timeout or a dropped connection is retried up to
+    ``retry.max_attempts`` times with jittered exponential backoff, as long as
+    no chunk has been yielded yet. With ``hedge.enabled`` a duplicate request
+    is sent when the first is slower than the agent's recent p95. When the
+    agent is routed, every attempt goes to the router's pick among the models
+    this call has not tried yet; ``info["model"]`` (if ``info`` is given) is
+    set to the one that answered.
+    """
+
+    retries = Retries(body, settings, agent)
+
+    while True:
+
+        delivered = False
+
+        try:
+
+            for chunk in iter_hedged(
+                url, headers, retries.next_body(), settings, agent, info
+            ):
+
+                delivered = True
+                yield chunk
+
+            return
+
+        except Exception as e:
+
+            delay = retries.backoff(e, delivered)
+
+            if delay is None:
+
+                raise
+
+            time.sleep(delay)
+
+
+async def _apump(source, tag: str, events: asyncio.Queue):
+
+    started = time.perf_counter()
+
+    try:
+
+        async for chunk in source:
+
+            events.put_nowait((tag, "chunk", chunk, time.perf_counter() - started))
+
+        events.put_nowait((tag, "end", None, time.perf_counter() - started))
+
+    except Exception as e:
+
+        events.put_nowait((tag, "error", e, time.perf_counter() - started))
+
+
+async def aiter_hedged(
+    url: str, headers: dict, body: dict, settings: dict, agent: str, info=None
+):
+    """Async form of ``iter_hedged``; the losing request's task is cancelled."""
+
+    race = HedgeRace(body, settings, agent, info)
+
+    if race.delay is None:
+
+        try:
+
+            async for chunk in transport.aiter_completion(url, headers, body, settings):
+
+                race.plain_chunk()
+                yield chunk
+
+        except Exception:
+
+            race.plain_failed()
+            raise
+
+        return
+
+    events = asyncio.Queue()
+    tasks = {}
+
+    def start(tag):
+
+        tasks[tag] = asyncio.create_task(
+            _apump(
+                transport.aiter_completion(url, headers, race.body(tag), settings),
+                tag,
+                events,
+            )
+        )
+
+    start("primary")
+
+    try:
+
+        while True:
+
+            try:
+
+                tag, kind, payload, elapsed = await asyncio.wait_for(
+                    events.get(), race.timeout()
+                )
+
+            except asyncio.TimeoutError:
+
+                start("hedge")
+                continue
+
+            if not race.accept(tag, kind, payload, elapsed):
+
+                continue
+
+            for other, task in tasks.items():
+
+                if other != race.winner:
+
+                    task.cancel()
+
+            if kind == "chunk":
+
+                yield payload
+
+            elif kind == "end":
+
+                return
+
+            else:
+
+                raise payload
+
+    finally:
+
+        for task in tasks.values():
+
+            task.cancel()
+
+
+async def aiter_completion(
+    url: str,
+    headers: dict,
+    body: dict,
+    settings: dict = None,
+    agent: str = "",
+    info: dict = None,
+):
+    """Async form of ``iter_completion``."""
+
+    retries = Retries(body, settings, agent)
+
+    while True:
+
+        delivered = False
+
+        try:
+
+            async for chunk in aiter_hedged(
+                url, headers, retries.next_body(), settings, agent, info
+            ):
+
+                delivered = True
+                yield chunk
+
+            return
+
+        except Exception as e:
+
+            delay = retries.backoff(e, delivered)
+
+            if delay is None:
+
+                raise
+
+            await asyncio.sleep(delay)
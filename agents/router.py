@@ -0,0 +1,217 @@
+import threading
+import time
+from collections import deque
+
+from telemetry import get_logger, metrics, warning
+
+DEFAULT_ROUTER_SETTINGS = {
+    "enabled": True,
+    "window": 50,
+    "window_seconds": 300,
+    "min_samples": 5,
+    "max_error_rate": 0.3,
+    "agents": {},
+}
+
+DEFAULT_MAX_LATENCY_SECONDS = 30.0
+
+logger = get_logger("agents.router")
+
+
+def get_router_settings(settings: dict) -> dict:
+
+    router_settings = dict(DEFAULT_ROUTER_SETTINGS)
+    router_settings.update((settings or {}).get("router", {}))
+
+    return router_settings
+
+
+class ModelRouter:
+    """Picks the model of each LLM request from an agent's priority list.
+
+    Every request's outcome is kept per model in a rolling window of the last
+    ``window`` results no older than ``window_seconds``. With at least
+    ``min_samples`` of them, a model is unhealthy while its error rate is over
+    ``max_error_rate`` or its median time to first chunk over the agent's
+    ``max_latency_seconds``. Requests go to the first healthy model in
+    priority order; unhealthy ones come after, best first, so something is
+    always tried. Old samples age out, so a skipped model is tried again once
+    its window has emptied.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._warned = set()
+
+    def record(self, model: str, ok: bool, seconds: float, settings: dict = None):
+
+        window = int(get_router_settings(settings)["window"])
+
+        with self._lock:
+
+            samples = self._samples.get(model)
+
+            if samples is None or samples.maxlen != window:
+
+                samples = self._samples[model] = deque(samples or (), maxlen=window)
+
+            samples.append((time.monotonic(), ok, seconds))
+
+    def stats(self, model: str, settings: dict = None) -> dict:
+        """``{"samples", "error_rate", "latency_s"}`` of ``model``'s window."""
+
+        router_settings = get_router_settings(settings)
+        horizon = time.monotonic() - float(router_settings["window_seconds"])
+
+        with self._lock:
+
+            samples = [s for s in self._samples.get(model, ()) if s[0] >= horizon]
+
+        latencies = sorted(seconds for _, ok, seconds in samples if ok)
+        errors = sum(1 for _, ok, _ in samples if not ok)
+
+        return {
+            "samples": len(samples),
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "latency_s": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+    def is_healthy(self, model: str, max_latency: float, settings: dict) -> bool:
+
+        router_settings = get_router_settings(settings)
+        stats = self.stats(model, settings)
+
+        if stats["samples"] < int(router_settings["min_samples"]):
+
+            return True
+
+        if stats["error_rate"] > float(router_settings["max_error_rate"]):
+
+            return False
+
+        return stats["latency_s"] is None or stats["latency_s"] <= max_latency
+
+    def agent_models(self, agent: str, settings: dict) -> tuple:
+        """``(priority list, max latency)`` of ``agent``; the list is empty
+        when the agent is not routed."""
+
+        router_settings = get_router_settings(settings)
+        agent_settings = router_settings["agents"].get(agent)
+
+        if not router_settings["enabled"] or not agent_settings:
+
+            return [], DEFAULT_MAX_LATENCY_SECONDS
+
+        available = (settings or {}).get("ai_api", {}).get("available_models")
+        models = []
+
+        for model in agent_settings.get("models", []):
+
+            if available is not None and model not in available:
+
+                if model not in self._warned:
+
+                    self._warned.add(model)
+                    warning(
+                        logger,
+                        Exception("Model not in available_models"),
+                        f"Skipping '{model}' in router.agents.{agent}",
+                    )
+
+                continue
+
+            models.append(model)
+
+        max_latency = float(
+            agent_settings.get("max_latency_seconds", DEFAULT_MAX_LATENCY_SECONDS)
+        )
+
+        return models, max_latency
+
+    def candidates(self, agent: str, settings: dict) -> list:
+        """``agent``'s models, healthy ones first in priority order."""
+
+        models, max_latency = self.agent_models(agent, settings)
+        healthy = []
+        unhealthy = []
+
+        for model in models:
+
+            if self.is_healthy(model, max_latency, settings):
+
+                healthy.append(model)
+
+            else:
+
+                stats = self.stats(model, settings)
+                unhealthy.append((stats["error_rate"], stats["latency_s"] or 0, model))
+
+        return healthy + [model for *_, model in sorted(unhealthy)]
+
+    def choose(
+        self,
+        agent: str,
+        settings: dict,
+        default: str,
+        exclude=(),
+        reason: str = None,
+    ) -> str:
+        """The model for ``agent``'s next request, avoiding ``exclude`` (the
+        models this call has already tried) while any other is left."""
+
+        models, _ = self.agent_models(agent, settings)
+
+        if not models:
+
+            metrics.LLM_ROUTES.inc(agent=agent, model=default, reason="default")
+            return default
+
+        candidates = self.candidates(agent, settings)
+        fresh = [model for model in candidates if model not in exclude]
+        model = (fresh or candidates)[0]
+
+        if reason is None:
+
+            reason = "preferred" if model == models[0] else "failover"
+
+        metrics.LLM_ROUTES.inc(agent=agent, model=model, reason=reason)
+
+        return model
+
+    def reset(self):
+
+        with self._lock:
+
+            self._samples = {}
+
+
+router = ModelRouter()
+
+
+def model_stats() -> dict:
+
+    with router._lock:
+
+        models = list(router._samples)
+
+    return {model: router.stats(model) for model in models}
+
+
+metrics.REGISTRY.callback(
+    "llm_model_error_rate",
+    "Error rate of each model over the router's rolling window.",
+    lambda: {model: s["error_rate"] for model, s in model_stats().items()},
+    labelnames=("model",),
+)
+metrics.REGISTRY.callback(
+    "llm_model_latency_seconds",
+    "Median time to first chunk of each model over the router's window.",
+    lambda: {
+        model: s["latency_s"]
+        for model, s in model_stats().items()
+        if s["latency_s"] is not None
+    },
+    labelnames=("model",),
+)
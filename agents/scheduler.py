@@ -0,0 +1,161 @@
+import queue
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def is_cooperative() -> bool:
+    """True in a gevent monkey-patched process, where threads are greenlets."""
+
+    # Only a process that has imported gevent.monkey can have been patched;
+    # checking first keeps gevent out of every other process's imports.
+    monkey = sys.modules.get("gevent.monkey")
+
+    if monkey is None:
+
+        return False
+
+    return monkey.is_module_patched("threading")
+
+
+class BatchScheduler:
+    """Runs agent batches concurrently on a shared, bounded worker pool.
+
+    The pool is created lazily on first use so that it is built inside the
+    worker process (after a gunicorn fork) rather than at import time. In a
+    gevent worker each call gets its own pool of greenlets instead, so one
+    worker's many concurrent queries do not queue behind a shared limit.
+    """
+
+    def __init__(self, max_concurrency: int = 4, name: str = "agent-batch"):
+
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+
+        if self._executor is None:
+
+            with self._lock:
+
+                if self._executor is None:
+
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency,
+                        thread_name_prefix=self.name,
+                    )
+
+        return self._executor
+
+    def iter_items(self, batches: list, worker, on_done=None):
+        """Submit every batch at once and yield ``(index, offset, item)`` for
+        each item as soon as any batch produces it.
+
+        ``worker`` is a generator function called with a single batch, so a
+        batch can hand over its items one by one while it is still running.
+        ``on_done(index, timing)`` is called from the consuming thread when a
+        batch finishes. A worker that raises keeps the items it already yielded
+        and records the error in ``timing["error"]``.
+        """
+
+        if is_cooperative():
+
+            executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix=self.name
+            )
+
+        else:
+
+            executor = self.get_executor()
+
+        events = queue.Queue()
+
+        def pump(index, batch, submitted):
+
+            started = time.perf_counter()
+            timing = {"queued_s": started - submitted, "error": None}
+            offset = 0
+
+            try:
+
+                for item in worker(batch):
+
+                    events.put(("item", index, offset, item))
+                    offset += 1
+
+            except Exception as e:
+
+                timing["error"] = f"{type(e).__name__}: {e}"
+
+            timing["elapsed_s"] = time.perf_counter() - started
+            timing["batch"] = index
+            timing["size"] = len(batch)
+            events.put(("done", index, offset, timing))
+
+        for index, batch in enumerate(batches):
+
+            executor.submit(pump, index, batch, time.perf_counter())
+
+        remaining = len(batches)
+
+        try:
+
+            while remaining:
+
+                kind, index, offset, payload = events.get()
+
+                if kind == "item":
+
+                    yield index, offset, payload
+
+                else:
+
+                    remaining -= 1
+
+                    if on_done is not None:
+
+                        on_done(index, payload)
+
+        finally:
+
+            if executor is not self._executor:
+
+                executor.shutdown(wait=False)
+
+    def run(self, batches: list, worker):
+        """Run every batch and return ``(results, timings)`` in batch order,
+        where ``results[i]`` is the list of items batch ``i`` produced."""
+
+        results = [[] for _ in batches]
+        timings = [None] * len(batches)
+
+        def on_done(index, timing):
+
+            timings[index] = timing
+
+        for index, offset, item in self.iter_items(batches, worker, on_done=on_done):
+
+            results[index].append(item)
+
+        return results, timings
+
+    def shutdown(self, wait: bool = True):
+
+        with self._lock:
+
+            if self._executor is not None:
+
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def make_batches(items: list, at_a_time: int, max_num: int) -> list:
+    """Split the first ``max_num`` items into consecutive batches."""
+
+    at_a_time = max(1, int(at_a_time))
+    items = items[:max_num]
+
+    return [items[i : i + at_a_time] for i in range(0, len(items), at_a_time)]
@@ -0,0 +1,393 @@
+import json
+import re
+import time
+
+from telemetry import metrics
+
+
+def sse_line_content(line: bytes) -> list:
+    """Return the content deltas of one SSE line, or ``None`` at ``[DONE]``."""
+
+    if not line or not line.startswith(b"data:"):
+
+        return []
+
+    data = line[5:].strip()
+
+    if data == b"[DONE]":
+
+        return None
+
+    try:
+
+        chunk = json.loads(data)
+
+    except ValueError:
+
+        return []
+
+    contents = []
+
+    for choice in chunk.get("choices", []):
+
+        content = (choice.get("delta") or {}).get("content")
+
+        if content:
+
+            contents.append(content)
+
+    return contents
+
+
+def iter_sse_content(response):
+    """Yield the content deltas of a streamed (``"stream": true``) chat completion.
+
+    ``response`` is a ``requests`` response opened with ``stream=True``. Lines
+    are split on bytes and decoded one at a time so that multi-byte characters
+    are never cut in half. The body is read to the end, past ``[DONE]``, so the
+    connection goes back to the keep-alive pool.
+    """
+
+    done = False
+
+    for raw_line in response.iter_lines(chunk_size=1024):
+
+        if done:
+
+            continue
+
+        contents = sse_line_content(raw_line)
+
+        if contents is None:
+
+            done = True
+            continue
+
+        yield from contents
+
+
+async def aiter_sse_content(response):
+    """Async form of ``iter_sse_content`` for a streamed ``httpx`` response."""
+
+    done = False
+    pending = b""
+
+    async for raw in response.aiter_bytes():
+
+        pending += raw
+        *lines, pending = pending.split(b"\n")
+
+        for raw_line in lines:
+
+            if done:
+
+                continue
+
+            contents = sse_line_content(raw_line.rstrip(b"\r"))
+
+            if contents is None:
+
+                done = True
+                continue
+
+            for content in contents:
+
+                yield content
+
+    if pending and not done:
+
+        for content in sse_line_content(pending.rstrip(b"\r")) or []:
+
+            yield content
+
+
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def repair_json(text: str) -> str:
+    """Best-effort fix of a model's almost-JSON reply.
+
+    Drops prose around the outermost ``[...]``/``{...}`` and trailing commas,
+    and cuts a truncated top-level array back to its last complete element.
+    The result may still not parse.
+    """
+
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+
+    if not starts:
+
+        return text
+
+    text = TRAILING_COMMA.sub(r"\1", text[min(starts) :])
+
+    depth = 0
+    in_string = False
+    escape = False
+    last_element_end = None
+
+    for i, char in enumerate(text):
+
+        if in_string:
+
+            if escape:
+
+                escape = False
+
+            elif char == "\\":
+
+                escape = True
+
+            elif char == '"':
+
+                in_string = False
+
+            continue
+
+        if char == '"':
+
+            in_string = True
+
+        elif char in "[{":
+
+            depth += 1
+
+        elif char in "]}":
+
+            depth -= 1
+
+            if depth == 0:
+
+                return text[: i + 1]
+
+            if depth == 1:
+
+                last_element_end = i + 1
+
+    if text[0] == "[" and last_element_end is not None:
+
+        return text[:last_element_end] + "]"
+
+    return text
+
+
+class JsonListParser:
+    """Incremental parser for a top-level JSON array of objects.
+
+    Text is fed in arbitrary pieces with ``feed``; every element of the
+    top-level array is returned as soon as its closing brace arrives. Anything
+    before the opening ``[`` (code fences, prose) is skipped, and parsing stops
+    at the matching ``]``; ``close`` checks that it was reached. An element
+    that does not decode raises ``ValueError`` from the next ``feed`` or
+    ``close``, so the elements decoded before it are returned first.
+    """
+
+    def __init__(self):
+
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.finished = False
+        self.count = 0
+        self.error = None
+        self._element = []
+
+    def feed(self, text: str) -> list:
+
+        elements = []
+
+        if self.error is not None:
+
+            raise self.error
+
+        if self.finished:
+
+            return elements
+
+        for char in text:
+
+            if not self.started:
+
+                if char == "[":
+
+                    self.started = True
+                    self.depth = 1
+
+                continue
+
+            if self.depth > 1:
+
+                self._element.append(char)
+
+            if self.in_string:
+
+                if self.escape:
+
+                    self.escape = False
+
+                elif char == "\\":
+
+                    self.escape = True
+
+                elif char == '"':
+
+                    self.in_string = False
+
+                continue
+
+            if char == '"':
+
+                self.in_string = True
+
+            elif char in "{[":
+
+                if self.depth == 1:
+
+                    self._element.append(char)
+
+                self.depth += 1
+
+            elif char in "}]":
+
+                self.depth -= 1
+
+                if self.depth == 1:
+
+                    try:
+
+                        elements.append(self._decode())
+
+                    except ValueError as e:
+
+                        self.error = e
+                        break
+
+                elif self.depth == 0:
+
+                    self.finished = True
+                    break
+
+        return elements
+
+    def close(self):
+        """Raise ``ValueError`` if an element did not decode or the text ended
+        before the array did."""
+
+        if self.error is not None:
+
+            raise self.error
+
+        if not self.started:
+
+            raise ValueError("No JSON list in the reply")
+
+        if not self.finished:
+
+            raise ValueError(
+                f"The reply ended inside the JSON list, after {self.count} elements"
+            )
+
+    def _decode(self):
+
+        text = "".join(self._element)
+        self._element = []
+
+        try:
+
+            element = json.loads(text, strict=False)
+
+        except ValueError:
+
+            element = json.loads(repair_json(text), strict=False)
+
+        self.count += 1
+
+        return element
+
+
+class ParseStage:
+    """Feeds a ``JsonListParser`` for ``iter_json_list``/``aiter_json_list``,
+    timing the parser (not the wait for chunks) as the ``json_parse`` stage
+    and counting its failures."""
+
+    def __init__(self):
+
+        self.parser = JsonListParser()
+        self.seconds = 0.0
+
+    def feed(self, chunk: str) -> list:
+
+        started = time.perf_counter()
+
+        try:
+
+            return self.parser.feed(chunk)
+
+        except ValueError:
+
+            metrics.STAGE_FAILURES.inc(stage="json_parse")
+            raise
+
+        finally:
+
+            self.seconds += time.perf_counter() - started
+
+    def close(self):
+
+        try:
+
+            self.parser.close()
+
+        except ValueError:
+
+            metrics.STAGE_FAILURES.inc(stage="json_parse")
+            raise
+
+    def record(self):
+
+        if self.parser.started:
+
+            metrics.observe("json_parse", self.seconds)
+
+
+def iter_json_list(chunks):
+    """Yield each top-level array element found in an iterable of text chunks.
+
+    The chunks are consumed to the end even after the array has closed, so a
+    streamed response is fully read and its connection can be reused. The
+    time spent in the parser is recorded as the ``json_parse`` stage.
+    """
+
+    stage = ParseStage()
+
+    try:
+
+        for chunk in chunks:
+
+            yield from stage.feed(chunk)
+
+        stage.close()
+
+    finally:
+
+        stage.record()
+
+
+async def aiter_json_list(chunks):
+    """Async form of ``iter_json_list`` for an async iterable of text chunks."""
+
+    stage = ParseStage()
+
+    try:
+
+        async for chunk in chunks:
+
+            for item in stage.feed(chunk):
+
+                yield item
+
+        stage.close()
+
+    finally:
+
+        stage.record()
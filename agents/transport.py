@@ -0,0 +1,440 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from agents.scheduler import is_cooperative
+from agents.streaming import aiter_sse_content, iter_sse_content
+from telemetry import metrics
+
+DEFAULT_TRANSPORT_SETTINGS = {
+    "connect_timeout": 10,
+    "read_timeout": 120,
+    "pool_connections": 4,
+    "pool_maxsize": 16,
+    "async_max_connections": 256,
+    "preconnect": 1,
+}
+
+
+class CompletionFailed(Exception):
+
+    def __init__(self, status_code: int, text: str = "", retry_after=None):
+
+        super().__init__(f"API request failed with status code {status_code}")
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers) -> float:
+    """The ``Retry-After`` header in seconds, if it is given as a number."""
+
+    try:
+
+        return float(headers.get("Retry-After"))
+
+    except (TypeError, ValueError):
+
+        return None
+
+
+class TransportStats:
+    """Process-wide counters for the shared agent session."""
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self._lock:
+
+            self.requests = 0
+            self.connections_opened = 0
+            self.handshake_seconds_total = 0.0
+            self.handshake_seconds_max = 0.0
+
+    def record_request(self):
+
+        with self._lock:
+
+            self.requests += 1
+
+    def record_connect(self, seconds: float):
+
+        with self._lock:
+
+            self.connections_opened += 1
+            self.handshake_seconds_total += seconds
+            self.handshake_seconds_max = max(self.handshake_seconds_max, seconds)
+
+    def snapshot(self) -> dict:
+
+        with self._lock:
+
+            reused = max(0, self.requests - self.connections_opened)
+
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": reused,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0,
+                "handshake_seconds_total": self.handshake_seconds_total,
+                "handshake_seconds_avg": (
+                    self.handshake_seconds_total / self.connections_opened
+                    if self.connections_opened
+                    else 0.0
+                ),
+                "handshake_seconds_max": self.handshake_seconds_max,
+            }
+
+
+transport_stats = TransportStats()
+
+
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+
+        started = time.perf_counter()
+        super().connect()
+        transport_stats.record_connect(time.perf_counter() - started)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+
+        # Covers the TCP connect and the TLS handshake.
+        started = time.perf_counter()
+        super().connect()
+        transport_stats.record_connect(time.perf_counter() - started)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+
+    ConnectionCls = TimedHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_transport_settings(settings: dict) -> dict:
+
+    transport_settings = dict(DEFAULT_TRANSPORT_SETTINGS)
+    transport_settings.update((settings or {}).get("transport", {}))
+
+    return transport_settings
+
+
+def get_session(settings: dict = None) -> requests.Session:
+    """Return the keep-alive session for this process.
+
+    The session is rebuilt if the process has forked since it was created, so
+    gunicorn workers never share sockets with the master.
+    """
+
+    global _session, _session_pid
+
+    if _session is not None and _session_pid == os.getpid():
+
+        return _session
+
+    with _session_lock:
+
+        if _session is None or _session_pid != os.getpid():
+
+            transport_settings = get_transport_settings(settings)
+            pool_maxsize = int(transport_settings["pool_maxsize"])
+
+            if is_cooperative():
+
+                # A gevent worker has as many requests in flight as the
+                # asyncio client; keep their connections too.
+                pool_maxsize = max(
+                    pool_maxsize, int(transport_settings["async_max_connections"])
+                )
+
+            adapter = PooledAdapter(
+                pool_connections=int(transport_settings["pool_connections"]),
+                pool_maxsize=pool_maxsize,
+                max_retries=0,
+            )
+
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            _session = session
+            _session_pid = os.getpid()
+
+    return _session
+
+
+def preconnect(url: str, settings: dict = None) -> int:
+    """Open ``transport.preconnect`` keep-alive connections to ``url``'s host
+    (TCP and TLS) in this process's pool, so the first request skips the
+    handshake. Returns how many were opened; a failure just opens fewer."""
+
+    transport_settings = get_transport_settings(settings)
+    session = get_session(settings)
+    conns = []
+    opened = 0
+
+    try:
+
+        # The same pool requests.Session.send would pick for this URL.
+        request = requests.Request("POST", url).prepare()
+        tls = session.merge_environment_settings(url, {}, None, None, None)
+        pool = session.get_adapter(url).get_connection_with_tls_context(
+            request, tls["verify"], tls["proxies"], tls["cert"]
+        )
+
+        for _ in range(int(transport_settings["preconnect"])):
+
+            conn = pool._get_conn()
+            conns.append(conn)
+            conn.timeout = float(transport_settings["connect_timeout"])
+            conn.connect()
+            opened += 1
+
+    except Exception:
+
+        if len(conns) > opened:
+
+            conns[-1].close()
+
+    finally:
+
+        for conn in conns:
+
+            pool._put_conn(conn)
+
+    return opened
+
+
+def post(url: str, headers: dict, json: dict, settings: dict = None, stream=False):
+    """POST through the shared session with the configured timeouts."""
+
+    transport_settings = get_transport_settings(settings)
+    timeout = (
+        float(transport_settings["connect_timeout"]),
+        float(transport_settings["read_timeout"]),
+    )
+
+    transport_stats.record_request()
+
+    return get_session(settings).post(
+        url, headers=headers, json=json, stream=stream, timeout=timeout
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of ``text``, at about 4 characters per token."""
+
+    return (len(text) + 3) // 4
+
+
+def record_tokens(body: dict, usage: dict = None, completion_chars: int = 0):
+    """Count a completion's tokens in ``llm_tokens_total``, from the reply's
+    ``usage`` if the API sent one, else estimated from the text."""
+
+    model = body.get("model", "")
+
+    if usage:
+
+        prompt = usage.get("prompt_tokens") or 0
+        completion = usage.get("completion_tokens") or 0
+
+    else:
+
+        prompt = sum(
+            estimate_tokens(message["content"])
+            for message in body.get("messages", [])
+            if isinstance(message.get("content"), str)
+        )
+        completion = (completion_chars + 3) // 4
+
+    metrics.LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+    metrics.LLM_TOKENS.inc(completion, model=model, kind="completion")
+
+
+def iter_completion(url: str, headers: dict, body: dict, settings: dict = None):
+    """Yield the assistant content of a chat completion as text chunks.
+
+    Streamed bodies (``"stream": true``) yield one chunk per SSE delta; other
+    bodies yield the whole content once. A non-200 reply raises
+    ``CompletionFailed``.
+    """
+
+    stream = bool(body.get("stream"))
+
+    response = post(url, headers=headers, json=body, settings=settings, stream=stream)
+
+    if response.status_code != 200:
+
+        raise CompletionFailed(
+            response.status_code,
+            response.text,
+            retry_after_seconds(response.headers),
+        )
+
+    if stream:
+
+        received = 0
+
+        try:
+
+            for chunk in iter_sse_content(response):
+
+                received += len(chunk)
+                yield chunk
+
+        finally:
+
+            # Frees the connection at once if the reader stopped early.
+            response.close()
+            record_tokens(body, completion_chars=received)
+
+    else:
+
+        reply = response.json()
+        content = reply["choices"][0]["message"]["content"]
+        record_tokens(body, reply.get("usage"), len(content))
+
+        yield content
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(settings: dict = None):
+    """Return the keep-alive ``httpx.AsyncClient`` of the running event loop.
+
+    An async client cannot be shared between event loops, so there is one per
+    loop. ``async_max_connections`` bounds the sockets it keeps open; it is
+    much larger than ``pool_maxsize`` because a single async worker may have
+    hundreds of queries waiting on the API at once.
+    """
+
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+
+    if client is None or client.is_closed:
+
+        transport_settings = get_transport_settings(settings)
+        max_connections = int(transport_settings["async_max_connections"])
+
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                float(transport_settings["read_timeout"]),
+                connect=float(transport_settings["connect_timeout"]),
+                pool=None,
+            ),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        _async_clients[loop] = client
+
+    return client
+
+
+async def aclose_async_client():
+
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+
+    if client is not None:
+
+        await client.aclose()
+
+
+async def aiter_completion(url: str, headers: dict, body: dict, settings: dict = None):
+    """Async form of ``iter_completion`` on the event loop's ``httpx`` client."""
+
+    stream = bool(body.get("stream"))
+    client = get_async_client(settings)
+
+    async with client.stream("POST", url, headers=headers, json=body) as response:
+
+        if response.status_code != 200:
+
+            await response.aread()
+            raise CompletionFailed(
+                response.status_code,
+                response.text,
+                retry_after_seconds(response.headers),
+            )
+
+        if stream:
+
+            received = 0
+
+            try:
+
+                async for chunk in aiter_sse_content(response):
+
+                    received += len(chunk)
+                    yield chunk
+
+            finally:
+
+                record_tokens(body, completion_chars=received)
+
+        else:
+
+            await response.aread()
+            reply = response.json()
+            content = reply["choices"][0]["message"]["content"]
+            record_tokens(body, reply.get("usage"), len(content))
+
+            yield content
+
+
+def stats() -> dict:
+
+    return transport_stats.snapshot()
+
+
+metrics.REGISTRY.callback(
+    "llm_http_requests_total",
+    "Requests sent to the LLM API on the shared session.",
+    lambda: transport_stats.requests,
+    kind="counter",
+)
+metrics.REGISTRY.callback(
+    "llm_http_connections_opened_total",
+    "Connections the shared session opened (the rest were reused).",
+    lambda: transport_stats.connections_opened,
+    kind="counter",
+)
@@ -1,4 +1,5 @@
 import os
+import random
 from flask import (
     Flask,
     jsonify,
@@ -10,7 +11,17 @@ from flask import (
 )
 import json
 from pathlib import Path
-from pathvalidate import sanitize_filename
+
+from agents.scheduler import is_cooperative
+from pipeline import JobQueue, JobRunner, cooperative, run_query
+from telemetry import metrics
+from storage import (
+    PageCache,
+    PersistenceWriter,
+    ResultsView,
+    clean_filename,
+    open_store,
+)
 
 app = Flask(__name__)
 
@@ -18,38 +29,128 @@ BASE_DB_PATH = Path(__file__).parent / "data" / "db"
 RECIPES_DB_PATH = BASE_DB_PATH / "recipes"
 RESULTS_DB_PATH = BASE_DB_PATH / "results"
 
+# "json" (the data/db tree) or "sqlite" (data/db/atlas.sqlite3)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
 
-def scan_directory_for_json(path: Path) -> list:
+store = open_store(BASE_DB_PATH, backend=STORAGE_BACKEND)
+writer = PersistenceWriter(store)
 
-    json_files = []
-    for file in path.glob("**/*.json"):
-        relative_path = file.relative_to(path)
-        json_files.append(str(relative_path))
-    return json_files
+# Rendered /load_results/ and /dish/ pages, reused until their entry changes.
+pages = PageCache()
 
+metrics.REGISTRY.callback(
+    "page_cache_events_total",
+    "Rendered-page cache hits and misses.",
+    lambda: {"hits": pages.hits, "misses": pages.misses},
+    kind="counter",
+    labelnames=("event",),
+)
 
-def clean_filename(name: str) -> str:
-    return sanitize_filename(name.replace(" ", "_").lower())
+JOBS_DB_PATH = BASE_DB_PATH / "jobs.sqlite3"
 
+# Pipelines one worker runs at once; under gevent they are cheap greenlets.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "200" if is_cooperative() else "4"))
 
-@app.route("/", methods=["GET"])
-def home():
 
-    import random
+def run_job(query: str, refresh: bool = False):
+
+    return run_query(query, store, writer, refresh)
+
+
+# Queries run as background jobs, shared by every worker process; identical
+# queries submitted while one is queued or running join that job.
+jobs = JobQueue(JOBS_DB_PATH)
+runner = JobRunner(jobs, run_job, max_workers=JOB_WORKERS)
+
+
+# Compiled by preload() so the first page view does not pay for it.
+TEMPLATES = ("index.html", "query.html", "results.html", "dish.html")
+
+PHRASES = (
+    "see how the world eats.",
+    "one dish. every culture.",
+    "map the menu.",
+    "eat everywhere.",
+    "the geography of flavor.",
+    "global roots. local tastes.",
+    "savor the world's flavors.",
+    "culinary journeys await.",
+    "flavorful adventures start here.",
+)
+
+
+def preload():
+    """Do the start-up work a worker can inherit across a fork: import the
+    agent modules (and requests), read their settings and ``.env``, build
+    their request bodies, index the store and compile the templates.
+
+    It starts no thread and leaves no socket open, so it is safe in
+    gunicorn's master with ``--preload``; without it each worker runs it
+    from ``warm_worker``. Running it again is harmless.
+    """
+
+    import agents.diversifier.client as diversifier_client
+    import agents.recipes.client
+    from agents import config
+
+    settings = diversifier_client.common_settings_instance.settings
+
+    for agent in settings.get("agents", {}).get("available_agents", []):
+
+        config.config.body_template(agent)
 
-    phrases = [
-        "see how the world eats.",
-        "one dish. every culture.",
-        "map the menu.",
-        "eat everywhere.",
-        "the geography of flavor.",
-        "global roots. local tastes.",
-        "savor the world's flavors.",
-        "culinary journeys await.",
-        "flavorful adventures start here.",
-    ]
+    store.refresh()
 
-    return render_template("index.html", phrase=random.choice(phrases))
+    for template in TEMPLATES:
+
+        app.jinja_env.get_template(template)
+
+
+def warm_worker():
+    """Per-process start-up, after any fork and before traffic: ``preload``,
+    open the LLM API connections, share the metrics with the other workers
+    and start the job runner."""
+
+    preload()
+
+    import agents.diversifier.client as diversifier_client
+    from agents import transport
+
+    settings_instance = diversifier_client.common_settings_instance
+    transport.preconnect(
+        settings_instance.get_chat_completion_url(), settings_instance.settings
+    )
+
+    metrics.REGISTRY.share(metrics.SHARED_DIR)
+    runner.start()
+
+
+def render(template: str, **context) -> str:
+    """``render_template``, timed as the ``render`` stage."""
+
+    with metrics.span("render"):
+
+        return render_template(template, **context)
+
+
+def cached_page(key, data, version, render) -> Response:
+    """Serve ``render()`` through the page cache, answering conditional
+    requests with 304 Not Modified."""
+
+    page = pages.get(key, data, render, version)
+
+    response = Response(page["body"], mimetype="text/html")
+    response.set_etag(page["etag"])
+    response.last_modified = page["last_modified"]
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+@app.route("/", methods=["GET"])
+def home():
+
+    return render("index.html", phrase=random.choice(PHRASES))
 
 
 @app.route("/status", methods=["GET"])
@@ -58,20 +159,25 @@ def status():
     return jsonify({"status": "ok"}), 200
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+
+    # Counters and histograms are summed over the workers started through
+    # warm_worker; a single process (flask run) serves only its own.
+    return Response(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.route("/query/load/", methods=["GET"])
 def load_query():
 
     params = request.args
     food = params.get("food", "")
 
-    already_exists = False
-
-    cleaned_food = clean_filename(food)
+    already_exists = store.has_result(food)
 
-    if (RESULTS_DB_PATH / f"{cleaned_food}.json").exists():
-        already_exists = True
-
-    return render_template("query.html", query=food, already_exists=already_exists)
+    return render("query.html", query=food, already_exists=already_exists)
 
 
 @app.route("/dish/<dish_name>/", methods=["GET"])
@@ -80,168 +186,146 @@ def dish(dish_name):
     params = request.args
 
     # Normalize dish_name to handle URL dashes mapped to directory underscores
-    normalized_dish_name = dish_name.replace("-", "_")
-    dish_dir = RECIPES_DB_PATH / f"{clean_filename(normalized_dish_name)}"
+    normalized_dish_name = clean_filename(dish_name.replace("-", "_"))
 
-    if not dish_dir.exists() or not dish_dir.is_dir():
+    if not store.has_dish(normalized_dish_name):
         return "Dish not found", 404
 
-    all_files = scan_directory_for_json(dish_dir)
+    all_variants = store.variants(normalized_dish_name)
+
+    came_from = params.get("from", all_variants[0])
+    came_from_cleaned = clean_filename(came_from.replace("-", " ").lower())
+
+    dish_data = store.get_recipe(normalized_dish_name, came_from_cleaned)
+
+    if dish_data is None:
+        # Fallback to the first available variant if the requested one doesn't exist
+        came_from = all_variants[0]
+        dish_data = store.get_recipe(normalized_dish_name, came_from)
 
-    if not all_files:
+    if dish_data is None:
         return "No recipes found for this dish", 404
 
-    came_from = params.get(
-        "from", str(all_files[0]).replace(".json", "") if all_files else ""
+    return cached_page(
+        ("dish", dish_name, came_from),
+        dish_data,
+        store.recipe_version(normalized_dish_name, clean_filename(came_from)),
+        lambda: render(
+            "dish.html", dish_name=dish_name, from_dish=came_from, dish_data=dish_data
+        ),
     )
-    came_from_cleaned = clean_filename(came_from.replace("-", " ").lower())
 
-    target_file = dish_dir / f"{came_from_cleaned}.json"
 
-    if not target_file.exists():
-        # Fallback to the first available file if the requested one doesn't exist
-        fallback_file = dish_dir / all_files[0]
-        target_file = fallback_file
-        # Update came_from to match the fallback file for the UI
-        came_from = all_files[0].replace(".json", "")
+def job_payload(job: dict) -> dict:
 
-    with open(target_file, "r", encoding="utf-8") as f:
-        dish_data = json.load(f)
+    return {
+        "job_id": job["id"],
+        "query": job["query"],
+        "state": job["state"],
+        "error": job["error"],
+        "status_url": url_for("job_status", job_id=job["id"]),
+        "events_url": url_for("job_events", job_id=job["id"]),
+    }
 
-    return render_template(
-        "dish.html", dish_name=dish_name, from_dish=came_from, dish_data=dish_data
-    )
+
+def job_not_found(job_id: str):
+
+    return jsonify({"status": "error", "message": f"No job '{job_id}'"}), 404
 
 
 @app.route("/api/query/", methods=["GET", "POST"])
 def ai_query():
 
-    params = request.args
-    food = params.get("food")
-
-    def generate():
+    food = request.values.get("food", "")
 
-        yield json.dumps({"status": "start", "stage": "initialization"}) + "\n"
+    if not food.strip():
 
-        import agents.diversifier.client as diversifier_client
+        return jsonify({"status": "error", "message": "Missing 'food'"}), 400
 
-        diversification_result = diversifier_client.process_diversification(food)
+    # Finished queries are served from the store unless a rerun is asked for.
+    if store.has_result(food) and not request.values.get("refresh"):
 
-        yield json.dumps(
+        return jsonify(
             {
-                "status": "complete",
-                "stage": "diversification",
-                "result": diversification_result,
+                "status": "done",
+                "query": food,
+                "result_url": url_for("load_results", query=food),
             }
-        ) + "\n"
+        )
 
-        import agents.recipes.client as recipes_client
+    job, created = jobs.submit(food, refresh=bool(request.values.get("refresh")))
 
-        recipes_result = recipes_client.process_list(diversification_result)
+    runner.start()
+    runner.notify()
 
-        yield json.dumps(
-            {"status": "complete", "stage": "recipes", "result": recipes_result}
-        ) + "\n"
+    payload = job_payload(job)
+    payload["created"] = created
 
-        cleaned_food = clean_filename(food)
+    return jsonify(payload), 202
 
-        for i in recipes_result:
 
-            os.makedirs(
-                RECIPES_DB_PATH / f"{clean_filename(i['dish_name'])}", exist_ok=True
-            )
+@app.route("/api/jobs/<job_id>/", methods=["GET"])
+def job_status(job_id):
 
-            with open(
-                RECIPES_DB_PATH
-                / f"{clean_filename(i['dish_name'])}"
-                / f"{clean_filename(food)}.json",
-                "w",
-                encoding="utf-8",
-            ) as f:
+    job = jobs.get(job_id)
 
-                json.dump(i, f, ensure_ascii=False, indent=4)
+    if job is None:
 
-        os.makedirs(RESULTS_DB_PATH, exist_ok=True)
-        with open(RESULTS_DB_PATH / f"{cleaned_food}.json", "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "dishes": diversification_result,
-                    "recipes": recipes_result,
-                },
-                f,
-                ensure_ascii=False,
-                indent=4,
-            )
+        return job_not_found(job_id)
 
-        yield json.dumps({"status": "done"}) + "\n"
+    after = request.args.get("after", -1, type=int)
+    events, finished = jobs.poll(job_id, after)
 
-    return Response(stream_with_context(generate()), mimetype="application/json")
+    payload = job_payload(job)
+    payload["events"] = [json.loads(line) for _, line in events]
+    payload["next"] = events[-1][0] if events else after
+    payload["finished"] = finished
 
+    return jsonify(payload)
 
-@app.route("/load_results/", methods=["GET"])
-def load_results():
-
-    params = request.args
-    food = params.get("query", "")
 
-    cleaned_food = clean_filename(food)
-    try:
+@app.route("/api/jobs/<job_id>/events/", methods=["GET"])
+def job_events(job_id):
 
-        with open(RESULTS_DB_PATH / f"{cleaned_food}.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
+    if jobs.get(job_id) is None:
 
-    except FileNotFoundError:
+        return job_not_found(job_id)
 
-        return render_template(
-            "results.html",
-            query=food,
-            dishes=[],
-            recipe_dishes=[],
-            non_recipe_dishes=[],
-        )
+    after = request.args.get("after", -1, type=int)
 
-    try:
-        dishes = (
-            json.loads(data["dishes"])
-            if isinstance(data["dishes"], str)
-            else data["dishes"]
-        )
+    def generate():
 
-        recipes = (
-            json.loads(data["recipes"])
-            if isinstance(data["recipes"], str)
-            else data["recipes"]
-        )
+        for _, line in jobs.iter_events(job_id, after):
 
-    except:
-        dishes = []
-        recipes = []
+            yield line
 
-    dishes_not_with_recipes = []
-    recipe_dishes = []
+    return Response(
+        stream_with_context(cooperative(generate())), mimetype="application/json"
+    )
 
-    for i in recipes:
 
-        dishes_not_with_recipes.append(i["dish_name"])
-        recipe_dishes.append(i)
+@app.route("/load_results/", methods=["GET"])
+def load_results():
 
-    non_recipe_dishes = []
+    params = request.args
+    food = params.get("query", "")
 
-    for dish in dishes:
+    data = store.get_result(food)
 
-        if dish in dishes_not_with_recipes:
+    if data is None:
 
-            non_recipe_dishes.append(dish)
+        return render("results.html", view=ResultsView.empty(food))
 
-    return render_template(
-        "results.html",
-        query=food,
-        dishes=dishes,
-        recipe_dishes=recipe_dishes,
-        non_recipe_dishes=non_recipe_dishes,
+    return cached_page(
+        ("results", food),
+        data,
+        store.result_version(food),
+        lambda: render("results.html", view=ResultsView.from_result(food, data)),
     )
 
 
 if __name__ == "__main__":
 
+    # Not warm_worker(): the debug reloader's parent process serves nothing.
+    preload()
     app.run(debug=True)
@@ -0,0 +1,153 @@
+"""ASGI entry point: query jobs on the asyncio agent pipeline.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Jobs run as tasks on the event loop and their event streams are served from
+it too, so one worker can hold hundreds of queries that are waiting on the
+LLM API. Every other route is the Flask app, served through a thread pool.
+"""
+
+import asyncio
+import os
+import re
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+from agents import transport
+from pipeline import AsyncJobRunner, arun_query
+from telemetry import metrics
+
+JOB_EVENTS_PATH = re.compile(r"^/api/jobs/(?P<job_id>[0-9a-f]+)/events/$")
+
+# Pipelines this worker runs at once.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "200"))
+
+
+def run_job(query: str, refresh: bool = False):
+
+    return arun_query(query, flask_app.store, flask_app.writer, refresh)
+
+
+# Flask's /api/query/ queues the job and notifies this runner instead.
+runner = flask_app.runner = AsyncJobRunner(
+    flask_app.jobs, run_job, max_workers=JOB_WORKERS
+)
+
+wsgi = WsgiToAsgi(flask_app.app)
+
+
+async def lifespan(receive, send):
+
+    while True:
+
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+
+            flask_app.preload()
+            metrics.prune_shared()
+            metrics.REGISTRY.share(metrics.SHARED_DIR)
+            runner.start()
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+
+            await runner.stop()
+            await transport.aclose_async_client()
+            flask_app.writer.flush()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def job_events(job_id: str, scope, receive, send):
+
+    if await asyncio.to_thread(flask_app.jobs.get, job_id) is None:
+
+        await wsgi(scope, receive, send)  # Flask's 404
+        return
+
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+    # As Flask's request.args.get("after", -1, type=int) does.
+    try:
+
+        after = int(params.get("after", ["-1"])[0])
+
+    except ValueError:
+
+        after = -1
+
+    async def stream():
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+
+        async for _, line in flask_app.jobs.aiter_events(job_id, after):
+
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": line.encode("utf-8"),
+                    "more_body": True,
+                }
+            )
+
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+
+        while (await receive())["type"] != "http.disconnect":
+
+            pass
+
+    streaming = asyncio.ensure_future(stream())
+    watching = asyncio.ensure_future(disconnected())
+
+    try:
+
+        await asyncio.wait({streaming, watching}, return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+
+        # Only the stream stops when the client goes away; the job keeps going.
+        for task in (streaming, watching):
+
+            task.cancel()
+
+        await asyncio.gather(streaming, watching, return_exceptions=True)
+
+    if not streaming.cancelled() and streaming.exception() is not None:
+
+        raise streaming.exception()
+
+
+async def app(scope, receive, send):
+
+    if scope["type"] == "lifespan":
+
+        await lifespan(receive, send)
+        return
+
+    # Without lifespan events the runner starts with the first request.
+    runner.start()
+
+    match = (
+        JOB_EVENTS_PATH.match(scope.get("path", ""))
+        if scope["type"] == "http"
+        else None
+    )
+
+    if match:
+
+        await job_events(match["job_id"], scope, receive, send)
+
+    else:
+
+        await wsgi(scope, receive, send)
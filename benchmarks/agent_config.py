@@ -0,0 +1,173 @@
+"""Check the shared agent config: lazy loading, private request bodies under
+concurrent use, hot reloading and the cost of cloning a body template.
+
+From the repository root:
+
+    python -m benchmarks.agent_config
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+
+from agents import config
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+
+CLONES = 20000
+
+
+def lazy_checks() -> list:
+
+    loaded = config.config._settings is not None
+    body = recipes_client.common_settings_instance.get_body()
+
+    return [
+        ("importing the agents reads no settings", not loaded),
+        ("the first body loads them", config.config.version >= 1 and bool(body)),
+        (
+            "the agents share one settings dict",
+            diversifier_client.common_settings_instance.settings
+            is recipes_client.common_settings_instance.settings,
+        ),
+    ]
+
+
+def body_checks() -> list:
+
+    settings = recipes_client.common_settings_instance
+    first = settings.get_body()
+    second = settings.get_body()
+    first["messages"][0]["content"] = "changed"
+    first["messages"].append({"role": "user", "content": "extra"})
+    template = config.config.body_template("recipes")
+
+    try:
+
+        template["model"] = "changed"
+        frozen = False
+
+    except TypeError:
+
+        frozen = True
+
+    def build(i):
+
+        _, _, body = diversifier_client.build_request(f"dish {i}")
+        time.sleep(0)
+        user = [m["content"] for m in body["messages"] if m["role"] == "user"]
+
+        return len(user) == 1 and f"dish {i}\n" in user[0]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+
+        own_prompts = all(pool.map(build, range(500)))
+
+    return [
+        (
+            "bodies are private copies",
+            second["messages"][0]["content"] != "changed"
+            and len(second["messages"]) == len(template["messages"]),
+        ),
+        ("body templates are read-only", frozen),
+        ("concurrent requests keep their own prompts", own_prompts),
+    ]
+
+
+def reload_checks() -> list:
+
+    results = []
+    check_seconds = config.RELOAD_CHECK_SECONDS
+    config.RELOAD_CHECK_SECONDS = 0
+
+    try:
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            path = Path(tmp) / "common_settings.json"
+            shutil.copy(config.SETTING_PATH, path)
+            shared = config.Config(path)
+            agent = config.AgentSettings("recipes", shared=shared)
+            before = agent.get_body()
+
+            settings = json.loads(path.read_text(encoding="utf-8"))
+            settings["ai_api"]["body"]["default"]["temperature"] = 0.1
+            path.write_text(json.dumps(settings), encoding="utf-8")
+            after = agent.get_body()
+
+            results.append(
+                (
+                    "an edited file is reloaded",
+                    before["temperature"] != 0.1
+                    and after["temperature"] == 0.1
+                    and shared.version == 2,
+                )
+            )
+
+            path.write_text("{ not json", encoding="utf-8")
+            kept = agent.get_body()
+
+            results.append(
+                (
+                    "a broken file keeps the last settings",
+                    kept["temperature"] == 0.1 and shared.version == 2,
+                )
+            )
+
+    finally:
+
+        config.RELOAD_CHECK_SECONDS = check_seconds
+
+    return results
+
+
+def clone_timing():
+
+    template = config.config.body_template("recipes")
+    source = config.thaw(template)
+
+    t0 = time.perf_counter()
+
+    for _ in range(CLONES):
+
+        config.thaw(template)
+
+    thaw_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+
+    for _ in range(CLONES):
+
+        json.loads(json.dumps(source))
+
+    json_s = time.perf_counter() - t0
+
+    print(
+        f"body clone: {thaw_s / CLONES * 1e6:.2f}us from the frozen template, "
+        f"{json_s / CLONES * 1e6:.2f}us through json"
+    )
+
+
+def main():
+
+    results = lazy_checks()
+    results += body_checks()
+    results += reload_checks()
+    clone_timing()
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,190 @@
+"""Check the adaptive recipes batch size: that it learns per-model batch
+latency and parse failures, picks the size with the shortest expected wall
+time, skips cache hits and keeps its samples across restarts.
+
+From the repository root:
+
+    python -m benchmarks.batch_tuning
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.recipes.client as recipes_client
+from agents import batching
+from agents import cache as llm_cache
+from benchmarks.stub_llm import StubLLMServer, load_examples
+from telemetry import metrics
+
+LATENCY = 0.3
+CHARS_PER_SECOND = 20000
+DISHES = 10
+
+BATCHING = dict(
+    batching.DEFAULT_BATCHING_SETTINGS,
+    state_path="",
+    min_samples=3,
+    save_every_seconds=0,
+)
+
+
+def dishes(n: int = DISHES) -> list:
+
+    return json.loads(json.dumps(load_examples()[0][:n]))
+
+
+def timed_run(at_a_time=None) -> tuple:
+
+    timings = []
+    t0 = time.perf_counter()
+    recipes = recipes_client.process_list(
+        dishes(), at_a_time=at_a_time, timings=timings
+    )
+
+    return recipes, timings, time.perf_counter() - t0
+
+
+def learning_checks(tuner) -> list:
+
+    model = recipes_client.planned_model()
+    cold = recipes_client.batch_size(None, DISHES)
+
+    fixed = [timed_run(at_a_time=5) for _ in range(2)]
+    stats = tuner.stats(model)
+    recipes, auto, auto_s = timed_run()
+    fixed_s = min(elapsed for _, _, elapsed in fixed)
+
+    print(
+        f"{model}: {stats['first_chunk_s']:.2f}s to first chunk, "
+        f"{stats['item_s']:.3f}s per recipe over {stats['samples']} batches"
+    )
+    print(
+        f"{DISHES} dishes: {fixed_s:.2f}s in batches of 5, {auto_s:.2f}s in "
+        f"batches of {[t['size'] for t in auto]}"
+    )
+
+    return [
+        ("the budget decides before any samples", cold == 5),
+        ("batches are recorded per model", stats["samples"] == 4),
+        (
+            "learned batches use the free slots",
+            len(auto) == recipes_client.max_concurrency() and len(recipes) == DISHES,
+        ),
+        ("learned batches finish sooner", auto_s < fixed_s),
+    ]
+
+
+def failure_checks() -> list:
+
+    clean = batching.BatchTuner()
+    flaky = batching.BatchTuner()
+
+    for i in range(20):
+
+        clean.record("m", 4, 1.2, 1.0, False, {"batching": BATCHING})
+        flaky.record("m", 4, 1.2, 1.0, i % 2 == 0, {"batching": BATCHING})
+
+    def choose(tuner):
+
+        return tuner.choose("m", 4, 4, 1, 4, {"batching": BATCHING})
+
+    return [
+        (
+            "parse failures favour smaller batches",
+            choose(clean) == 2 and choose(flaky) == 1,
+        )
+    ]
+
+
+def cache_checks(tuner, tmp: Path) -> list:
+
+    model = recipes_client.planned_model()
+    llm_cache._cache = llm_cache.ResponseCache(tmp / "cache.sqlite3")
+    os.environ.pop("LLM_CACHE_BYPASS")
+
+    try:
+
+        recipes_client.process_list(dishes(4), at_a_time=4)
+        before = tuner.stats(model)["samples"]
+        recipes_client.process_list(dishes(4), at_a_time=4)
+        after = tuner.stats(model)["samples"]
+
+    finally:
+
+        os.environ["LLM_CACHE_BYPASS"] = "1"
+
+    return [("cache hits are not recorded", after == before)]
+
+
+def state_checks(tuner, tmp: Path) -> list:
+
+    model = recipes_client.planned_model()
+    tuner.save()
+    restarted = batching.BatchTuner(tuner.path)
+    size = tuner.path.stat().st_size
+
+    broken = tmp / "broken.json"
+    broken.write_text("{ not json", encoding="utf-8")
+    print(f"state file: {size} bytes")
+
+    return [
+        (
+            "samples survive a restart",
+            restarted.stats(model) == tuner.stats(model)
+            and restarted.choose(model, DISHES, 4, 1, 5, {"batching": BATCHING})
+            == tuner.choose(model, DISHES, 4, 1, 5, {"batching": BATCHING}),
+        ),
+        (
+            "a broken state file starts empty",
+            batching.BatchTuner(broken).models() == [],
+        ),
+    ]
+
+
+def main():
+
+    metrics.REGISTRY.reset()
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        tuner = batching._tuner = batching.BatchTuner(Path(tmp) / "batch_stats.json")
+
+        with StubLLMServer(
+            latency=LATENCY, stream_chars_per_second=CHARS_PER_SECOND
+        ) as stub:
+
+            settings = recipes_client.common_settings_instance.settings
+            stub.point_settings_at_stub(settings)
+            settings["batching"] = BATCHING
+
+            results = learning_checks(tuner)
+            results += failure_checks()
+            results += cache_checks(tuner, Path(tmp))
+            results += state_checks(tuner, Path(tmp))
+
+        results.append(
+            (
+                "estimates exposed",
+                'llm_batch_estimate{model="' in metrics.render(),
+            )
+        )
+
+        # Nothing left to save into the removed directory at exit.
+        batching._tuner = None
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,85 @@
+"""Check that repeated agent calls are answered from the response cache.
+
+Run from the repository root:
+
+    python -m benchmarks.cache_stub
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ.pop("LLM_CACHE_BYPASS", None)
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+from agents import cache as llm_cache
+from benchmarks.stub_llm import StubLLMServer
+
+LATENCY = 0.3
+
+
+def timed(fn, *args, **kwargs):
+
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+
+    return result, time.perf_counter() - t0
+
+
+def main():
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        llm_cache._cache = llm_cache.ResponseCache(Path(tmp) / "cache.sqlite3")
+
+        with StubLLMServer(latency=LATENCY) as stub:
+
+            for client in (diversifier_client, recipes_client):
+
+                stub.point_settings_at_stub(client.common_settings_instance.settings)
+
+            dishes, cold = timed(diversifier_client.process_diversification, "Rice")
+            _, warm = timed(diversifier_client.process_diversification, "Rice")
+            after_diversifier = stub.requests
+
+            recipes, cold_recipes = timed(
+                recipes_client.process_list, json.loads(json.dumps(dishes))
+            )
+            again, warm_recipes = timed(
+                recipes_client.process_list, json.loads(json.dumps(dishes))
+            )
+
+            async_dishes = asyncio.run(
+                diversifier_client.aprocess_diversification("Rice")
+            )
+
+            results.append(("diversifier hit skips the API", after_diversifier == 1))
+            results.append(("async calls read the cache", async_dishes == dishes))
+            results.append(("recipes hits skip the API", stub.requests == 3))
+            results.append(("cached recipes are identical", recipes == again))
+            results.append(("warm run is fast", warm + warm_recipes < LATENCY))
+
+        stats = llm_cache.stats()
+        llm_cache._cache = None
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    print(f"diversifier: cold {cold:.3f}s, warm {warm:.4f}s")
+    print(f"recipes: cold {cold_recipes:.3f}s, warm {warm_recipes:.4f}s")
+    print(f"cache stats: {stats}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,123 @@
+"""Disk and parse-time savings of the compact backend on the bundled data.
+
+Converts a copy of data/db into the compact format (gzip and uncompressed)
+and compares it with the JSON tree. From the repository root:
+
+    python -m benchmarks.compact_format
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from storage import CompactBackend, JsonBackend, ResultsView, clean_filename
+from storage.migrate import DEFAULT_SOURCE, import_json_tree
+
+ROUNDS = 200
+
+
+def disk_bytes(path: Path) -> int:
+
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def per_load(fn, *args) -> float:
+
+    t0 = time.perf_counter()
+
+    for _ in range(ROUNDS):
+
+        fn(*args)
+
+    return (time.perf_counter() - t0) / ROUNDS
+
+
+def results_page(backend, query: str) -> ResultsView:
+    """What /load_results/ needs: the result, joined into cards."""
+
+    view = ResultsView.from_result(query, backend.load_result(query))
+
+    for card in view.with_recipe + view.without_recipe:
+
+        (card.dish_name, card.local_name, card.similarity_score, card.image_url)
+
+    return view
+
+
+def same_result(source, target, query: str) -> bool:
+    """The compact result matches the JSON one; where ``recipes/`` holds a
+    copy of a recipe, that copy wins (as in ``import_json_tree``)."""
+
+    expected = source.load_result(query)
+    loaded = target.load_result(query)
+
+    if loaded["dishes"] != expected["dishes"]:
+
+        return False
+
+    return [dict(recipe) for recipe in loaded["recipes"]] == [
+        source.load_recipe(clean_filename(recipe["dish_name"]), query) or recipe
+        for recipe in expected["recipes"]
+    ]
+
+
+def main():
+
+    results = []
+    source = JsonBackend(DEFAULT_SOURCE)
+    dishes, queries = source.scan()
+    sizes = {"json": disk_bytes(source.recipes_path) + disk_bytes(source.results_path)}
+    timings = {"json": sum(per_load(results_page, source, q) for q in queries)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        for compression in ("none", "gzip"):
+
+            name = f"compact ({compression})"
+            target = CompactBackend(Path(tmp) / compression, compression=compression)
+            import_json_tree(source, target)
+
+            sizes[name] = disk_bytes(target.base_path)
+            timings[name] = sum(per_load(results_page, target, q) for q in queries)
+
+            cards = [
+                card for q in queries for card in results_page(target, q).with_recipe
+            ]
+            lazy = bool(cards) and all(not card.recipe.loaded for card in cards)
+            same_recipes = all(
+                target.load_recipe(dish, variant) == source.load_recipe(dish, variant)
+                for dish in dishes
+                for variant in dishes[dish]
+            )
+            same_results = all(same_result(source, target, q) for q in queries)
+
+            results.append((f"{name}: recipes round-trip", same_recipes))
+            results.append((f"{name}: results round-trip", same_results))
+            results.append((f"{name}: results page opens no recipe file", lazy))
+            results.append((f"{name}: smaller on disk", sizes[name] < sizes["json"]))
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    print(f"{len(queries)} results, {sum(len(v) for v in dishes.values())} recipes")
+
+    for name, size in sizes.items():
+
+        print(
+            f"{name:>16}: {size / 1024:7.1f} KiB ({size / sizes['json']:.0%}), "
+            f"results page load {timings[name] * 1e6:.0f}us "
+            f"({timings[name] / timings['json']:.0%})"
+        )
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
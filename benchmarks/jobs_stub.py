@@ -0,0 +1,453 @@
+"""Check that /api/query/ jobs are shared by concurrent identical queries,
+within a worker and across worker processes, that a job runs to the end
+and saves its result with nobody listening, that a dead worker's job
+is picked up again without replaying its earlier events, that a job
+lease is held by one process at a time, and that the asyncio runner keeps the event loop
+running while another worker holds the jobs database.
+
+Run from the repository root:
+
+    python -m benchmarks.jobs_stub
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+import app as webapp
+from agents import batching
+from benchmarks.stub_llm import StubLLMServer
+from pipeline import AsyncJobRunner, JobQueue, JobRunner
+from pipeline.lease import Lease
+from storage import PersistenceWriter, open_store
+
+CLIENTS = 8
+WORKERS = 2
+QUERY = "Fried Rice"
+LOCK_SECONDS = 1.0
+LEASE_PROCESSES = 4
+LEASE_ROUNDS = 2000
+
+
+def submit(client, query: str = QUERY) -> dict:
+
+    return client.post("/api/query/", data={"food": query}).get_json()
+
+
+def query_lines(client, query: str = QUERY):
+    """Submit ``query``; return its job id and its event lines."""
+
+    job = submit(client, query)
+    lines = client.get(job["events_url"]).data.decode().splitlines()
+
+    return job["job_id"], lines
+
+
+def burst(clients: int) -> list:
+
+    results = [None] * clients
+
+    def fetch(i):
+
+        results[i] = query_lines(webapp.app.test_client())
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(clients)]
+
+    for thread in threads:
+
+        thread.start()
+
+    for thread in threads:
+
+        thread.join()
+
+    return results
+
+
+def use_store(path: Path):
+
+    webapp.store = open_store(path)
+    webapp.writer = PersistenceWriter(webapp.store)
+    webapp.jobs = JobQueue(path / "jobs.sqlite3", stale_after=1.0)
+    webapp.runner = JobRunner(
+        webapp.jobs, webapp.run_job, heartbeat_interval=0.2, poll_interval=0.1
+    )
+
+
+def use_fresh_store() -> Path:
+    """Point the app at an empty store so no run can reuse stored recipes."""
+
+    path = Path(tempfile.mkdtemp())
+    use_store(path)
+
+    return path
+
+
+def wait_finished(job_id: str, timeout: float = 30.0) -> dict:
+
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+
+        job = webapp.jobs.get(job_id)
+
+        if job["state"] in ("done", "failed"):
+
+            return job
+
+        time.sleep(0.05)
+
+    return webapp.jobs.get(job_id)
+
+
+def worker(path: str, base_url: str):
+    """Entry point of a separate worker process sharing ``path``."""
+
+    use_store(Path(path))
+
+    for client in (diversifier_client, recipes_client):
+
+        client.common_settings_instance.settings["ai_api"]["urls"][
+            "base_api_url"
+        ] = base_url
+
+    # Stub timings stay out of the saved batching state.
+    batching._tuner = batching.BatchTuner()
+
+    job_id, lines = query_lines(webapp.app.test_client())
+    sys.stdout.write(job_id + "\n" + lines[-1] + "\n")
+
+
+def contend(path: str, rounds: str, start: str):
+    """Entry point of a worker process that, from time ``start``, tries
+    ``rounds`` times to take and remove the lease at ``path``, and prints
+    how often it found another holder inside it."""
+
+    inside = Path(path).with_suffix(".holder")
+    overlaps = 0
+
+    time.sleep(max(0.0, float(start) - time.time()))
+
+    for _ in range(int(rounds)):
+
+        lease = Lease(Path(path))
+
+        if not lease.try_acquire():
+
+            continue
+
+        try:
+
+            os.close(os.open(inside, os.O_CREAT | os.O_EXCL))
+            time.sleep(0.0002)
+            os.remove(inside)
+
+        except FileExistsError:
+
+            overlaps += 1
+
+        lease.release(remove=True)
+
+    print(overlaps)
+
+
+def lease_overlaps(path: Path) -> int:
+    """Times processes contending for one lease found it held twice."""
+
+    # Started together once every process has imported this module.
+    start = time.time() + 3.0
+    workers = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                __spec__.name,
+                "--lease",
+                str(path / "job.lock"),
+                str(LEASE_ROUNDS),
+                str(start),
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(LEASE_PROCESSES)
+    ]
+
+    return sum(int(w.communicate()[0]) for w in workers)
+
+
+def claim_and_die(path: str, owner: str = None):
+    """Entry point of a worker process that claims the queued job (as
+    ``owner``, by default itself), sends its first event and exits."""
+
+    queue = JobQueue(Path(path) / "jobs.sqlite3")
+    job = queue.claim(owner or JobRunner(queue, None).owner)
+    queue.append(job["id"], json.dumps({"status": "start"}) + "\n")
+
+
+def dead_claim(path: Path, owner: str = None):
+
+    subprocess.run(
+        [sys.executable, "-m", __spec__.name, "--claim", str(path)]
+        + ([owner] if owner else []),
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+async def no_events(query: str, refresh: bool = False):
+
+    for line in ():
+
+        yield line
+
+
+def leases_broken(path: Path, name: str) -> tuple:
+    """A queue with one job whose lease directory is a file, so that claims
+    fail with an OSError until ``mend`` is called; ``(queue, job, mend)``."""
+
+    queue = JobQueue(path / f"{name}.sqlite3")
+    job, _ = queue.submit(QUERY)
+    queue.lease_path.rmdir()
+    queue.lease_path.touch()
+
+    def mend():
+
+        queue.lease_path.unlink()
+        queue.lease_path.mkdir()
+
+    return queue, job, mend
+
+
+def survives_lease_errors(path: Path) -> bool:
+    """Whether a JobRunner still runs a job after its claims have failed."""
+
+    queue, job, mend = leases_broken(path, "sync")
+    runner = JobRunner(queue, lambda query, refresh: iter(()), poll_interval=0.05)
+    runner.start()
+    time.sleep(0.3)
+    mend()
+    deadline = time.monotonic() + 5.0
+
+    while queue.get(job["id"])["state"] != "done" and time.monotonic() < deadline:
+
+        time.sleep(0.05)
+
+    return queue.get(job["id"])["state"] == "done"
+
+
+async def asurvives_lease_errors(path: Path) -> bool:
+    """``survives_lease_errors`` for an AsyncJobRunner."""
+
+    queue, job, mend = leases_broken(path, "async")
+    runner = AsyncJobRunner(queue, no_events, poll_interval=0.05)
+    runner.start()
+    await asyncio.sleep(0.3)
+    mend()
+    deadline = time.monotonic() + 5.0
+
+    while queue.get(job["id"])["state"] != "done" and time.monotonic() < deadline:
+
+        await asyncio.sleep(0.05)
+
+    await runner.stop()
+
+    return queue.get(job["id"])["state"] == "done"
+
+
+async def loop_stall(path: Path) -> float:
+    """Longest gap between ticks of the event loop while an AsyncJobRunner
+    polls a jobs database that another connection holds write-locked for
+    ``LOCK_SECONDS``, and a client follows a job's events."""
+
+    queue = JobQueue(path / "locked.sqlite3")
+    job, _ = queue.submit(QUERY)
+    runner = AsyncJobRunner(queue, no_events, poll_interval=0.05)
+    holder = sqlite3.connect(queue.path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(LOCK_SECONDS, holder.execute, ("ROLLBACK",)).start()
+
+    async def follow():
+
+        async for _ in queue.aiter_events(job["id"]):
+
+            pass
+
+    runner.start()
+    following = asyncio.ensure_future(follow())
+    worst = 0.0
+    last = time.perf_counter()
+    deadline = last + LOCK_SECONDS * 1.5
+
+    while last < deadline:
+
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        worst = max(worst, now - last)
+        last = now
+
+    following.cancel()
+    await runner.stop()
+
+    return worst
+
+
+def main():
+
+    results = []
+
+    with StubLLMServer(latency=0.3) as stub:
+
+        for client in (diversifier_client, recipes_client):
+
+            stub.point_settings_at_stub(client.common_settings_instance.settings)
+
+        use_fresh_store()
+        _, single = query_lines(webapp.app.test_client())
+        per_run = stub.requests
+
+        use_fresh_store()
+        stub.requests = 0
+        t0 = time.perf_counter()
+        streams = burst(CLIENTS)
+        elapsed = time.perf_counter() - t0
+        in_process = stub.requests
+
+        # Nobody reads the events; the job still finishes and is saved.
+        use_fresh_store()
+        job = submit(webapp.app.test_client())
+        unattended = wait_finished(job["job_id"])
+        webapp.writer.flush()
+        saved = webapp.store.get_result(QUERY) is not None
+        served = "result_url" in submit(webapp.app.test_client())
+
+        # A job left running by a dead worker on another host is picked up
+        # again once its heartbeat goes stale.
+        path = use_fresh_store()
+        orphan, _ = webapp.jobs.submit(QUERY)
+        dead_claim(path, "gone:0")
+        webapp.runner.start()
+        recovered = wait_finished(orphan["id"])
+
+        # One that died on this host is queued again through its free lease,
+        # well before its heartbeat goes stale.
+        path = use_fresh_store()
+        dead, _ = webapp.jobs.submit(QUERY)
+        dead_claim(path)
+        claimed = webapp.jobs.get(dead["id"])
+        webapp.runner.start()
+        revived = wait_finished(dead["id"])
+        replayed = [
+            json.loads(line)["status"] for _, line in webapp.jobs.events(dead["id"])
+        ]
+
+        # Separate worker processes share the job through the jobs table only.
+        path = use_fresh_store()
+        stub.requests = 0
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    __spec__.name,
+                    "--worker",
+                    str(path),
+                    stub.base_url,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+            for _ in range(WORKERS)
+        ]
+        outputs = [w.communicate()[0].splitlines() for w in workers]
+        workers_ok = all(out and out[-1] == single[-1] for out in outputs)
+        worker_jobs = {out[-2] for out in outputs if len(out) > 1}
+        across_workers = stub.requests
+
+    stall = asyncio.run(loop_stall(use_fresh_store()))
+    overlaps = lease_overlaps(use_fresh_store())
+    survived = survives_lease_errors(use_fresh_store())
+    asurvived = asyncio.run(asurvives_lease_errors(use_fresh_store()))
+
+    results.append(("one job in-process", len({job_id for job_id, _ in streams}) == 1))
+    results.append(("identical streams", all(s == streams[0] for s in streams)))
+    results.append(("one run in-process", in_process == per_run))
+    results.append(
+        ("streams end with done", json.loads(single[-1])["status"] == "done")
+    )
+    results.append(("unattended job done", unattended["state"] == "done"))
+    results.append(("unattended result saved", saved))
+    results.append(("next visitor served from store", served))
+    results.append(("orphaned job recovered", recovered["state"] == "done"))
+    results.append(
+        (
+            "dead worker's job taken over at once",
+            claimed["state"] == "running"
+            and revived["state"] == "done"
+            and revived["started_at"] - claimed["started_at"] < webapp.jobs.stale_after,
+        )
+    )
+    results.append(
+        (
+            "taken over job replays one run",
+            replayed[0] == "restart"
+            and replayed.count("start") == 1
+            and replayed[-1] == "done",
+        )
+    )
+    results.append(("workers finished", workers_ok))
+    results.append(("one job across workers", len(worker_jobs) == 1))
+    results.append(("one run across workers", across_workers == per_run))
+    results.append(("a locked database does not stall the loop", stall < 0.2))
+    results.append(("one lease holder at a time", overlaps == 0))
+    results.append(("the dispatcher outlives a failed claim", survived))
+    results.append(("the async dispatcher outlives a failed claim", asurvived))
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    print(
+        f"{CLIENTS} concurrent clients: {in_process} LLM calls "
+        f"(one run makes {per_run}, {CLIENTS * per_run} without sharing), "
+        f"{elapsed:.2f}s"
+    )
+    print(f"{WORKERS} worker processes: {across_workers} LLM calls")
+    print(
+        f"event loop stalled for at most {stall * 1000:.0f}ms while the jobs "
+        f"database was locked for {LOCK_SECONDS:.1f}s"
+    )
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1:2] == ["--worker"]:
+
+        worker(*sys.argv[2:4])
+
+    elif sys.argv[1:2] == ["--claim"]:
+
+        claim_and_die(*sys.argv[2:4])
+
+    elif sys.argv[1:2] == ["--lease"]:
+
+        contend(*sys.argv[2:5])
+
+    else:
+
+        raise SystemExit(0 if main() else 1)
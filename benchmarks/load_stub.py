@@ -0,0 +1,273 @@
+"""Load-test /api/query/ under each deployment against the stub LLM server.
+
+Modes: ``sync`` is gunicorn's sync worker with 4 threads (the Dockerfile
+setup), ``gevent`` is ``gunicorn_gevent.conf.py`` and ``async`` is uvicorn on
+``asgi.py``. Each is started with ``--workers`` workers (1 by default) and a
+throwaway store, then gets ``--queries`` distinct queries at once.
+
+Run from the repository root:
+
+    python -m benchmarks.load_stub [--queries 100] [--latency 0.5]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+from benchmarks.stub_llm import StubLLMServer
+
+
+def free_port() -> int:
+
+    with socket.socket() as sock:
+
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+ROOT_PATH = Path(__file__).parent.parent
+
+# One worker each, so the numbers compare what a single worker can hold.
+MODES = ("sync", "gevent", "async")
+
+
+def server_command(mode: str, port: int, workers: int) -> list:
+
+    bind = f"127.0.0.1:{port}"
+
+    if mode == "async":
+
+        return [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.stub_app:asgi_app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ]
+
+    command = [sys.executable, "-m", "gunicorn", "--bind", bind]
+
+    if mode == "gevent":
+
+        command += ["-c", str(ROOT_PATH / "gunicorn_gevent.conf.py")]
+
+    else:
+
+        # The Dockerfile's sync worker: 4 threads per process.
+        command += ["--threads", "4"]
+
+    return command + [
+        "--workers",
+        str(workers),
+        "--log-level",
+        "warning",
+        "benchmarks.stub_app:app",
+    ]
+
+
+async def wait_until_up(port: int, timeout: float = 20.0):
+
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+
+        try:
+
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+
+        except OSError:
+
+            await asyncio.sleep(0.1)
+
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def run_load(port: int, queries: int) -> dict:
+
+    import httpx
+
+    latencies = []
+    first_events = []
+    failures = 0
+
+    async def one(client, index):
+
+        nonlocal failures
+
+        started = time.perf_counter()
+        first = None
+        last = ""
+
+        try:
+
+            response = await client.post(
+                "/api/query/", data={"food": f"load test dish {index}"}
+            )
+            response.raise_for_status()
+            events_url = response.json()["events_url"]
+
+            # A malformed ?after= streams from the start, as Flask reads it.
+            if index == 0:
+
+                events_url += "?after=start"
+
+            async with client.stream("GET", events_url) as response:
+
+                async for line in response.aiter_lines():
+
+                    if first is None:
+
+                        first = time.perf_counter() - started
+
+                    if line:
+
+                        last = line
+
+        except httpx.HTTPError:
+
+            failures += 1
+            return
+
+        if '"done"' not in last:
+
+            failures += 1
+            return
+
+        latencies.append(time.perf_counter() - started)
+        first_events.append(first)
+
+    # No keep-alive: gunicorn drops connections idle for 2s, racing a client
+    # that reuses the submit request's connection for the event stream.
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits
+    ) as client:
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(queries)))
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    first_events.sort()
+
+    def pct(values, p):
+
+        return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+    return {
+        "completed": len(latencies),
+        "failed": failures,
+        "elapsed_s": elapsed,
+        "throughput_qps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_s": pct(latencies, 0.50),
+        "p95_s": pct(latencies, 0.95),
+        "first_event_p50_s": pct(first_events, 0.50),
+    }
+
+
+def bench_mode(mode: str, stub: StubLLMServer, queries: int, workers: int) -> dict:
+
+    port = free_port()
+    env = dict(
+        os.environ, STUB_LLM_URL=stub.base_url, STUB_STORE_PATH=tempfile.mkdtemp()
+    )
+    server = subprocess.Popen(
+        server_command(mode, port, workers),
+        cwd=ROOT_PATH,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+    try:
+
+        asyncio.run(wait_until_up(port))
+        stub.requests = 0
+        stub.max_in_flight = 0
+        result = asyncio.run(run_load(port, queries))
+        result["llm_calls"] = stub.requests
+        result["max_llm_in_flight"] = stub.max_in_flight
+
+        return result
+
+    finally:
+
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args(argv)
+    modes = args.modes.split(",")
+
+    results = {}
+
+    # Large SSE chunks keep the stub's own CPU use out of the comparison.
+    with StubLLMServer(
+        latency=args.latency, unique_dishes=True, stream_chunk_chars=1024
+    ) as stub:
+
+        for mode in modes:
+
+            results[mode] = bench_mode(mode, stub, args.queries, args.workers)
+
+    for mode, result in results.items():
+
+        print(
+            f"{mode:>6}: {result['completed']}/{args.queries} queries in "
+            f"{result['elapsed_s']:.2f}s ({result['throughput_qps']:.1f}/s), "
+            f"p50 {result['p50_s']:.2f}s, p95 {result['p95_s']:.2f}s, "
+            f"first event p50 {result['first_event_p50_s']:.2f}s, "
+            f"{result['llm_calls']} LLM calls, "
+            f"{result['max_llm_in_flight']} max in flight"
+        )
+
+    checks = [
+        ("all queries completed", all(r["failed"] == 0 for r in results.values()))
+    ]
+
+    for mode in ("gevent", "async"):
+
+        if mode in results and "sync" in results:
+
+            checks.append(
+                (
+                    f"{mode} faster under load",
+                    results[mode]["elapsed_s"] < results["sync"]["elapsed_s"],
+                )
+            )
+
+    for name, ok in checks:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in checks)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main(sys.argv[1:]) else 1)
@@ -0,0 +1,280 @@
+"""Check the /metrics endpoint and the levelled agent logger against the stub LLM.
+
+Runs a query through the app's test client, loads its results page and
+checks that every pipeline stage, the token and cache counters and injected
+failures show up in /metrics, and that worker processes sharing a metrics
+directory are summed. From the repository root:
+
+    python -m benchmarks.metrics_stub
+"""
+
+import contextlib
+import io
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ.pop("LLM_CACHE_BYPASS", None)
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+import app as webapp
+from agents import cache as llm_cache
+from benchmarks.stub_llm import StubLLMServer
+from pipeline import JobQueue, JobRunner
+from storage import PersistenceWriter, open_store
+from telemetry import metrics
+
+STAGES = ("diversifier_request", "json_parse", "recipes_batch", "persist", "render")
+DISH_PAUSE = 0.05
+WORKER_RETRIES = (3, 4)
+
+SAMPLE_LINE = re.compile(
+    r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.e+-]+$'
+)
+
+
+def value(text: str, name: str, **labels) -> float:
+    """Sum of the ``name`` samples of a /metrics page that carry ``labels``."""
+
+    wanted = [f'{key}="{label}"' for key, label in labels.items()]
+    total = 0.0
+
+    for line in text.splitlines():
+
+        sample, _, number = line.rpartition(" ")
+
+        if sample.split("{")[0] == name and all(w in sample for w in wanted):
+
+            total += float(number)
+
+    return total
+
+
+def run_query(client, food: str, **params):
+
+    job = client.post("/api/query/", data={"food": food, **params}).get_json()
+    response = client.get(job["events_url"])
+
+    return response.get_data(as_text=True).splitlines()[-1]
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+
+        self.messages.append(record.getMessage())
+
+
+def log_checks() -> list:
+
+    settings = recipes_client.common_settings_instance
+    logger = settings.logger
+    records = Records()
+    level, debug = logger.level, settings.debug
+
+    logger.addHandler(records)
+    logger.setLevel(logging.INFO)
+
+    try:
+
+        settings.debug = False
+        settings.log("quiet")
+        settings.debug = True
+        settings.log("loud")
+
+    finally:
+
+        logger.removeHandler(records)
+        logger.setLevel(level)
+        settings.debug = debug
+
+    return [
+        ("log() is off without log=True", "quiet" not in records.messages),
+        ("log() is on with log=True", "loud" in records.messages),
+    ]
+
+
+def count_and_exit(directory: str, retries: str):
+    """Entry point of a worker process that shares ``directory``, counts
+    ``retries`` and one render, and exits."""
+
+    metrics.REGISTRY.share(Path(directory))
+    metrics.LLM_RETRIES.inc(int(retries), agent="recipes", reason="parse")
+    metrics.observe("render", 0.01)
+
+
+def shared_checks() -> list:
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        for retries in WORKER_RETRIES:
+
+            subprocess.run(
+                [sys.executable, "-m", __spec__.name, "--count", tmp, str(retries)],
+                check=True,
+            )
+
+        registry = metrics.Registry()
+        registry.counter("llm_retries_total", "Retries.", ("agent", "reason")).inc(
+            agent="recipes", reason="parse"
+        )
+        registry.share(Path(tmp))
+        first = registry.render()
+        again = registry.render()
+
+        metrics.prune_shared(Path(tmp))
+        pruned = registry.render()
+
+    retries = value(first, "llm_retries_total", agent="recipes", reason="parse")
+
+    return [
+        ("workers' counters summed", retries == sum(WORKER_RETRIES) + 1),
+        (
+            "workers' histograms summed",
+            value(first, "pipeline_stage_seconds_count", stage="render")
+            == len(WORKER_RETRIES),
+        ),
+        ("exited workers still counted", again == first),
+        (
+            "a new server drops exited workers' files",
+            value(pruned, "llm_retries_total", agent="recipes", reason="parse") == 1,
+        ),
+    ]
+
+
+def slow_reader_span(query: str) -> tuple:
+    """``(diversifier_request seconds, seconds spent reading)`` of a
+    diversification whose reader pauses ``DISH_PAUSE`` after every dish."""
+
+    before = metrics.STAGE_SECONDS.snapshot(stage="diversifier_request")["sum"]
+    started = time.perf_counter()
+
+    for _ in diversifier_client.iter_diversification(query):
+
+        time.sleep(DISH_PAUSE)
+
+    read = time.perf_counter() - started
+    after = metrics.STAGE_SECONDS.snapshot(stage="diversifier_request")["sum"]
+
+    return after - before, read
+
+
+def main():
+
+    results = log_checks() + shared_checks()
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp)
+        llm_cache._cache = llm_cache.ResponseCache(path / "cache.sqlite3")
+        webapp.store = open_store(path)
+        webapp.writer = PersistenceWriter(webapp.store)
+        webapp.jobs = JobQueue(path / "jobs.sqlite3")
+        webapp.runner = JobRunner(webapp.jobs, webapp.run_job)
+        webapp.pages.clear()
+        metrics.REGISTRY.reset()
+
+        client = webapp.app.test_client()
+        stdout = io.StringIO()
+
+        with StubLLMServer() as stub, contextlib.redirect_stdout(stdout):
+
+            for agent in (diversifier_client, recipes_client):
+
+                stub.point_settings_at_stub(agent.common_settings_instance.settings)
+
+            first = run_query(client, "Rice")
+            first_requests = stub.requests
+            again = run_query(client, "Rice", refresh="1")
+            refresh_requests = stub.requests - first_requests
+            cached = diversifier_client.process_diversification("Rice")
+            webapp.writer.flush()
+            page = client.get("/load_results/", query_string={"query": "Rice"})
+            span, read = slow_reader_span("Soup")
+
+            stub.error_rate = 1.0
+            failed = diversifier_client.process_diversification("Noodles")
+
+            response = client.get("/metrics")
+
+        llm_cache._cache = None
+
+    text = response.get_data(as_text=True)
+    samples = [line for line in text.splitlines() if not line.startswith("#")]
+
+    results.append(("queries finished", '"done"' in first and '"done"' in again))
+    results.append(("a refresh asks the LLM again", refresh_requests == first_requests))
+    results.append(("results page rendered", page.status_code == 200))
+    results.append(("pipeline prints nothing to stdout", stdout.getvalue() == ""))
+    results.append(("served as Prometheus text", response.mimetype == "text/plain"))
+    results.append(
+        (
+            "every sample line parses",
+            bool(samples) and all(map(SAMPLE_LINE.match, samples)),
+        )
+    )
+
+    for stage in STAGES:
+
+        count = value(text, "pipeline_stage_seconds_count", stage=stage)
+        results.append((f"{stage} span recorded", count > 0))
+
+    for kind in ("prompt", "completion"):
+
+        tokens = value(text, "llm_tokens_total", kind=kind)
+        results.append((f"{kind} tokens counted", tokens > 0))
+
+    results.append(
+        (
+            "cache hits counted",
+            bool(cached) and value(text, "llm_cache_events_total", event="hits") > 0,
+        )
+    )
+    results.append(
+        (
+            "injected failure counted",
+            failed == []
+            and value(text, "llm_failures_total", agent="diversifier", reason="500")
+            == 1,
+        )
+    )
+    results.append(("retries counter exposed", "# TYPE llm_retries_total" in text))
+    results.append(("a slow reader is not timed as the request", span < read / 2))
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    for stage in STAGES:
+
+        count = value(text, "pipeline_stage_seconds_count", stage=stage)
+        total = value(text, "pipeline_stage_seconds_sum", stage=stage)
+        print(
+            f"{stage:>20}: {count:.0f} spans, "
+            f"mean {total / count * 1000 if count else 0:.2f}ms"
+        )
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1:2] == ["--count"]:
+
+        count_and_exit(*sys.argv[2:4])
+
+    else:
+
+        raise SystemExit(0 if main() else 1)
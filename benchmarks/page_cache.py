@@ -0,0 +1,106 @@
+"""Check that /load_results/ and /dish/ pages are served from the page cache,
+answer conditional requests with 304 and are re-rendered after a write.
+
+Runs on a copy of the bundled data/db tree. From the repository root:
+
+    python -m benchmarks.page_cache
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+
+import app as webapp
+from storage import PageCache, PersistenceWriter, open_store
+
+ROUNDS = 200
+QUERY = "rice"
+
+
+def per_request(client, url: str, **kwargs) -> float:
+
+    t0 = time.perf_counter()
+
+    for _ in range(ROUNDS):
+
+        client.get(url, **kwargs)
+
+    return (time.perf_counter() - t0) / ROUNDS
+
+
+def main():
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "db"
+        shutil.copytree(webapp.BASE_DB_PATH / "recipes", path / "recipes")
+        shutil.copytree(webapp.BASE_DB_PATH / "results", path / "results")
+
+        webapp.store = open_store(path)
+        webapp.writer = PersistenceWriter(webapp.store)
+        client = webapp.app.test_client()
+
+        dish = webapp.store.get_result(QUERY)["recipes"][0]["dish_name"]
+        urls = {
+            "results": f"/load_results/?query={QUERY}",
+            "dish": f"/dish/{dish.replace(' ', '-').lower()}/?from={QUERY}",
+        }
+
+        for name, url in urls.items():
+
+            webapp.pages = PageCache(max_entries=0)
+            uncached = per_request(client, url)
+
+            webapp.pages = PageCache()
+            first = client.get(url)
+            cached = per_request(client, url)
+            again = client.get(url)
+            not_modified = client.get(
+                url, headers={"If-None-Match": first.headers["ETag"]}
+            )
+            revalidate = per_request(
+                client, url, headers={"If-None-Match": first.headers["ETag"]}
+            )
+
+            results.append((f"{name}: cached page identical", again.data == first.data))
+            results.append(
+                (f"{name}: 304 on matching ETag", not_modified.status_code == 304)
+            )
+            results.append(
+                (f"{name}: Last-Modified sent", "Last-Modified" in first.headers)
+            )
+            results.append((f"{name}: cached is faster", cached < uncached))
+
+            print(
+                f"{name}: uncached {uncached * 1e3:.2f}ms, cached {cached * 1e3:.2f}ms, "
+                f"304 {revalidate * 1e3:.2f}ms per request"
+            )
+
+        # A write replaces the entry, so the next view is rendered again.
+        data = webapp.store.get_result(QUERY)
+        before = client.get(urls["results"])
+        webapp.store.put_result(QUERY, data["dishes"], data["recipes"][:1])
+        after = client.get(urls["results"])
+        stale = client.get(
+            urls["results"], headers={"If-None-Match": before.headers["ETag"]}
+        )
+
+        results.append(("write invalidates the page", after.data != before.data))
+        results.append(("old ETag is not 304", stale.status_code == 200))
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,341 @@
+"""Fuzz and time the reply parser on replies built from ``agents/examples/``.
+
+Every case is an example list (or one of its objects) rendered compactly or
+indented, wrapped in code fences and prose, given strings with newlines and
+backticks, trailing commas, or cut off at a random point. The whole-reply
+parser must return every complete element of each (and raise after the
+salvaged ones of a cut-off reply); the streaming parser must agree with it
+when the reply arrives in random chunks. The old ``replace``/``json.loads``
+parse is scored on the same corpus, and both are timed on a ~100KB reply.
+From the repository root:
+
+    python -m benchmarks.parse_fuzz [--cases 2000] [--seed 0]
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+from agents.parsing import iter_json_items
+from agents.streaming import JsonListParser, iter_json_list, repair_json
+
+EXAMPLE_PATH = Path(__file__).parent.parent / "agents" / "examples"
+EXAMPLES = ("diversifier_output.json", "recipes_output.json")
+
+SEPARATORS = (",", ", ", ",\n  ", ",\n")
+WRAPPERS = (
+    ("", ""),
+    ("```json\n", "\n```"),
+    ("```\n", "\n```"),
+    ("Here is the JSON you asked for:\n```json\n", "\n```\nEnjoy!"),
+    ("", "\n\nNote: quantities are approximate."),
+)
+# Brackets in the prose before the fence: only the whole-reply parser looks
+# for the fence, a stream cannot know one is coming.
+BRACKET_PROSE = ("Results [3 of them] {as JSON}:\n```json\n", "\n```")
+SPICED = '\nServe with `sambal` and a "squeeze" of lime; no ```fences``` here.'
+
+
+def old_parse(text: str) -> list:
+    """What both agents did before ``agents.parsing``."""
+
+    text = text.replace("`json", "").replace("\n", "").replace("`", "")
+
+    try:
+
+        return json.loads(text)
+
+    except ValueError:
+
+        return json.loads(repair_json(text))
+
+
+def run(parse, text: str) -> tuple:
+    """``(items, error)`` of draining ``parse(text)``."""
+
+    items = []
+
+    try:
+
+        for item in parse(text):
+
+            items.append(item)
+
+        return items, None
+
+    except ValueError as e:
+
+        return items, e
+
+
+def stream_parse(rng: random.Random):
+
+    def parse(text):
+
+        chunks = []
+        pos = 0
+
+        while pos < len(text):
+
+            size = rng.randint(1, 200)
+            chunks.append(text[pos : pos + size])
+            pos += size
+
+        return iter_json_list(chunks)
+
+    return parse
+
+
+def bad_element_in_chunk() -> tuple:
+    """``(elements, count, error)`` of one chunk holding a good element and
+    then one that cannot be decoded or repaired."""
+
+    parser = JsonListParser()
+    elements = parser.feed('[{"dish_name": "Pilaf"}, {"dish_name": "Plov" 1}')
+
+    try:
+
+        parser.close()
+
+    except ValueError as e:
+
+        return elements, parser.count, e
+
+    return elements, parser.count, None
+
+
+def spice(rng: random.Random, items: list) -> list:
+    """A copy of ``items`` with newlines, quotes and backticks in a string."""
+
+    items = json.loads(json.dumps(items))
+    item = rng.choice(items)
+    key = rng.choice([k for k, v in item.items() if isinstance(v, str)])
+    item[key] += SPICED
+
+    return items
+
+
+def make_case(rng: random.Random, examples: list) -> dict:
+    """One reply: ``text``, the ``expected`` elements and whether it is cut."""
+
+    items = rng.choice(examples)
+    items = items[: rng.randint(1, len(items))]
+
+    if rng.random() < 0.3:
+
+        items = spice(rng, items)
+
+    indent = rng.choice((None, 2))
+    rendered = [json.dumps(item, indent=indent, ensure_ascii=False) for item in items]
+    sep = rng.choice(SEPARATORS)
+
+    single = len(items) == 1 and rng.random() < 0.3
+    streamable = not single
+
+    if single:
+
+        payload = rendered[0]
+        ends = [len(payload)]
+
+    else:
+
+        payload = "["
+        ends = []
+
+        for i, text in enumerate(rendered):
+
+            payload += (sep if i else "") + text
+            ends.append(len(payload))
+
+        if rng.random() < 0.2:
+
+            payload += ","
+
+        payload += "]"
+
+    if rng.random() < 0.1:
+
+        prefix, suffix = BRACKET_PROSE
+        streamable = False
+
+    else:
+
+        prefix, suffix = rng.choice(WRAPPERS)
+
+    text = prefix + payload + suffix
+    cut = None
+
+    if rng.random() < 0.4:
+
+        cut = rng.randint(1, len(payload) - 1)
+        text = prefix + payload[:cut]
+
+    complete = [item for item, end in zip(items, ends) if cut is None or end <= cut]
+
+    return {
+        "text": text,
+        "expected": complete,
+        "cut": cut is not None,
+        "streamable": streamable,
+    }
+
+
+def fuzz(cases: int, seed: int) -> dict:
+
+    rng = random.Random(seed)
+    examples = [
+        json.loads((EXAMPLE_PATH / name).read_text(encoding="utf-8"))
+        for name in EXAMPLES
+    ]
+    stream = stream_parse(rng)
+    report = {
+        "cases": cases,
+        "cut": 0,
+        "exact": 0,
+        "stream_agrees": 0,
+        "streamable": 0,
+        "old_exact": 0,
+        "salvaged": 0,
+        "failures": [],
+    }
+
+    for index in range(cases):
+
+        case = make_case(rng, examples)
+        items, error = run(iter_json_items, case["text"])
+        report["cut"] += case["cut"]
+
+        # A cut reply always lacks its closing bracket, so it must end in an
+        # error after the salvaged elements; a whole one never does.
+        if items == case["expected"] and (error is not None) == case["cut"]:
+
+            report["exact"] += 1
+
+            if case["cut"]:
+
+                report["salvaged"] += len(items)
+
+        elif len(report["failures"]) < 5:
+
+            report["failures"].append((index, case["text"][:120], str(error)))
+
+        if case["streamable"]:
+
+            report["streamable"] += 1
+            report["stream_agrees"] += run(stream, case["text"])[0] == items
+
+        if not case["cut"]:
+
+            try:
+
+                old = old_parse(case["text"])
+
+            except ValueError:
+
+                old = None
+
+            if isinstance(old, dict):
+
+                old = [old]
+
+            report["old_exact"] += old == case["expected"]
+
+    return report
+
+
+def big_reply() -> str:
+
+    recipes = json.loads(
+        (EXAMPLE_PATH / "recipes_output.json").read_text(encoding="utf-8")
+    )
+    items = []
+
+    while len(json.dumps(items, indent=2)) < 100_000:
+
+        items.extend(recipes)
+
+    return "```json\n" + json.dumps(items, indent=2, ensure_ascii=False) + "\n```"
+
+
+def measure(parse, text: str, runs: int) -> tuple:
+    """``(best seconds, peak traced bytes)`` of ``list(parse(text))``."""
+
+    best = float("inf")
+
+    for _ in range(runs):
+
+        t0 = time.perf_counter()
+        list(parse(text))
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    list(parse(text))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    report = fuzz(args.cases, args.seed)
+    whole = report["cases"] - report["cut"]
+
+    print(
+        f"{report['cases']} replies ({report['cut']} cut off): "
+        f"{report['exact']} parsed exactly, {report['salvaged']} elements "
+        f"salvaged from cut replies; the old parse got {report['old_exact']} "
+        f"of the {whole} whole replies"
+    )
+
+    for index, text, error in report["failures"]:
+
+        print(f"  case {index}: {error} in {text!r}")
+
+    text = big_reply()
+    old_s, old_peak = measure(old_parse, text, args.runs)
+    new_s, new_peak = measure(iter_json_items, text, args.runs)
+
+    print(
+        f"{len(text) / 1000:.0f}KB reply: old {old_s * 1000:.2f}ms, peak "
+        f"{old_peak / 1000:.0f}KB; new {new_s * 1000:.2f}ms, peak "
+        f"{new_peak / 1000:.0f}KB"
+    )
+
+    elements, count, error = bad_element_in_chunk()
+
+    results = [
+        ("every reply parses to its complete elements", not report["failures"]),
+        (
+            "a bad element keeps those before it in its chunk",
+            elements == [{"dish_name": "Pilaf"}] and count == 1 and error is not None,
+        ),
+        (
+            "the stream parser agrees",
+            report["stream_agrees"] == report["streamable"],
+        ),
+        ("cut replies keep their complete elements", report["salvaged"] > 0),
+        ("the old parse did worse", report["old_exact"] < whole),
+        ("a big reply parses with less memory", new_peak < old_peak),
+        ("a big reply parses no slower", new_s <= old_s * 1.1),
+    ]
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
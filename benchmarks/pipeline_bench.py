@@ -0,0 +1,372 @@
+"""Offline benchmark suite for the query pipeline, against the stub LLM.
+
+Times ``process_diversification``, ``process_list`` and whole /api/query/
+jobs (submit, then stream the events) with the stub's latency, jitter and
+error rate set from the command line. Queries go through the Flask test
+client, or through a real server with ``--server sync|gevent|async`` (see
+``benchmarks.load_stub``). Reports p50/p95/p99 latency, time to first event
+and throughput, and writes them with the run's parameters to ``--output``.
+
+Run from the repository root:
+
+    python -m benchmarks.pipeline_bench [--queries 40] [--concurrency 8]
+        [--latency 0.2] [--jitter 0.1] [--error-rate 0.0] [--server sync]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+from benchmarks.load_stub import ROOT_PATH, free_port, server_command, wait_until_up
+from benchmarks.stub_llm import StubLLMServer
+
+RESULTS_PATH = ROOT_PATH / "benchmarks" / "results"
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of ``values`` (``p`` in 0-100)."""
+
+    if not values:
+
+        return 0.0
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(latencies: list, elapsed: float, failed: int = 0, **extra) -> dict:
+
+    return {
+        "count": len(latencies),
+        "failed": failed,
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_s": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        **extra,
+    }
+
+
+def run_concurrent(fn, items: list, concurrency: int):
+    """Call ``fn`` on every item, ``concurrency`` at a time; return the
+    results and the wall time."""
+
+    t0 = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        results = list(pool.map(fn, items))
+
+    return results, time.perf_counter() - t0
+
+
+def timed(fn, *args):
+
+    t0 = time.perf_counter()
+    result = fn(*args)
+
+    return result, time.perf_counter() - t0
+
+
+def bench_diversification(queries: list, concurrency: int) -> dict:
+
+    import agents.diversifier.client as diversifier_client
+
+    results, elapsed = run_concurrent(
+        lambda q: timed(diversifier_client.process_diversification, q),
+        queries,
+        concurrency,
+    )
+    failed = sum(1 for dishes, _ in results if not dishes)
+
+    return summarize([t for dishes, t in results if dishes], elapsed, failed)
+
+
+def bench_process_list(dishes: list, runs: int, concurrency: int) -> dict:
+
+    import agents.recipes.client as recipes_client
+
+    results, elapsed = run_concurrent(
+        lambda _: timed(recipes_client.process_list, json.loads(json.dumps(dishes))),
+        range(runs),
+        concurrency,
+    )
+    recipes = [len(out) for out, _ in results]
+
+    return summarize(
+        [t for _, t in results],
+        elapsed,
+        sum(1 for n in recipes if n == 0),
+        recipes_per_run=sum(recipes) / len(recipes) if recipes else 0.0,
+    )
+
+
+class TestClientDriver:
+    """Submits queries to the app in this process through its test client."""
+
+    def __init__(self, concurrency: int):
+
+        import app as webapp
+        from pipeline import JobQueue, JobRunner
+        from storage import PersistenceWriter, open_store
+
+        path = Path(tempfile.mkdtemp())
+
+        webapp.store = open_store(path)
+        webapp.writer = PersistenceWriter(webapp.store)
+        webapp.jobs = JobQueue(path / "jobs.sqlite3")
+        webapp.runner = JobRunner(webapp.jobs, webapp.run_job, max_workers=concurrency)
+
+        self.app = webapp.app
+
+    def lines(self, food: str):
+
+        client = self.app.test_client()
+        job = client.post("/api/query/", data={"food": food}).get_json()
+        response = client.get(job["events_url"], buffered=False)
+
+        try:
+
+            for chunk in response.response:
+
+                yield from (
+                    chunk if isinstance(chunk, str) else chunk.decode()
+                ).splitlines()
+
+        finally:
+
+            response.close()
+
+    def close(self):
+
+        pass
+
+
+class ServerDriver:
+    """Submits queries over HTTP to a server started with ``server_command``."""
+
+    def __init__(self, mode: str, stub: StubLLMServer):
+
+        import asyncio
+
+        import httpx
+
+        port = free_port()
+        env = dict(
+            os.environ,
+            STUB_LLM_URL=stub.base_url,
+            STUB_STORE_PATH=tempfile.mkdtemp(),
+        )
+        self.server = subprocess.Popen(
+            server_command(mode, port, 1),
+            cwd=ROOT_PATH,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        asyncio.run(wait_until_up(port))
+
+        # No keep-alive: see benchmarks.load_stub.
+        self.client = httpx.Client(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=None,
+            limits=httpx.Limits(max_keepalive_connections=0),
+        )
+
+    def lines(self, food: str):
+
+        job = self.client.post("/api/query/", data={"food": food}).json()
+
+        with self.client.stream("GET", job["events_url"]) as response:
+
+            yield from response.iter_lines()
+
+    def close(self):
+
+        self.client.close()
+        self.server.terminate()
+        self.server.wait(timeout=30)
+
+
+def query_once(driver, food: str) -> dict:
+
+    started = time.perf_counter()
+    first = None
+    last = None
+    errors = 0
+
+    try:
+
+        for line in driver.lines(food):
+
+            if not line.strip():
+
+                continue
+
+            if first is None:
+
+                first = time.perf_counter() - started
+
+            last = json.loads(line)
+
+            if last.get("status") == "restart":
+
+                errors = 0
+
+            errors += last.get("status") == "error"
+
+    except Exception as e:
+
+        print(f"| FROM pipeline_bench | WARNING: {e} | Query '{food}' failed")
+
+    return {
+        "latency": time.perf_counter() - started,
+        "first_event": first,
+        "done": last is not None and last.get("status") == "done",
+        "error_events": errors,
+    }
+
+
+def bench_queries(driver, queries: list, concurrency: int) -> dict:
+
+    results, elapsed = run_concurrent(
+        lambda q: query_once(driver, q), queries, concurrency
+    )
+    done = [r for r in results if r["done"]]
+    first_events = [r["first_event"] for r in done if r["first_event"] is not None]
+
+    return summarize(
+        [r["latency"] for r in done],
+        elapsed,
+        len(results) - len(done),
+        first_event_p50_s=percentile(first_events, 50),
+        first_event_p95_s=percentile(first_events, 95),
+        first_event_p99_s=percentile(first_events, 99),
+        error_events=sum(r["error_events"] for r in results),
+    )
+
+
+def git_commit() -> str:
+
+    try:
+
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+
+        return ""
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--server", choices=("client", "sync", "gevent", "async"), default="client"
+    )
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args(argv)
+
+    import agents.diversifier.client as diversifier_client
+    import agents.recipes.client as recipes_client
+
+    queries = [f"benchmark dish {i}" for i in range(args.queries)]
+    scenarios = {}
+
+    with StubLLMServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        unique_dishes=True,
+    ) as stub:
+
+        for client in (diversifier_client, recipes_client):
+
+            stub.point_settings_at_stub(client.common_settings_instance.settings)
+
+        scenarios["diversification"] = bench_diversification(queries, args.concurrency)
+        scenarios["process_list"] = bench_process_list(
+            stub.dishes, args.queries, args.concurrency
+        )
+
+        driver = (
+            TestClientDriver(args.concurrency)
+            if args.server == "client"
+            else ServerDriver(args.server, stub)
+        )
+
+        try:
+
+            requests_before = stub.requests
+            scenarios["query"] = bench_queries(driver, queries, args.concurrency)
+            scenarios["query"]["llm_calls"] = stub.requests - requests_before
+
+        finally:
+
+            driver.close()
+
+        llm = {"requests": stub.requests, "errors": stub.errors}
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "params": {
+            k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+        },
+        "llm": llm,
+        "scenarios": scenarios,
+    }
+
+    output = args.output or RESULTS_PATH / (
+        f"pipeline-{report['timestamp'].replace(':', '')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(output, "w", encoding="utf-8") as f:
+
+        json.dump(report, f, indent=4)
+
+    for name, result in scenarios.items():
+
+        line = (
+            f"{name:>15}: {result['count']} ok, {result['failed']} failed, "
+            f"p50 {result['p50_s']:.3f}s, p95 {result['p95_s']:.3f}s, "
+            f"p99 {result['p99_s']:.3f}s, {result['throughput_per_s']:.1f}/s"
+        )
+
+        if "first_event_p50_s" in result:
+
+            line += f", first event p50 {result['first_event_p50_s']:.3f}s"
+
+        print(line)
+
+    print(f"LLM: {llm['requests']} requests, {llm['errors']} errors; wrote {output}")
+
+    # Injected errors are expected to fail some runs; without them none may.
+    return args.error_rate > 0 or all(r["failed"] == 0 for r in scenarios.values())
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
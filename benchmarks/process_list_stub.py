@@ -0,0 +1,107 @@
+"""Check that process_list runs its batches concurrently and in order, and
+that repeat runs reuse the pooled keep-alive connections.
+
+Run from the repository root:
+
+    python -m benchmarks.process_list_stub
+"""
+
+import json
+import os
+import time
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.recipes.client as recipes_client
+from agents import transport
+from benchmarks.stub_llm import StubLLMServer, load_examples
+
+LATENCY = 0.5
+RUNS = 200
+
+
+def main():
+
+    dishes, _ = load_examples()
+    results = []
+
+    with StubLLMServer(latency=LATENCY) as stub:
+
+        stub.point_settings_at_stub(recipes_client.common_settings_instance.settings)
+
+        timings = []
+        t0 = time.perf_counter()
+        recipes = recipes_client.process_list(
+            json.loads(json.dumps(dishes)), at_a_time=2, max_num=10, timings=timings
+        )
+        elapsed = time.perf_counter() - t0
+
+        # A second run should go entirely over kept-alive connections.
+        transport.transport_stats.reset()
+        recipes_client.process_list(json.loads(json.dumps(dishes)), at_a_time=2)
+        transport_stats = transport.stats()
+
+        # Concurrent batches must not send one batch's dishes under another
+        # batch's prompt.
+        stub.latency = 0
+        mismatched = 0
+
+        for _ in range(RUNS):
+
+            for recipe in recipes_client.process_list(
+                json.loads(json.dumps(dishes)), at_a_time=1, max_num=10
+            ):
+
+                known = stub.recipes_by_name.get(recipe["dish_name"].lower())
+                mismatched += (
+                    known is not None
+                    and recipe["matched_recipe_title"] != known["matched_recipe_title"]
+                )
+
+    expected = [
+        d["dish_name"]
+        for d in sorted(dishes, key=lambda d: d["similarity_score"], reverse=True)
+    ][:10]
+
+    batches = len(timings)
+    waves = -(-batches // recipes_client.get_scheduler().max_concurrency)
+    sequential = batches * LATENCY
+
+    results.append(
+        ("order", [r["dish_name"] for r in recipes] == expected),
+    )
+    results.append(("all batches ok", all(t["error"] is None for t in timings)))
+    results.append(("ran concurrently", stub.max_in_flight > 1))
+    results.append(("faster than sequential", elapsed < sequential))
+    results.append(("connections reused", transport_stats["connections_opened"] == 0))
+    results.append(("recipes match their dishes", mismatched == 0))
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    print(
+        f"{batches} batches in {elapsed:.2f}s "
+        f"(~{waves * LATENCY:.2f}s expected, {sequential:.2f}s sequential)"
+    )
+
+    for timing in timings:
+
+        print(
+            f"  batch {timing['batch']}: {timing['size']} items, "
+            f"queued {timing['queued_s']:.3f}s, took {timing['elapsed_s']:.3f}s"
+        )
+
+    print(
+        f"second run: {transport_stats['requests']} requests, "
+        f"{transport_stats['connections_opened']} new connections, "
+        f"{transport_stats['connections_reused']} reused"
+    )
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,268 @@
+"""Check retries, re-asks and hedged requests against scripted stub faults.
+
+From the repository root:
+
+    python -m benchmarks.resilience_stub
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+import app as webapp
+from agents import resilience, transport
+from agents.streaming import repair_json
+from benchmarks.stub_llm import StubLLMServer
+from pipeline import JobQueue, JobRunner
+from storage import PersistenceWriter, open_store
+from telemetry import metrics
+
+LATENCY = 0.05
+STALL = 2.0
+
+
+def configure(stub, **hedge):
+
+    for client in (diversifier_client, recipes_client):
+
+        settings = client.common_settings_instance.settings
+        stub.point_settings_at_stub(settings)
+        settings["retry"] = dict(
+            resilience.DEFAULT_RETRY_SETTINGS, backoff_base_seconds=0.01
+        )
+        settings["hedge"] = dict(resilience.DEFAULT_HEDGE_SETTINGS, **hedge)
+
+
+def calls(stub, fn, *args):
+    """``(result, requests made, seconds)`` of ``fn(*args)``."""
+
+    before = stub.requests
+    t0 = time.perf_counter()
+    result = fn(*args)
+
+    return result, stub.requests - before, time.perf_counter() - t0
+
+
+def names(dishes) -> list:
+
+    return [dish["dish_name"] for dish in dishes or []]
+
+
+def repair_checks() -> list:
+
+    return [
+        (
+            "repair drops prose and trailing commas",
+            json.loads(repair_json('Sure! [{"a": 1,}, {"b": 2},] Enjoy.'))
+            == [{"a": 1}, {"b": 2}],
+        ),
+        (
+            "repair cuts a truncated list",
+            json.loads(repair_json('[{"a": 1}, {"b": "tru')) == [{"a": 1}],
+        ),
+    ]
+
+
+def quotes_reply(body: dict, text: str) -> bool:
+    """Whether ``body`` is a re-ask following a failed reply containing
+    ``text``."""
+
+    reply, correction = body["messages"][-2:]
+
+    return (
+        reply["role"] == "assistant"
+        and text in reply["content"]
+        and correction["content"].startswith("Your previous reply")
+    )
+
+
+def retry_checks(stub) -> list:
+
+    results = []
+    expected = names(stub.dishes)
+
+    stub.error_status = 503
+    stub.faults = ["error", "error"]
+    dishes, requests, _ = calls(stub, diversifier_client.process_diversification, "a")
+    results.append(("503s are retried", names(dishes) == expected and requests == 3))
+
+    stub.faults = ["error"] * 3
+    dishes, requests, _ = calls(stub, diversifier_client.process_diversification, "b")
+    results.append(("retries stop at max_attempts", dishes == [] and requests == 3))
+
+    stub.error_status = 400
+    stub.faults = ["error"]
+    dishes, requests, _ = calls(stub, diversifier_client.process_diversification, "c")
+    results.append(("a 400 is not retried", dishes == [] and requests == 1))
+
+    stub.faults = ["garble"]
+    dishes, requests, _ = calls(stub, diversifier_client.process_diversification, "d")
+    results.append(
+        ("bad JSON is asked for again", names(dishes) == expected and requests == 2)
+    )
+    results.append(
+        ("a re-ask quotes the failed reply", quotes_reply(stub.last_body, expected[0]))
+    )
+
+    dishes = json.loads(json.dumps(stub.dishes[:5]))
+    stub.faults = ["garble"]
+    recipes, requests, _ = calls(stub, recipes_client.process_list, dishes)
+    results.append(
+        (
+            "a batch re-asks for its unanswered dishes",
+            len(recipes) == 5 and requests == 2,
+        )
+    )
+    results.append(
+        (
+            "a batch re-ask quotes the failed reply",
+            quotes_reply(stub.last_body, recipes[0]["dish_name"]),
+        )
+    )
+
+    results.append(
+        (
+            "a failed diversification skips recipes",
+            calls(stub, recipes_client.process_list, "")[0] == [],
+        )
+    )
+
+    stub.error_status = 503
+    stub.faults = ["error"]
+    dishes = asyncio.run(diversifier_client.aprocess_diversification("e"))
+    results.append(("async calls are retried", names(dishes) == expected))
+
+    return results
+
+
+def job_checks(stub) -> list:
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp)
+        webapp.store = open_store(path)
+        webapp.writer = PersistenceWriter(webapp.store)
+        webapp.jobs = JobQueue(path / "jobs.sqlite3")
+        webapp.runner = JobRunner(webapp.jobs, webapp.run_job)
+
+        client = webapp.app.test_client()
+        stub.error_status = 503
+        stub.faults = ["error"] * 3
+
+        job = client.post("/api/query/", data={"food": "Rice"}).get_json()
+        lines = client.get(job["events_url"]).get_data(as_text=True).splitlines()
+        last = json.loads(lines[-1])
+        state = client.get(job["status_url"]).get_json()["state"]
+
+        return [
+            (
+                "a failed query ends in an error event",
+                last["status"] == "error" and state == "failed",
+            ),
+            ("a failed query is not stored", not webapp.store.has_result("Rice")),
+        ]
+
+
+def abandoned_winner_closed(settings: dict) -> bool:
+    """Whether a hedged reply is closed when its reader stops after the first
+    chunk, rather than drained to the end."""
+
+    closed = threading.Event()
+
+    def endless(url, headers, body, settings=None):
+
+        try:
+
+            while True:
+
+                yield "["
+                time.sleep(0.01)
+
+        finally:
+
+            closed.set()
+
+    real = transport.iter_completion
+    transport.iter_completion = endless
+
+    try:
+
+        stream = resilience.iter_hedged("", {}, {}, settings, "diversifier")
+        next(stream)
+        stream.close()
+
+        return closed.wait(1.0)
+
+    finally:
+
+        transport.iter_completion = real
+
+
+def hedge_checks(stub) -> list:
+
+    configure(stub, enabled=True, min_samples=5)
+    resilience.latencies.reset()
+
+    for i in range(5):
+
+        diversifier_client.process_diversification(f"warm {i}")
+
+    before = metrics.LLM_HEDGES.value(agent="diversifier", winner="hedge")
+    stub.faults = ["stall"]
+    dishes, requests, elapsed = calls(
+        stub, diversifier_client.process_diversification, "slow"
+    )
+    won = metrics.LLM_HEDGES.value(agent="diversifier", winner="hedge") - before
+
+    stub.faults = ["stall"]
+    t0 = time.perf_counter()
+    adishes = asyncio.run(diversifier_client.aprocess_diversification("aslow"))
+    aelapsed = time.perf_counter() - t0
+
+    closed = abandoned_winner_closed(
+        diversifier_client.common_settings_instance.settings
+    )
+
+    configure(stub)
+
+    print(f"hedged: {elapsed:.2f}s (sync), {aelapsed:.2f}s (async), stall {STALL}s")
+
+    return [
+        ("a stalled request is hedged", bool(dishes) and requests == 2 and won == 1),
+        ("the hedge beats the stall", elapsed < STALL / 2),
+        ("async requests are hedged", bool(adishes) and aelapsed < STALL / 2),
+        ("an abandoned reply is closed", closed),
+    ]
+
+
+def main():
+
+    results = repair_checks()
+
+    with StubLLMServer(latency=LATENCY, stall_seconds=STALL) as stub:
+
+        configure(stub)
+
+        results += retry_checks(stub)
+        results += job_checks(stub)
+        results += hedge_checks(stub)
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,160 @@
+"""Micro-benchmark of the results-page join on synthetic result sets.
+
+Compares ``join_results`` with the list-membership join /load_results/ used
+to do (fixed to compare names, so both produce the same partitions), and
+checks that every storage backend gives the same join for a result whose
+dish names clash once cleaned. From the repository root:
+
+    python -m benchmarks.results_join
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from storage import BACKENDS, ResultsView, join_results, open_store
+
+SIZES = (100, 1000, 5000)
+ROUNDS = 3
+
+
+def synthetic(size: int):
+    """``size`` dishes; two in three have a recipe, listed in reverse order."""
+
+    dishes = [
+        {"dish_name": f"Dish {i}", "local_name": f"Local {i}", "similarity_score": 0.5}
+        for i in range(size)
+    ]
+    recipes = [
+        dict(dish, image_url=f"/img/{i}.jpg") for i, dish in enumerate(dishes) if i % 3
+    ]
+
+    return dishes, recipes[::-1]
+
+
+def list_join(dishes: list, recipes: list):
+
+    recipe_names = []
+
+    for recipe in recipes:
+
+        recipe_names.append(recipe["dish_name"])
+
+    without_recipe = []
+
+    for dish in dishes:
+
+        if dish["dish_name"] not in recipe_names:
+
+            without_recipe.append(dish)
+
+    return recipes, without_recipe
+
+
+def clashing():
+    """Dishes whose names differ but clean to the same file name."""
+
+    dishes = [
+        {"dish_name": name, "local_name": name, "similarity_score": 0.5}
+        for name in ("Pilaf", "Pilaf?", "Plov")
+    ]
+    recipes = [dict(dish, image_url=f"/img/{i}.jpg") for i, dish in enumerate(dishes)]
+
+    return dishes, recipes
+
+
+def stored_join(backend: str, tmp: Path) -> list:
+
+    store = open_store(tmp / backend, backend=backend, refresh_interval=None)
+    store.put_result("rice", *clashing())
+
+    # A fresh store reads the result back from the backend.
+    stored = open_store(tmp / backend, backend=backend).get_result("rice")
+    view = ResultsView.from_result("rice", stored)
+
+    return [
+        (card.dish_name, card.image_url)
+        for card in view.with_recipe + view.without_recipe
+    ]
+
+
+def best_of(fn, *args) -> float:
+
+    best = None
+
+    for _ in range(ROUNDS):
+
+        t0 = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+
+    results = []
+    timings = {}
+
+    for size in SIZES:
+
+        dishes, recipes = synthetic(size)
+        with_recipe, without_recipe = join_results(dishes, recipes)
+        expected_with, expected_without = list_join(dishes, recipes)
+
+        results.append(
+            (
+                f"{size}: same partitions",
+                len(with_recipe) == len(expected_with)
+                and [card.dish for card in without_recipe] == expected_without,
+            )
+        )
+        results.append(
+            (
+                f"{size}: recipes attached in dish order",
+                all(card.recipe["dish_name"] == card.dish_name for card in with_recipe)
+                and [card.dish_name for card in with_recipe]
+                == [dish["dish_name"] for i, dish in enumerate(dishes) if i % 3],
+            )
+        )
+
+        timings[size] = (
+            best_of(list_join, dishes, recipes),
+            best_of(join_results, dishes, recipes),
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        joins = {backend: stored_join(backend, Path(tmp)) for backend in BACKENDS}
+
+    results.append(
+        (
+            "clashing dish names join alike in every backend",
+            all(join == joins["json"] for join in joins.values())
+            and len(joins["json"]) == len(clashing()[0]),
+        )
+    )
+
+    largest = SIZES[-1]
+    results.append(
+        (f"{largest}: keyed join faster", timings[largest][1] < timings[largest][0])
+    )
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    for size, (listed, keyed) in timings.items():
+
+        print(
+            f"{size:>6} dishes: list membership {listed * 1e3:.2f}ms, "
+            f"keyed join {keyed * 1e3:.2f}ms"
+        )
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,260 @@
+"""Check per-agent model routing and failover against per-model stub faults.
+
+From the repository root:
+
+    python -m benchmarks.router_stub
+"""
+
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+from agents import batching, resilience
+from agents.router import router
+from benchmarks.stub_llm import StubLLMServer
+from telemetry import metrics
+
+STRONG = "google/gemini-2.5-flash:online"
+BACKUP = "openai/gpt-5-mini"
+FAST = "openai/gpt-oss-120b"
+STALL = 0.5
+MIN_SAMPLES = 3
+
+ROUTER = {
+    "enabled": True,
+    "window": 20,
+    "window_seconds": 300,
+    "min_samples": MIN_SAMPLES,
+    "max_error_rate": 0.3,
+    "agents": {
+        "diversifier": {"models": [STRONG, BACKUP], "max_latency_seconds": STALL / 2},
+        "recipes": {"models": [FAST, "not/a-model", STRONG]},
+    },
+}
+
+
+def configure(stub, **hedge):
+
+    for client in (diversifier_client, recipes_client):
+
+        settings = client.common_settings_instance.settings
+        stub.point_settings_at_stub(settings)
+        settings["retry"] = dict(
+            resilience.DEFAULT_RETRY_SETTINGS, backoff_base_seconds=0.01
+        )
+        settings["hedge"] = dict(resilience.DEFAULT_HEDGE_SETTINGS, **hedge)
+        settings["router"] = json.loads(json.dumps(ROUTER))
+
+
+def sent(stub, fn, *args) -> tuple:
+    """``(result, {model: requests})`` of ``fn(*args)``."""
+
+    before = dict(stub.models)
+    result = fn(*args)
+    counts = {
+        model: count - before.get(model, 0)
+        for model, count in stub.models.items()
+        if count != before.get(model, 0)
+    }
+
+    return result, counts
+
+
+def dishes(stub) -> list:
+
+    return json.loads(json.dumps(stub.dishes[:3]))
+
+
+def choice_checks(stub) -> list:
+
+    settings = recipes_client.common_settings_instance.settings
+    divers, to_diversifier = sent(stub, diversifier_client.process_diversification, "a")
+    recipes, to_recipes = sent(stub, recipes_client.process_list, dishes(stub))
+
+    settings["router"]["enabled"] = False
+    _, unrouted = sent(stub, recipes_client.process_list, dishes(stub))
+    settings["router"]["enabled"] = True
+
+    return [
+        (
+            "the diversifier gets its first model",
+            bool(divers) and to_diversifier == {STRONG: 1},
+        ),
+        (
+            "recipes get their own first model",
+            len(recipes) == 3 and to_recipes == {FAST: 1},
+        ),
+        (
+            "models outside available_models are skipped",
+            "not/a-model" not in router.candidates("recipes", settings),
+        ),
+        ("a disabled router keeps the body's model", list(unrouted) == [STRONG]),
+    ]
+
+
+def failover_checks(stub) -> list:
+
+    results = []
+    settings = recipes_client.common_settings_instance.settings
+    stub.error_status = 503
+    stub.model_faults = {FAST: "error"}
+
+    tuner = batching.get_tuner(settings)
+    before = {model: tuner.stats(model)["samples"] for model in (FAST, STRONG)}
+    recipes, first = sent(stub, recipes_client.process_list, dishes(stub))
+    after = {model: tuner.stats(model)["samples"] for model in (FAST, STRONG)}
+    results.append(
+        (
+            "a failed request is retried on the next model",
+            len(recipes) == 3 and first == {FAST: 1, STRONG: 1},
+        )
+    )
+    results.append(
+        (
+            "the batch is tuned for the model that answered",
+            after[STRONG] == before[STRONG] + 1 and after[FAST] == before[FAST],
+        )
+    )
+
+    for _ in range(MIN_SAMPLES):
+
+        recipes_client.process_list(dishes(stub))
+
+    recipes, later = sent(stub, recipes_client.process_list, dishes(stub))
+    results.append(
+        (
+            "an erroring model is skipped",
+            len(recipes) == 3
+            and later == {STRONG: 1}
+            and router.candidates("recipes", settings)[0] == STRONG,
+        )
+    )
+
+    stub.model_faults = {}
+    settings["router"]["window_seconds"] = 0
+    _, recovered = sent(stub, recipes_client.process_list, dishes(stub))
+    settings["router"]["window_seconds"] = ROUTER["window_seconds"]
+    results.append(
+        ("a model is tried again once its window ages out", recovered == {FAST: 1})
+    )
+
+    # Health is kept per model, across agents: forget the fast recipe replies.
+    router.reset()
+    stub.model_faults = {STRONG: "stall"}
+
+    for i in range(MIN_SAMPLES):
+
+        diversifier_client.process_diversification(f"slow {i}")
+
+    t0 = time.perf_counter()
+    divers, slow = sent(stub, diversifier_client.process_diversification, "b")
+    elapsed = time.perf_counter() - t0
+    results.append(
+        (
+            "a slow model is skipped",
+            bool(divers) and slow == {BACKUP: 1} and elapsed < STALL,
+        )
+    )
+
+    stub.model_faults = {STRONG: "error"}
+    router.reset()
+    divers, async_sent = sent(
+        stub, asyncio.run, diversifier_client.aprocess_diversification("c")
+    )
+    results.append(
+        (
+            "async requests fail over",
+            bool(divers) and async_sent == {STRONG: 1, BACKUP: 1},
+        )
+    )
+
+    stub.model_faults = {}
+
+    return results
+
+
+def hedge_checks(stub) -> list:
+
+    configure(stub, enabled=True, min_samples=5)
+    resilience.latencies.reset()
+    router.reset()
+
+    for i in range(5):
+
+        diversifier_client.process_diversification(f"warm {i}")
+
+    stub.faults = ["stall"]
+    divers, hedged = sent(stub, diversifier_client.process_diversification, "d")
+    configure(stub)
+
+    return [
+        (
+            "a hedge goes to the next model",
+            bool(divers) and hedged == {STRONG: 1, BACKUP: 1},
+        )
+    ]
+
+
+def routes(**labels) -> float:
+    """Sum of the ``llm_routes_total`` samples that carry ``labels``."""
+
+    names = metrics.LLM_ROUTES.labelnames
+
+    return sum(
+        count
+        for key, count in metrics.LLM_ROUTES.series().items()
+        if all(dict(zip(names, key))[name] == v for name, v in labels.items())
+    )
+
+
+def metric_checks() -> list:
+
+    latency = metrics.REGISTRY.get("llm_model_latency_seconds").series()
+    error_rate = metrics.REGISTRY.get("llm_model_error_rate").series()
+    text = metrics.render()
+
+    return [
+        ("preferred routes counted", routes(agent="recipes", reason="preferred") > 0),
+        (
+            "failovers counted",
+            routes(agent="recipes", reason="failover") > 0
+            and routes(agent="diversifier", reason="failover") > 0,
+        ),
+        ("hedged routes counted", routes(model=BACKUP, reason="hedge") == 1),
+        ("per-model latency exposed", latency.get((STRONG,), 0) > 0),
+        ("per-model error rate exposed", (STRONG,) in error_rate),
+        ("routes rendered", 'reason="failover"' in text),
+    ]
+
+
+def main():
+
+    metrics.REGISTRY.reset()
+    router.reset()
+
+    with StubLLMServer(latency=0.02, stall_seconds=STALL) as stub:
+
+        configure(stub)
+
+        results = choice_checks(stub)
+        results += failover_checks(stub)
+        results += hedge_checks(stub)
+
+    results += metric_checks()
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
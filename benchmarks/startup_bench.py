@@ -0,0 +1,283 @@
+"""Import-time and first-request benchmark for the Flask app.
+
+Runs ``python -X importtime -c "import app"`` in fresh interpreters and
+reports the cumulative import time of ``app`` and its slowest modules. It
+also times, in fresh processes against the stub LLM, the first and the
+second query job with and without ``app.preload()``/``app.warm_worker()``.
+The run fails if ``import app`` pulls in a module that should load lazily
+(the agents, requests, httpx, gevent, dotenv), or if a timing is more than
+``--tolerance`` times its baseline in ``benchmarks/startup_baseline.json``
+(plus 20ms of noise; rewrite it with ``--update-baseline``). From the repository root:
+
+    python -m benchmarks.startup_bench [--runs 5] [--tolerance 1.5]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).parent.parent
+BASELINE_PATH = ROOT_PATH / "benchmarks" / "startup_baseline.json"
+
+# Modules `import app` must leave to the first query or to preload().
+LAZY_MODULES = (
+    "agents.diversifier.client",
+    "agents.recipes.client",
+    "requests",
+    "httpx",
+    "gevent",
+    "dotenv",
+)
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+# Timings kept in the baseline, and the noise allowed on top of --tolerance.
+BASELINE_KEYS = (
+    "import_app_s",
+    "first_query_s",
+    "first_query_preloaded_s",
+    "preload_s",
+)
+BASELINE_SLACK_S = 0.02
+
+LAZY_SCRIPT = """
+import json, sys
+import app
+print(json.dumps([m for m in %r if m in sys.modules]))
+"""
+
+
+def child_env() -> dict:
+
+    env = dict(os.environ, AI_API_KEY="stub", LLM_CACHE_BYPASS="1")
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+
+    return env
+
+
+def import_profile() -> dict:
+    """``{"total_s", "modules": {name: (self_s, cumulative_s)}}`` of one
+    ``import app`` in a fresh interpreter."""
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT_PATH,
+        env=child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+
+    for line in proc.stderr.splitlines():
+
+        match = IMPORTTIME_LINE.match(line)
+
+        if match:
+
+            own, cumulative, _, name = match.groups()
+            modules[name] = (int(own) / 1e6, int(cumulative) / 1e6)
+
+    return {"total_s": modules["app"][1], "modules": modules}
+
+
+def lazy_imports() -> list:
+
+    proc = subprocess.run(
+        [sys.executable, "-c", LAZY_SCRIPT % (LAZY_MODULES,)],
+        cwd=ROOT_PATH,
+        env=child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def first_requests(preload: bool) -> dict:
+    """Times of a fresh process's first and second query jobs."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup_bench", "--child", tmp]
+            + (["--preload"] if preload else []),
+            cwd=ROOT_PATH,
+            env=child_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def run_child(store_path: str, preload: bool):
+    """Serve two queries through the test client and print their timings."""
+
+    from benchmarks.stub_llm import StubLLMServer
+
+    with StubLLMServer() as stub:
+
+        # Read when the agent settings first load, i.e. after `import app`.
+        os.environ["AI_API_BASE_URL"] = stub.base_url
+
+        t0 = time.perf_counter()
+        import app as webapp
+
+        timings = {"import_s": time.perf_counter() - t0}
+
+        # What benchmarks.stub_app does, without importing the agents first.
+        from agents import batching
+        from pipeline import JobQueue, JobRunner
+        from storage import PersistenceWriter, open_store
+
+        batching._tuner = batching.BatchTuner()
+
+        webapp.store = open_store(Path(store_path))
+        webapp.writer = PersistenceWriter(webapp.store)
+        webapp.jobs = JobQueue(Path(store_path) / "jobs.sqlite3")
+        webapp.runner = JobRunner(webapp.jobs, webapp.run_job)
+
+        if preload:
+
+            t0 = time.perf_counter()
+            webapp.warm_worker()
+            timings["preload_s"] = time.perf_counter() - t0
+
+        client = webapp.app.test_client()
+
+        for name, food in (("first_query_s", "Rice"), ("second_query_s", "Noodles")):
+
+            t0 = time.perf_counter()
+            job = client.post("/api/query/", data={"food": food}).get_json()
+            lines = client.get(job["events_url"]).get_data(as_text=True)
+            timings[name] = time.perf_counter() - t0
+            timings["ok"] = timings.get("ok", True) and '"done"' in lines
+
+        t0 = time.perf_counter()
+        client.get("/")
+        timings["first_page_s"] = time.perf_counter() - t0
+
+    print(json.dumps(timings))
+
+
+def summary(args) -> dict:
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    cold = [first_requests(False) for _ in range(args.runs)]
+    warm = [first_requests(True) for _ in range(args.runs)]
+
+    def median(runs, key):
+
+        return statistics.median(run[key] for run in runs)
+
+    fastest = min(profiles, key=lambda profile: profile["total_s"])
+    slowest = sorted(
+        fastest["modules"].items(), key=lambda item: item[1][0], reverse=True
+    )
+
+    return {
+        "import_app_s": median(profiles, "total_s"),
+        "first_query_s": median(cold, "first_query_s"),
+        "first_query_preloaded_s": median(warm, "first_query_s"),
+        "second_query_s": median(cold, "second_query_s"),
+        "first_page_s": median(cold, "first_page_s"),
+        "first_page_preloaded_s": median(warm, "first_page_s"),
+        "preload_s": median(warm, "preload_s"),
+        "queries_ok": all(run["ok"] for run in cold + warm),
+        "slowest_imports": [
+            [name, round(own, 4)] for name, (own, _) in slowest[: args.top]
+        ],
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--preload", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+
+        run_child(args.child, args.preload)
+        return True
+
+    report = summary(args)
+    lazy = lazy_imports()
+
+    print(f"import app: {report['import_app_s'] * 1000:.1f}ms; slowest modules (self):")
+
+    for name, own in report["slowest_imports"]:
+
+        print(f"  {own * 1000:8.2f}ms  {name}")
+
+    print(
+        f"first query {report['first_query_s'] * 1000:.1f}ms cold, "
+        f"{report['first_query_preloaded_s'] * 1000:.1f}ms after "
+        f"{report['preload_s'] * 1000:.1f}ms of preload; "
+        f"second query {report['second_query_s'] * 1000:.1f}ms"
+    )
+    print(
+        f"first page {report['first_page_s'] * 1000:.1f}ms cold, "
+        f"{report['first_page_preloaded_s'] * 1000:.1f}ms preloaded"
+    )
+
+    if args.update_baseline:
+
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+
+            json.dump(
+                {key: report[key] for key in BASELINE_KEYS},
+                f,
+                indent=4,
+            )
+            f.write("\n")
+
+        print(f"wrote {BASELINE_PATH.relative_to(ROOT_PATH)}")
+
+    results = [
+        ("queries finished", report["queries_ok"]),
+        (f"import app loads no lazy modules {lazy}", not lazy),
+        (
+            "preload makes the first query cheaper",
+            report["first_query_preloaded_s"] < report["first_query_s"],
+        ),
+    ]
+
+    if BASELINE_PATH.exists():
+
+        baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+
+        for key, limit in baseline.items():
+
+            results.append(
+                (
+                    f"{key} within {args.tolerance}x baseline",
+                    report[key] <= limit * args.tolerance + BASELINE_SLACK_S,
+                )
+            )
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
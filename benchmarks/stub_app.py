@@ -0,0 +1,57 @@
+"""WSGI/ASGI entry points for load tests: the app pointed at the stub LLM.
+
+``STUB_LLM_URL`` is the stub's base URL and ``STUB_STORE_PATH`` a throwaway
+store directory, e.g.
+
+    gunicorn benchmarks.stub_app:app
+    uvicorn benchmarks.stub_app:asgi_app
+"""
+
+import os
+from pathlib import Path
+
+import agents.diversifier.client as diversifier_client
+import agents.recipes.client as recipes_client
+import app as webapp
+from agents import batching
+from pipeline import JobQueue, JobRunner
+from storage import PersistenceWriter, open_store
+
+
+def configure_app(stub_url: str, store_path: str):
+    """Point the app at the stub and a throwaway store."""
+
+    for client in (diversifier_client, recipes_client):
+
+        client.common_settings_instance.settings["ai_api"]["urls"][
+            "base_api_url"
+        ] = stub_url
+
+    # Stub timings stay out of the saved batching state.
+    batching._tuner = batching.BatchTuner()
+
+    webapp.store = open_store(Path(store_path))
+    webapp.writer = PersistenceWriter(webapp.store)
+    webapp.jobs = JobQueue(Path(store_path) / "jobs.sqlite3")
+    webapp.runner = JobRunner(
+        webapp.jobs, webapp.run_job, max_workers=webapp.JOB_WORKERS
+    )
+
+    return webapp
+
+
+configure_app(os.environ["STUB_LLM_URL"], os.environ["STUB_STORE_PATH"])
+
+app = webapp.app
+
+
+def __getattr__(name):
+
+    # Imported on demand: the ASGI module swaps in its own asyncio job runner.
+    if name == "asgi_app":
+
+        from asgi import app as asgi_app
+
+        return asgi_app
+
+    raise AttributeError(name)
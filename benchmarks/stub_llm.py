@@ -0,0 +1,337 @@
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).parent.parent
+EXAMPLE_PATH = ROOT_PATH / "agents" / "examples"
+
+
+def load_examples():
+
+    with open(EXAMPLE_PATH / "diversifier_output.json", "r", encoding="utf-8") as f:
+
+        dishes = json.load(f)
+
+    with open(EXAMPLE_PATH / "recipes_output.json", "r", encoding="utf-8") as f:
+
+        recipes = json.load(f)
+
+    return dishes, recipes
+
+
+def garble(content: str) -> str:
+    """Unquote the first key of the second array element."""
+
+    first = content.find('{\n    "')
+    second = content.find('{\n    "', first + 1)
+
+    if second == -1:
+
+        return content[: len(content) // 2]
+
+    return content[:second] + "{\n    " + content[second + len('{\n    "') :]
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+
+        # Clients dropping idle keep-alive connections is expected here.
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+
+            super().handle_error(request, client_address)
+
+
+class StubLLMServer:
+    """Local stand-in for the chat-completion proxy.
+
+    Answers diversifier prompts with ``diversifier_output.json`` and recipes
+    prompts with one canned recipe per requested dish, after ``latency``
+    seconds (plus up to ``jitter`` seconds of random delay). Requests with
+    ``"stream": true`` get a server-sent-event stream of ``stream_chunk_chars``
+    sized deltas spread evenly over ``stream_duration`` seconds, or paced at
+    ``stream_chars_per_second`` like a model generating tokens. With
+    ``unique_dishes`` every diversifier reply gets its own dish names, so no
+    query can reuse recipes stored by another. A random ``error_rate`` share
+    of requests is answered with an ``error_status`` error instead.
+
+    ``faults`` scripts what happens to the next requests, one entry each:
+    ``"error"`` (an ``error_status`` reply), ``"garble"`` (content that is
+    not valid JSON from the second element on) or ``"stall"`` (answered
+    ``stall_seconds`` late); ``None`` leaves a request alone. ``model_faults``
+    maps a model name to the fault every request for it gets, ``models``
+    counts the requests per model and ``last_body`` is the latest request.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        port: int = 0,
+        stream_duration: float = 0.0,
+        stream_chunk_chars: int = 64,
+        stream_chars_per_second: float = 0.0,
+        unique_dishes: bool = False,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        stall_seconds: float = 2.0,
+    ):
+
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_duration = stream_duration
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chars_per_second = stream_chars_per_second
+        self.unique_dishes = unique_dishes
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_seconds = stall_seconds
+        self.faults = []
+        self.model_faults = {}
+        self.models = {}
+        self.last_body = None
+        self.dishes, self.recipes = load_examples()
+        self.recipes_by_name = {r["dish_name"].lower(): r for r in self.recipes}
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        self.httpd = QuietHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, *exc):
+
+        self.stop()
+
+    def point_settings_at_stub(self, settings: dict):
+        """Rewrite an agent settings dict so its chat-completion URL hits us,
+        and keep the stub's timings out of the saved batching state."""
+
+        settings["ai_api"]["urls"]["base_api_url"] = self.base_url
+        settings.setdefault("batching", {})["state_path"] = ""
+
+    def build_content(self, body: dict) -> str:
+
+        messages = {}
+
+        # The first message of each role; a re-ask appends a second user one.
+        for message in body.get("messages", []):
+
+            messages.setdefault(message["role"], message["content"])
+        system = messages.get("system", "")
+        user = messages.get("user", "")
+
+        if "recipe retrieval" in system:
+
+            requested = json.loads(user[user.index("[") : user.rindex("]") + 1])
+            out = []
+
+            for index, item in enumerate(requested):
+
+                name = item.get("dish_name", "").lower()
+                recipe = self.recipes_by_name.get(
+                    name, self.recipes[index % len(self.recipes)]
+                )
+                out.append(
+                    {k: v for k, v in recipe.items() if k not in self.dishes[0]}
+                )
+
+            payload = out
+
+        elif self.unique_dishes:
+
+            with self._lock:
+
+                reply = self.requests
+
+            payload = [
+                dict(dish, dish_name=f"{dish['dish_name']} {reply}")
+                for dish in self.dishes
+            ]
+
+        else:
+
+            payload = self.dishes
+
+        return "```json\n" + json.dumps(payload, ensure_ascii=False, indent=2) + "\n```"
+
+    def _delay(self):
+
+        delay = self.latency + random.uniform(0, self.jitter)
+
+        if delay > 0:
+
+            time.sleep(delay)
+
+    def _handler(self):
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+
+                pass
+
+            def do_POST(self):
+
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                with server._lock:
+
+                    server.requests += 1
+                    server.last_body = body
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    model = body.get("model", "")
+                    server.models[model] = server.models.get(model, 0) + 1
+                    fault = server.faults.pop(0) if server.faults else None
+                    fault = fault or server.model_faults.get(model)
+
+                failed = False
+
+                try:
+
+                    server._delay()
+
+                    if fault == "stall":
+
+                        time.sleep(server.stall_seconds)
+
+                    failed = fault == "error" or random.random() < server.error_rate
+                    content = None if failed else server.build_content(body)
+
+                    if fault == "garble":
+
+                        content = garble(content)
+
+                finally:
+
+                    with server._lock:
+
+                        server.in_flight -= 1
+                        server.errors += failed
+
+                if failed:
+
+                    self.send_json(
+                        server.error_status,
+                        {
+                            "error": {
+                                "message": "stub error",
+                                "code": server.error_status,
+                            }
+                        },
+                    )
+                    return
+
+                if body.get("stream"):
+
+                    try:
+
+                        self.send_stream(body, content)
+
+                    except (BrokenPipeError, ConnectionResetError):
+
+                        self.close_connection = True
+
+                    return
+
+                self.send_json(
+                    200,
+                    {
+                        "id": "stub",
+                        "object": "chat.completion",
+                        "model": body.get("model", ""),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                    },
+                )
+
+            def send_json(self, status: int, payload: dict):
+
+                raw = json.dumps(payload).encode("utf-8")
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def send_stream(self, body, content):
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                size = server.stream_chunk_chars
+                pieces = [content[i : i + size] for i in range(0, len(content), size)]
+                pause = server.stream_duration / max(1, len(pieces))
+
+                if server.stream_chars_per_second:
+
+                    pause = size / server.stream_chars_per_second
+
+                for piece in pieces:
+
+                    event = {
+                        "id": "stub",
+                        "object": "chat.completion.chunk",
+                        "model": body.get("model", ""),
+                        "choices": [{"index": 0, "delta": {"content": piece}}],
+                    }
+                    self.write_chunk(f"data: {json.dumps(event)}\n\n")
+
+                    if pause > 0:
+
+                        time.sleep(pause)
+
+                self.write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, text):
+
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,177 @@
+"""Check the recipes token budget: compact prompts, per-batch ``max_tokens``
+and batch sizes that keep each request under the latency target, against a
+stub that streams at a fixed number of characters per second.
+
+From the repository root:
+
+    python -m benchmarks.token_budget
+"""
+
+import json
+import os
+import time
+
+os.environ.setdefault("AI_API_KEY", "stub")
+os.environ["LLM_CACHE_BYPASS"] = "1"
+
+import agents.recipes.client as recipes_client
+from agents import budget as token_budget
+from agents.budget import budget
+from benchmarks.stub_llm import StubLLMServer, load_examples
+from telemetry import metrics
+
+CHARS_PER_SECOND = 8000
+TARGET = 0.8
+
+BUDGET = dict(
+    token_budget.DEFAULT_BUDGET_SETTINGS,
+    latency_target_seconds=TARGET,
+    window=5,
+)
+
+
+def dishes(n: int) -> list:
+
+    return json.loads(json.dumps(load_examples()[0][:n]))
+
+
+def prompt_checks() -> list:
+
+    settings = recipes_client.common_settings_instance.settings
+    _, _, one = recipes_client.build_batch_request(dishes(1))
+    _, _, five = recipes_client.build_batch_request(dishes(5))
+
+    def content(body, role):
+
+        return [m["content"] for m in body["messages"] if m["role"] == role][0]
+
+    user = json.loads(content(five, "user"))
+    per_dish = [
+        token_budget.prompt_tokens(body) / n for n, body in ((1, one), (5, five))
+    ]
+    print(
+        f"prompt tokens per dish: {per_dish[0]:.0f} alone, {per_dish[1]:.0f} in a "
+        f"batch of 5 (system prompt {token_budget.estimate_tokens(content(one, 'system'))})"
+    )
+
+    settings["budget"] = dict(BUDGET, enabled=False)
+    _, _, unbudgeted = recipes_client.build_batch_request(dishes(2))
+    settings["budget"] = BUDGET
+
+    return [
+        (
+            "every batch shares one system prompt",
+            content(one, "system") == content(five, "system"),
+        ),
+        (
+            "the user message is only the dishes",
+            [dish["dish_name"] for dish in user]
+            == [dish["dish_name"] for dish in dishes(5)]
+            and ", " not in content(five, "user"),
+        ),
+        (
+            "max_tokens scales with the batch",
+            one["max_tokens"] == BUDGET["max_tokens_per_item"]
+            and five["max_tokens"] == 5 * BUDGET["max_tokens_per_item"],
+        ),
+        ("a disabled budget keeps max_tokens", unbudgeted["max_tokens"] == 100000),
+    ]
+
+
+def run(n: int, at_a_time=None) -> list:
+
+    timings = []
+    recipes_client.process_list(dishes(n), at_a_time=at_a_time, timings=timings)
+
+    return timings
+
+
+def sizing_checks() -> list:
+
+    settings = recipes_client.common_settings_instance.settings
+    budget.reset()
+    cold = budget.batch_size("recipes", 10)
+
+    fixed = run(5, at_a_time=5)
+    estimates = budget.estimates("recipes", settings)
+    sized = budget.batch_size("recipes", 10, settings)
+
+    t0 = time.perf_counter()
+    auto = run(10)
+    elapsed = time.perf_counter() - t0
+
+    print(
+        f"measured {estimates['tokens_per_item']:.0f} tokens per recipe at "
+        f"{estimates['tokens_per_second']:.0f} tokens/s; batches of {cold} "
+        f"before, {sized} after"
+    )
+    print(
+        f"batch of 5: {fixed[0]['elapsed_s']:.2f}s; budgeted batches of "
+        f"{[t['size'] for t in auto]}: up to "
+        f"{max(t['elapsed_s'] for t in auto):.2f}s, {elapsed:.2f}s in all "
+        f"(target {TARGET}s)"
+    )
+
+    return [
+        ("the default estimates keep full batches", cold == BUDGET["max_batch"]),
+        ("the fixed batch overran the target", fixed[0]["elapsed_s"] > TARGET),
+        (
+            "tokens per recipe are measured",
+            estimates["tokens_per_item"] != BUDGET["completion_tokens_per_item"],
+        ),
+        (
+            "slow replies shrink the batches evenly",
+            1 < sized < 5 and {t["size"] for t in auto} <= {sized, sized - 1},
+        ),
+        (
+            "budgeted batches stay near the target",
+            all(t["error"] is None for t in auto)
+            and max(t["elapsed_s"] for t in auto) < TARGET * 1.5,
+        ),
+        ("an explicit at_a_time still wins", [t["size"] for t in run(4, 4)] == [4]),
+    ]
+
+
+def metric_checks() -> list:
+
+    per_item = metrics.LLM_TOKENS_PER_ITEM
+    text = metrics.render()
+
+    return [
+        (
+            "tokens per recipe recorded",
+            per_item.snapshot(agent="recipes", kind="completion")["count"] > 0
+            and per_item.snapshot(agent="recipes", kind="prompt")["count"] > 0,
+        ),
+        (
+            "budget estimates exposed",
+            'llm_budget_estimate{agent="recipes",kind="tokens_per_second"}' in text,
+        ),
+    ]
+
+
+def main():
+
+    metrics.REGISTRY.reset()
+
+    with StubLLMServer(stream_chars_per_second=CHARS_PER_SECOND) as stub:
+
+        settings = recipes_client.common_settings_instance.settings
+        stub.point_settings_at_stub(settings)
+        settings["budget"] = BUDGET
+
+        results = prompt_checks()
+        results += sizing_checks()
+
+    results += metric_checks()
+
+    for name, ok in results:
+
+        print(f"{name}: {'PASS' if ok else 'FAIL'}")
+
+    return all(ok for _, ok in results)
+
+
+if __name__ == "__main__":
+
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,8 @@
+"""Gunicorn profile for sync workers (the Dockerfile's); gunicorn reads
+``./gunicorn.conf.py`` by itself when no ``-c`` is given.
+
+    gunicorn --preload --workers 2 --threads 4 app:app
+"""
+
+# Gunicorn looks its hooks up by name in this module.
+from gunicorn_hooks import on_starting, post_worker_init, when_ready
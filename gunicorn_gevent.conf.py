@@ -0,0 +1,25 @@
+"""Gunicorn profile for gevent workers.
+
+    gunicorn -c gunicorn_gevent.conf.py app:app
+
+Each worker serves up to ``worker_connections`` /api/query/ streams at once:
+agent calls go through the monkey-patched socket module and wait on the hub
+instead of holding an OS thread.
+"""
+
+# Gunicorn reads this file before it imports the app (even with --preload),
+# so patching here means the locks, queues and sockets the app and agent
+# modules create at import time are already cooperative.
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+
+# Gunicorn looks its hooks up by name in this module.
+from gunicorn_hooks import on_starting, post_worker_init, when_ready
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_class = "gevent"
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
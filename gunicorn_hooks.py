@@ -0,0 +1,32 @@
+"""Server hooks shared by the gunicorn profiles (``gunicorn.conf.py`` and
+``gunicorn_gevent.conf.py``). Gunicorn imports them before the app, so the
+app is only imported inside the hooks."""
+
+
+def on_starting(server):
+
+    # Worker metrics are summed from files in metrics.SHARED_DIR; start from
+    # zero with the server rather than from the last run's totals.
+    from telemetry import metrics
+
+    metrics.clear_shared()
+
+
+def when_ready(server):
+
+    # With --preload the master has imported the app before forking: do the
+    # shared start-up work once, here, so every worker inherits it.
+    if server.cfg.preload_app:
+
+        import app
+
+        app.preload()
+
+
+def post_worker_init(worker):
+
+    # Connect to the LLM API and pick up queued jobs (and ones orphaned by a
+    # dead worker) straight away, not inside the first query.
+    import app
+
+    app.warm_worker()
@@ -0,0 +1,2 @@
+from pipeline.jobs import AsyncJobRunner, JobQueue, JobRunner
+from pipeline.query import arun_query, cooperative, event, run_query
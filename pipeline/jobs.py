@@ -0,0 +1,663 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pipeline.lease import Lease
+from storage import clean_filename
+from telemetry import get_logger, warning
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    query TEXT NOT NULL,
+    state TEXT NOT NULL,
+    refresh INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key)
+    WHERE state IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+JOB_FIELDS = (
+    "id",
+    "key",
+    "query",
+    "state",
+    "refresh",
+    "owner",
+    "error",
+    "created_at",
+    "started_at",
+    "heartbeat_at",
+    "finished_at",
+)
+
+TERMINAL_STATUSES = ("done", "error")
+
+
+def is_terminal(line: str) -> bool:
+
+    try:
+
+        return json.loads(line).get("status") in TERMINAL_STATUSES
+
+    except (ValueError, AttributeError):
+
+        return False
+
+
+class JobQueue:
+    """Pipeline jobs and their progress events in a SQLite file.
+
+    Every worker process opens the same file, so a job submitted to one worker
+    can be run by any other and its events read by all of them. There is at
+    most one queued or running job per cleaned query: submitting the same
+    query again returns that job, which is how concurrent identical queries
+    share a single pipeline run.
+
+    Claiming a job takes an ``flock`` lease on ``<name>.leases/<job id>.lock``
+    next to the file, held until the job finishes. The kernel releases it if
+    the owner dies, so a running job on this host whose lease is free is
+    queued again at the next claim. A running job whose owner has not sent a
+    heartbeat for ``stale_after`` seconds (on any host) is queued again too,
+    and its events so far are replaced by a ``restart`` event.
+    Finished jobs are deleted ``retention`` seconds after they finish.
+    """
+
+    def __init__(self, path: Path, stale_after: float = 30.0, retention=86400.0):
+
+        self.path = Path(path)
+        self.lease_path = self.path.with_name(f"{self.path.stem}.leases")
+        self.stale_after = stale_after
+        self.retention = retention
+        self._local = threading.local()
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+        self.lease_path.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+
+            # Files made before jobs could ask for fresh LLM replies.
+            if "refresh" not in columns:
+
+                conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN refresh INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None or self._local.pid != os.getpid():
+
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def _row(self, row) -> dict:
+
+        return dict(zip(JOB_FIELDS, row)) if row else None
+
+    def get(self, job_id: str):
+
+        return self._row(
+            self._connect()
+            .execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            )
+            .fetchone()
+        )
+
+    def active(self, query: str):
+        """The queued or running job for ``query``, if any."""
+
+        return self._row(
+            self._connect()
+            .execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs"
+                " WHERE key = ? AND state IN ('queued', 'running')",
+                (clean_filename(query),),
+            )
+            .fetchone()
+        )
+
+    def submit(self, query: str, refresh: bool = False):
+        """Queue a job for ``query``; return ``(job, created)``. A ``refresh``
+        job asks the LLM again instead of replaying cached replies.
+
+        If the query already has a queued or running job, that job is returned
+        with ``created`` false.
+        """
+
+        job_id = uuid.uuid4().hex
+
+        try:
+
+            self._connect().execute(
+                "INSERT INTO jobs (id, key, query, state, refresh, created_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, clean_filename(query), query, int(refresh), time.time()),
+            )
+
+        except sqlite3.IntegrityError:
+
+            job = self.active(query)
+
+            if job is not None:
+
+                return job, False
+
+            # It finished between the insert and the lookup; queue a new one.
+            return self.submit(query, refresh)
+
+        return self.get(job_id), True
+
+    def _lease(self, job_id: str) -> Lease:
+
+        return Lease(self.lease_path / f"{job_id}.lock")
+
+    def _orphaned(self, conn, owner: str, now: float) -> list:
+        """Ids of running jobs whose owner died: its lease is free (owners on
+        this host) or its heartbeat is older than ``stale_after``."""
+
+        host = owner.rpartition(":")[0]
+        orphaned = []
+
+        for job_id, job_owner, heartbeat_at in conn.execute(
+            "SELECT id, owner, heartbeat_at FROM jobs WHERE state = 'running'"
+        ):
+
+            if (heartbeat_at or 0) < now - self.stale_after or (
+                (job_owner or "").rpartition(":")[0] == host
+                and self._lease(job_id).holder_gone()
+            ):
+
+                orphaned.append(job_id)
+
+        return orphaned
+
+    def _requeue(self, conn, job_id: str):
+        """Queue ``job_id`` again, replacing its events with a ``restart``
+        marker. The marker keeps the next ``seq``, so a reader following the
+        job sees it and drops what the earlier run sent."""
+
+        conn.execute(
+            "UPDATE jobs SET state = 'queued', owner = NULL WHERE id = ?", (job_id,)
+        )
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, line)"
+            " SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM job_events WHERE job_id = ?",
+            (job_id, restart_event(), job_id),
+        )
+        conn.execute(
+            "DELETE FROM job_events WHERE job_id = ? AND seq <"
+            " (SELECT MAX(seq) FROM job_events WHERE job_id = ?)",
+            (job_id, job_id),
+        )
+
+    def claim(self, owner: str):
+        """Mark the oldest queued job as running for ``owner``, take its lease
+        and return it."""
+
+        conn = self._connect()
+        now = time.time()
+        lease = None
+
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+
+            for job_id in self._orphaned(conn, owner, now):
+
+                self._requeue(conn, job_id)
+
+            queued = conn.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' ORDER BY created_at"
+            ).fetchall()
+            row = None
+
+            for candidate in queued:
+
+                # Taken before the commit, so no other claim sees the job
+                # running without a held lease. A job queued again for a
+                # missed heartbeat may still be held by its hung owner.
+                lease = self._lease(candidate[0])
+
+                if lease.try_acquire():
+
+                    row = candidate
+                    break
+
+                lease = None
+
+            if row is not None:
+
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', owner = ?,"
+                    " started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (owner, now, now, row[0]),
+                )
+
+            conn.execute("COMMIT")
+
+        except BaseException:
+
+            conn.execute("ROLLBACK")
+
+            if lease is not None:
+
+                lease.release()
+
+            raise
+
+        if row is None:
+
+            return None
+
+        with self._leases_lock:
+
+            self._leases[row[0]] = lease
+
+        return self.get(row[0])
+
+    def heartbeat(self, owner: str):
+        """Record that ``owner`` is still running its jobs."""
+
+        self._connect().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND state = 'running'",
+            (time.time(), owner),
+        )
+
+    def append(self, job_id: str, line: str):
+
+        self._connect().execute(
+            "INSERT INTO job_events (job_id, seq, line)"
+            " SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM job_events WHERE job_id = ?",
+            (job_id, line, job_id),
+        )
+
+    def events(self, job_id: str, after: int = -1) -> list:
+        """Return ``(seq, line)`` for the job's events after ``after``."""
+
+        return (
+            self._connect()
+            .execute(
+                "SELECT seq, line FROM job_events WHERE job_id = ? AND seq > ?"
+                " ORDER BY seq",
+                (job_id, after),
+            )
+            .fetchall()
+        )
+
+    def finish(self, job_id: str, state: str, error: str = None):
+
+        now = time.time()
+        conn = self._connect()
+
+        conn.execute(
+            "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+            (state, error, now, job_id),
+        )
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,))
+
+        with self._leases_lock:
+
+            lease = self._leases.pop(job_id, None)
+
+        # Released once the job is no longer running, so it is never queued
+        # again for a free lease.
+        if lease is not None:
+
+            lease.release(remove=True)
+
+    def poll(self, job_id: str, after: int = -1):
+        """Return ``(events, finished)``: the job's ``(seq, line)`` events after
+        ``after`` up to its terminal one, and whether no more will follow."""
+
+        events = self.events(job_id, after)
+
+        for i, (_, line) in enumerate(events):
+
+            if is_terminal(line):
+
+                return events[: i + 1], True
+
+        if events:
+
+            return events, False
+
+        job = self.get(job_id)
+        finished = job is None or job["state"] in ("done", "failed")
+
+        # Events are all appended before a job is finished.
+        return (self.events(job_id, after) if finished else []), finished
+
+    def iter_events(self, job_id: str, after: int = -1, poll_interval: float = 0.1):
+        """Yield ``(seq, line)`` for the job's events as they are appended,
+        until its terminal event."""
+
+        while True:
+
+            events, finished = self.poll(job_id, after)
+
+            for seq, line in events:
+
+                after = seq
+                yield seq, line
+
+            if finished:
+
+                return
+
+            if not events:
+
+                time.sleep(poll_interval)
+
+    async def aiter_events(
+        self, job_id: str, after: int = -1, poll_interval: float = 0.1
+    ):
+        """Async form of ``iter_events``; the queries run on a worker thread,
+        as a locked database would otherwise stall the whole event loop."""
+
+        while True:
+
+            events, finished = await asyncio.to_thread(self.poll, job_id, after)
+
+            for seq, line in events:
+
+                after = seq
+                yield seq, line
+
+            if finished:
+
+                return
+
+            if not events:
+
+                await asyncio.sleep(poll_interval)
+
+
+def error_event(message: str) -> str:
+
+    return json.dumps({"status": "error", "stage": "job", "message": message}) + "\n"
+
+
+def restart_event() -> str:
+
+    return json.dumps({"status": "restart", "stage": "job"}) + "\n"
+
+
+class JobRunner:
+    """In-process pool that runs queued jobs, up to ``max_workers`` at once.
+
+    ``run(query, refresh)`` returns the job's NDJSON event lines, with
+    ``refresh`` whether the job skips cached LLM replies; each one is appended
+    to the queue as it is produced, so the pipeline keeps going (and its
+    result gets saved) whether or not anyone is reading the events. A single
+    dispatcher thread claims jobs while the pool has room. The pool is started
+    lazily, and again after a fork, so each worker process has its own.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        run,
+        max_workers: int = 4,
+        poll_interval: float = 0.5,
+        heartbeat_interval: float = 5.0,
+    ):
+
+        self.queue = queue
+        self.run = run
+        self.max_workers = max(1, int(max_workers))
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.module_name = self.__class__.__name__
+        self.logger = get_logger(f"pipeline.{self.module_name}")
+
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def owner(self) -> str:
+
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def warn(self, e: Exception, extra: str = ""):
+
+        warning(self.logger, e, extra)
+
+    def start(self):
+
+        if self._pid == os.getpid():
+
+            return
+
+        with self._lock:
+
+            if self._pid == os.getpid():
+
+                return
+
+            self._wake = threading.Event()
+            self._slots = threading.Semaphore(self.max_workers)
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="job-runner"
+            )
+
+            for target, name in (
+                (self._dispatch, "job-dispatch"),
+                (self._beat, "job-heartbeat"),
+            ):
+
+                threading.Thread(target=target, name=name, daemon=True).start()
+
+            self._pid = os.getpid()
+
+    def notify(self):
+        """Wake the dispatcher after a job was queued."""
+
+        if self._pid == os.getpid():
+
+            self._wake.set()
+
+    def _beat(self):
+
+        while True:
+
+            time.sleep(self.heartbeat_interval)
+
+            try:
+
+                self.queue.heartbeat(self.owner)
+
+            except Exception as e:
+
+                self.warn(e, "Heartbeat failed")
+
+    def _claim(self):
+        """The next job, or ``None``. A failure (of the database or of a lease
+        file) is logged and waited out for ``poll_interval``, so the
+        dispatcher backs off and lives on."""
+
+        try:
+
+            return self.queue.claim(self.owner)
+
+        except Exception as e:
+
+            self.warn(e, "Claim failed")
+            time.sleep(self.poll_interval)
+            return None
+
+    def _dispatch(self):
+
+        while True:
+
+            self._slots.acquire()
+            self._wake.clear()
+            job = self._claim()
+
+            if job is None:
+
+                self._slots.release()
+                self._wake.wait(self.poll_interval)
+                continue
+
+            self._pool.submit(self._run_slot, job)
+
+    def _run_slot(self, job: dict):
+
+        try:
+
+            self._run_job(job)
+
+        finally:
+
+            self._slots.release()
+
+    def _fail(self, job: dict, e: Exception):
+
+        self.warn(e, f"Job {job['id']} failed")
+
+        try:
+
+            self.queue.append(job["id"], error_event(str(e)))
+            self.queue.finish(job["id"], "failed", str(e))
+
+        except sqlite3.Error as db_error:
+
+            self.warn(db_error, f"Could not record the failure of job {job['id']}")
+
+    def _run_job(self, job: dict):
+
+        try:
+
+            for line in self.run(job["query"], bool(job["refresh"])):
+
+                self.queue.append(job["id"], line)
+
+            self.queue.finish(job["id"], "done")
+
+        except Exception as e:
+
+            self._fail(job, e)
+
+
+class AsyncJobRunner(JobRunner):
+    """``JobRunner`` for an asyncio server: jobs run as tasks on the event
+    loop and ``run(query, refresh)`` returns an async iterator of event lines. The
+    queue's blocking SQLite calls (which wait up to its busy timeout while
+    another worker writes) go through ``asyncio.to_thread``. ``start`` and
+    ``stop`` must be called from the loop."""
+
+    def start(self):
+
+        if self._pid == os.getpid():
+
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._tasks = set()
+        self._main_task = self._loop.create_task(self._dispatch())
+
+        threading.Thread(target=self._beat, name="job-heartbeat", daemon=True).start()
+
+        self._pid = os.getpid()
+
+    def notify(self):
+
+        # Called from request threads as well as from the loop.
+        if self._pid == os.getpid():
+
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def stop(self):
+
+        if self._pid != os.getpid():
+
+            return
+
+        self._main_task.cancel()
+
+        for task in list(self._tasks):
+
+            task.cancel()
+
+        await asyncio.gather(self._main_task, *self._tasks, return_exceptions=True)
+        self._pid = None
+
+    async def _dispatch(self):
+
+        while True:
+
+            if len(self._tasks) >= self.max_workers:
+
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            self._wake.clear()
+            job = await asyncio.to_thread(self._claim)
+
+            if job is None:
+
+                try:
+
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+
+                except asyncio.TimeoutError:
+
+                    pass
+
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, job: dict):
+
+        try:
+
+            async for line in self.run(job["query"], bool(job["refresh"])):
+
+                await asyncio.to_thread(self.queue.append, job["id"], line)
+
+            await asyncio.to_thread(self.queue.finish, job["id"], "done")
+
+        except Exception as e:
+
+            await asyncio.to_thread(self._fail, job, e)
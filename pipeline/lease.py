@@ -0,0 +1,118 @@
+import os
+import threading
+from pathlib import Path
+
+try:
+
+    import fcntl
+
+except ImportError:  # Windows: leases only coordinate threads of one process
+
+    fcntl = None
+
+
+class Lease:
+    """Exclusive, non-blocking lease on a lock file.
+
+    Uses ``flock``, so the lease is shared by every worker process on the host
+    and is released by the kernel if its holder dies. A lease only counts as
+    taken if the file it locked is still the one at ``path``, which lets a
+    holder remove the file on release without a second holder slipping in
+    on a new file while the old one is locked.
+    """
+
+    _local_held = set()
+    _local_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+
+        self.path = Path(path)
+        self._fd = None
+
+    def try_acquire(self) -> bool:
+
+        if fcntl is None:
+
+            with Lease._local_lock:
+
+                if self.path in Lease._local_held:
+
+                    return False
+
+                Lease._local_held.add(self.path)
+
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            return True
+
+        while True:
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+            try:
+
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            except OSError:
+
+                os.close(fd)
+                return False
+
+            # A holder releasing with remove=True unlinks the file while it
+            # still has it locked, so the file locked here may no longer be
+            # the one at the path; lock the current one instead.
+            try:
+
+                current = os.stat(self.path).st_ino
+
+            except FileNotFoundError:
+
+                current = None
+
+            if current == os.fstat(fd).st_ino:
+
+                self._fd = fd
+                return True
+
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def release(self, remove: bool = False):
+
+        if self._fd is None:
+
+            return
+
+        if remove:
+
+            self.path.unlink(missing_ok=True)
+
+        if fcntl is not None:
+
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        else:
+
+            with Lease._local_lock:
+
+                Lease._local_held.discard(self.path)
+
+        os.close(self._fd)
+        self._fd = None
+
+    def holder_gone(self) -> bool:
+        """Whether a holder that took this lease has since released it or
+        died. Without ``flock`` other processes' leases cannot be seen, so
+        this is always false."""
+
+        if fcntl is None or not self.path.exists():
+
+            return False
+
+        probe = Lease(self.path)
+
+        if probe.try_acquire():
+
+            probe.release()
+            return True
+
+        return False
@@ -0,0 +1,177 @@
+import json
+
+from agents.scheduler import is_cooperative
+
+
+def event(status: str, stage: str = None, **fields) -> str:
+    """One NDJSON line of the /api/query/ stream."""
+
+    payload = {"status": status}
+
+    if stage is not None:
+
+        payload["stage"] = stage
+
+    payload.update(fields)
+
+    return json.dumps(payload) + "\n"
+
+
+def cooperative(lines):
+    """Pass ``lines`` through, letting other greenlets run after each one in
+    a gevent worker (a socket write that does not block never yields)."""
+
+    if not is_cooperative():
+
+        yield from lines
+        return
+
+    import gevent
+
+    try:
+
+        for line in lines:
+
+            yield line
+            gevent.sleep(0)
+
+    finally:
+
+        # Let a stream stopped by a disconnect close its source at once.
+        lines.close()
+
+
+class ReuseTracker:
+    """``lookup`` for ``process_list`` that serves stored recipes and
+    counts the dishes it was asked about."""
+
+    def __init__(self, store):
+
+        self.store = store
+        self.reused = []
+        self.looked_up = 0
+
+    def __call__(self, dish):
+
+        self.looked_up += 1
+        recipe = self.store.find_recipe(dish.get("dish_name", ""))
+
+        if recipe is not None:
+
+            self.reused.append(dish.get("dish_name", ""))
+
+        return recipe
+
+    def event(self, recipes: int) -> str:
+        """The ``reuse`` event; ``hit_rate`` is over the dishes looked up,
+        not the ``recipes`` returned, so failed batches do not inflate it."""
+
+        total = self.looked_up
+
+        return event(
+            "complete",
+            "reuse",
+            reused=self.reused,
+            hits=len(self.reused),
+            total=total,
+            recipes=recipes,
+            hit_rate=len(self.reused) / total if total else 0.0,
+        )
+
+
+def run_query(food: str, store, writer, refresh: bool = False):
+    """Run the agent pipeline for ``food``, yielding NDJSON event lines.
+
+    Dishes and recipes are streamed as they are parsed; the finished query is
+    handed to ``writer`` before the final ``done`` event. If diversification
+    fails, ``DiversificationFailed`` is raised and nothing is stored. A
+    ``refresh`` run asks the LLM for everything again: it bypasses the
+    response cache and does not reuse stored recipes.
+    """
+
+    yield event("start", "initialization")
+
+    import agents.diversifier.client as diversifier_client
+
+    diversification_result = []
+
+    # A DiversificationFailed propagates: the job fails and nothing is stored,
+    # so the next request for this query runs it again.
+    for index, dish in enumerate(
+        diversifier_client.iter_diversification(food, bypass=refresh)
+    ):
+
+        diversification_result.append(dish)
+
+        yield event("progress", "dish", index=index, result=dish)
+
+    yield event("complete", "diversification", result=diversification_result)
+
+    import agents.recipes.client as recipes_client
+
+    indexed_recipes = []
+    lookup = ReuseTracker(store)
+
+    for index, recipe in recipes_client.iter_process_list(
+        diversification_result, lookup=None if refresh else lookup, bypass=refresh
+    ):
+
+        indexed_recipes.append((index, recipe))
+
+        yield event("progress", "recipe", index=index, result=recipe)
+
+    indexed_recipes.sort(key=lambda pair: pair[0])
+    recipes_result = [recipe for _, recipe in indexed_recipes]
+
+    yield lookup.event(len(recipes_result))
+
+    yield event("complete", "recipes", result=recipes_result)
+
+    # Served from memory at once; written to disk by the background writer.
+    writer.put_query(food, diversification_result, recipes_result)
+
+    yield event("done")
+
+
+async def arun_query(food: str, store, writer, refresh: bool = False):
+    """Async form of ``run_query`` on the asyncio agent clients."""
+
+    yield event("start", "initialization")
+
+    import agents.diversifier.client as diversifier_client
+
+    diversification_result = []
+    index = 0
+
+    async for dish in diversifier_client.aiter_diversification(food, bypass=refresh):
+
+        diversification_result.append(dish)
+
+        yield event("progress", "dish", index=index, result=dish)
+        index += 1
+
+    yield event("complete", "diversification", result=diversification_result)
+
+    import agents.recipes.client as recipes_client
+
+    indexed_recipes = []
+    lookup = ReuseTracker(store)
+
+    async for index, recipe in recipes_client.aiter_process_list(
+        diversification_result, lookup=None if refresh else lookup, bypass=refresh
+    ):
+
+        indexed_recipes.append((index, recipe))
+
+        yield event("progress", "recipe", index=index, result=recipe)
+
+    indexed_recipes.sort(key=lambda pair: pair[0])
+    recipes_result = [recipe for _, recipe in indexed_recipes]
+
+    yield lookup.event(len(recipes_result))
+
+    yield event("complete", "recipes", result=recipes_result)
+
+    writer.put_query(food, diversification_result, recipes_result)
+
+    yield event("done")
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from storage.compact_backend import CompactBackend, LazyRecipe
+from storage.json_backend import JsonBackend
+from storage.pages import PageCache
+from storage.sqlite_backend import SqliteBackend
+from storage.store import RecipeStore, clean_filename
+from storage.views import DishCard, ResultsView, join_results
+from storage.writer import PersistenceWriter
+
+BACKENDS = ("json", "sqlite", "compact")
+
+
+def open_store(base_path: Path, backend: str = "json", **kwargs) -> RecipeStore:
+    """Build a ``RecipeStore`` over ``base_path`` with the named backend.
+
+    The SQLite backend keeps its data in ``<base_path>/atlas.sqlite3`` and the
+    compact one under ``<base_path>/compact/``; use ``python -m storage.migrate``
+    once to import an existing JSON tree into either.
+    """
+
+    if backend == "json":
+
+        return RecipeStore(JsonBackend(base_path), **kwargs)
+
+    if backend == "sqlite":
+
+        return RecipeStore(SqliteBackend(Path(base_path) / "atlas.sqlite3"), **kwargs)
+
+    if backend == "compact":
+
+        return RecipeStore(CompactBackend(Path(base_path) / "compact"), **kwargs)
+
+    raise ValueError(f"Unknown storage backend '{backend}'; expected one of {BACKENDS}")
@@ -0,0 +1,211 @@
+import gzip
+import json
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+
+from storage.json_backend import JsonBackend
+from storage.store import clean_filename, unique_recipes
+
+COMPRESSIONS = ("gzip", "none")
+
+# Recipe fields a result keeps inline, so the results page never opens the
+# recipe files (see storage.views.DishCard).
+CARD_FIELDS = ("dish_name", "local_name", "similarity_score", "image_url")
+
+
+class LazyRecipe(Mapping):
+    """Read-only recipe from a compact result.
+
+    Holds the inline ``CARD_FIELDS``; the first lookup of any other field
+    loads the whole recipe file.
+    """
+
+    __slots__ = ("_backend", "_dish", "_variant", "_card", "_recipe")
+
+    def __init__(self, backend, dish: str, variant: str, card: dict):
+
+        self._backend = backend
+        self._dish = dish
+        self._variant = variant
+        self._card = card
+        self._recipe = None
+
+    def _load(self) -> dict:
+
+        if self._recipe is None:
+
+            self._recipe = (
+                self._backend.load_recipe(self._dish, self._variant) or self._card
+            )
+
+        return self._recipe
+
+    def __getitem__(self, key):
+
+        if key in self._card and self._recipe is None:
+
+            return self._card[key]
+
+        return self._load()[key]
+
+    def __iter__(self):
+
+        return iter(self._load())
+
+    def __len__(self):
+
+        return len(self._load())
+
+    @property
+    def loaded(self) -> bool:
+
+        return self._recipe is not None
+
+
+class CompactBackend(JsonBackend):
+    """The ``data/db`` layout as minified, optionally gzipped, JSON.
+
+    Recipes are stored once, under ``recipes/<dish>/<variant>``; a result
+    lists its dishes and, for each recipe, a ``[dish, variant]`` reference
+    plus the few fields the results page shows. ``load_result`` returns the
+    recipes as ``LazyRecipe`` mappings. Versions are file mtimes.
+    """
+
+    name = "compact"
+
+    def __init__(self, base_path: Path, compression: str = "gzip"):
+
+        if compression not in COMPRESSIONS:
+
+            raise ValueError(
+                f"Unknown compression '{compression}'; expected one of {COMPRESSIONS}"
+            )
+
+        super().__init__(base_path)
+
+        self.compression = compression
+        self.suffix = ".json.gz" if compression == "gzip" else ".json"
+
+    def _encode(self, data) -> bytes:
+
+        raw = json.dumps(
+            data, ensure_ascii=False, separators=(",", ":"), default=dict
+        ).encode("utf-8")
+
+        # mtime=0 keeps the bytes of unchanged data identical.
+        return gzip.compress(raw, mtime=0) if self.compression == "gzip" else raw
+
+    def _decode(self, raw: bytes):
+
+        if self.compression == "gzip":
+
+            try:
+
+                raw = gzip.decompress(raw)
+
+            except (OSError, EOFError, zlib.error) as e:
+
+                raise ValueError(e)
+
+        return json.loads(raw)
+
+    def save_result(self, query: str, result: dict) -> int:
+
+        dishes = result.get("dishes") or []
+        recipes = result.get("recipes") or []
+
+        if isinstance(dishes, str):
+
+            dishes = json.loads(dishes)
+
+        if isinstance(recipes, str):
+
+            recipes = json.loads(recipes)
+
+        recipes = unique_recipes(recipes)
+
+        refs = []
+
+        for recipe in recipes:
+
+            dish = clean_filename(recipe["dish_name"])
+
+            # A lazy recipe read from this very file is already stored.
+            if not (
+                isinstance(recipe, LazyRecipe)
+                and recipe._backend is self
+                and (recipe._dish, recipe._variant) == (dish, query)
+            ):
+
+                self.save_recipe(dish, query, dict(recipe))
+
+            refs.append(
+                {
+                    "ref": [dish, query],
+                    **{key: recipe.get(key) for key in CARD_FIELDS},
+                }
+            )
+
+        return self._save(
+            self.results_path / f"{query}{self.suffix}",
+            {"dishes": dishes, "recipes": refs},
+        )
+
+    def load_result(self, query: str):
+
+        stored = self._load(self.results_path / f"{query}{self.suffix}")
+
+        if stored is None:
+
+            return None
+
+        recipes = []
+
+        for ref in stored.get("recipes") or []:
+
+            dish, variant = ref.pop("ref")
+            recipes.append(LazyRecipe(self, dish, variant, ref))
+
+        return {"dishes": stored.get("dishes") or [], "recipes": recipes}
+
+    def save_batch(self, ops: list) -> list:
+        """Like ``JsonBackend.save_batch``, but a recipe op is not written
+        when a later result op in the batch stores the same recipe."""
+
+        covered = {}
+
+        for i, (kind, key, data) in enumerate(ops):
+
+            if kind == "result":
+
+                for recipe in data.get("recipes") or []:
+
+                    if isinstance(recipe, Mapping):
+
+                        covered[(clean_filename(recipe["dish_name"]), key)] = i
+
+        versions = []
+
+        for i, (kind, key, data) in enumerate(ops):
+
+            if kind == "result":
+
+                versions.append(self.save_result(key, data))
+
+            elif covered.get(key, -1) > i:
+
+                versions.append(None)
+
+            else:
+
+                versions.append(self.save_recipe(key[0], key[1], data))
+
+        # Versions of the skipped recipe ops, now that their results are saved.
+        for i, (kind, key, _) in enumerate(ops):
+
+            if kind == "recipe" and versions[i] is None:
+
+                versions[i] = self.scan_dish(key[0]).get(key[1])
+
+        return versions
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+class JsonBackend:
+    """The original ``data/db`` layout of pretty-printed JSON files.
+
+    ``recipes/<dish>/<variant>.json`` holds the recipe of a dish as found by
+    the query ``variant``; ``results/<query>.json`` holds a whole query result.
+    Versions are file mtimes.
+    """
+
+    name = "json"
+    suffix = ".json"
+
+    def __init__(self, base_path: Path):
+
+        self.base_path = Path(base_path)
+        self.recipes_path = self.base_path / "recipes"
+        self.results_path = self.base_path / "results"
+
+    def _scan_json_dir(self, path: Path) -> dict:
+
+        found = {}
+
+        try:
+
+            entries = list(os.scandir(path))
+
+        except FileNotFoundError:
+
+            return found
+
+        for entry in entries:
+
+            if entry.name.endswith(self.suffix) and entry.is_file():
+
+                found[entry.name[: -len(self.suffix)]] = entry.stat().st_mtime_ns
+
+        return found
+
+    def scan(self):
+        """Return ``({dish: {variant: version}}, {query: version})``."""
+
+        dishes = {}
+
+        try:
+
+            dish_entries = list(os.scandir(self.recipes_path))
+
+        except FileNotFoundError:
+
+            dish_entries = []
+
+        for entry in dish_entries:
+
+            if entry.is_dir():
+
+                variants = self._scan_json_dir(Path(entry.path))
+
+                if variants:
+
+                    dishes[entry.name] = variants
+
+        return dishes, self._scan_json_dir(self.results_path)
+
+    def scan_dish(self, dish: str) -> dict:
+        """Return ``{variant: version}`` for one dish."""
+
+        return self._scan_json_dir(self.recipes_path / dish)
+
+    def result_version(self, query: str):
+
+        try:
+
+            return (self.results_path / f"{query}{self.suffix}").stat().st_mtime_ns
+
+        except OSError:
+
+            return None
+
+    def _encode(self, data) -> bytes:
+
+        return json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+
+    def _decode(self, raw: bytes):
+
+        return json.loads(raw)
+
+    def _load(self, path: Path):
+
+        try:
+
+            with open(path, "rb") as f:
+
+                return self._decode(f.read())
+
+        except (OSError, ValueError):
+
+            return None
+
+    def _save(self, path: Path, data) -> int:
+        """Write through a temp file and ``os.replace`` so readers never see a
+        half-written file."""
+
+        os.makedirs(path.parent, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+        )
+
+        try:
+
+            with os.fdopen(fd, "wb") as f:
+
+                f.write(self._encode(data))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # mkstemp creates the file 0600; match what a plain open() gives.
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+
+        except BaseException:
+
+            try:
+
+                os.unlink(tmp_path)
+
+            except OSError:
+
+                pass
+
+            raise
+
+        return path.stat().st_mtime_ns
+
+    def load_recipe(self, dish: str, variant: str):
+
+        return self._load(self.recipes_path / dish / f"{variant}{self.suffix}")
+
+    def save_recipe(self, dish: str, variant: str, recipe: dict) -> int:
+
+        return self._save(self.recipes_path / dish / f"{variant}{self.suffix}", recipe)
+
+    def load_result(self, query: str):
+
+        return self._load(self.results_path / f"{query}{self.suffix}")
+
+    def save_result(self, query: str, result: dict) -> int:
+
+        return self._save(self.results_path / f"{query}{self.suffix}", result)
+
+    def save_batch(self, ops: list) -> list:
+        """Save ``("recipe", (dish, variant), data)`` and ``("result", query,
+        data)`` ops in order; return their versions."""
+
+        versions = []
+
+        for kind, key, data in ops:
+
+            if kind == "recipe":
+
+                versions.append(self.save_recipe(key[0], key[1], data))
+
+            else:
+
+                versions.append(self.save_result(key, data))
+
+        return versions
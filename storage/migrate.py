@@ -0,0 +1,89 @@
+"""One-shot import of the ``data/db`` JSON tree into another backend.
+
+    python -m storage.migrate [--source data/db] [--target data/db/atlas.sqlite3]
+    python -m storage.migrate --to compact [--target data/db/compact]
+
+Results are imported first and the recipe files afterwards, so where both
+hold a copy of the same recipe the file under ``recipes/`` wins. Importing
+twice is safe; existing rows are overwritten.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from storage.compact_backend import COMPRESSIONS, CompactBackend
+from storage.json_backend import JsonBackend
+from storage.sqlite_backend import SqliteBackend
+
+ROOT_PATH = Path(__file__).parent.parent
+DEFAULT_SOURCE = ROOT_PATH / "data" / "db"
+DEFAULT_TARGETS = {
+    "sqlite": DEFAULT_SOURCE / "atlas.sqlite3",
+    "compact": DEFAULT_SOURCE / "compact",
+}
+
+
+def import_json_tree(source: JsonBackend, target) -> dict:
+
+    counts = {"results": 0, "recipes": 0, "skipped": 0}
+    dishes, results = source.scan()
+
+    for query in sorted(results):
+
+        result = source.load_result(query)
+
+        if result is None:
+
+            counts["skipped"] += 1
+            continue
+
+        target.save_result(query, result)
+        counts["results"] += 1
+
+    for dish in sorted(dishes):
+
+        for variant in sorted(dishes[dish]):
+
+            recipe = source.load_recipe(dish, variant)
+
+            if recipe is None:
+
+                counts["skipped"] += 1
+                continue
+
+            target.save_recipe(dish, variant, recipe)
+            counts["recipes"] += 1
+
+    return counts
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", type=Path, default=DEFAULT_SOURCE)
+    parser.add_argument("--to", choices=tuple(DEFAULT_TARGETS), default="sqlite")
+    parser.add_argument("--target", type=Path)
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    args = parser.parse_args()
+
+    args.target = args.target or DEFAULT_TARGETS[args.to]
+    target = (
+        SqliteBackend(args.target)
+        if args.to == "sqlite"
+        else CompactBackend(args.target, compression=args.compression)
+    )
+
+    t0 = time.perf_counter()
+    counts = import_json_tree(JsonBackend(args.source), target)
+    elapsed = time.perf_counter() - t0
+
+    print(
+        f"Imported {counts['results']} results and {counts['recipes']} recipes"
+        f" into {args.target} in {elapsed:.2f}s ({counts['skipped']} skipped)"
+    )
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import time
+
+
+class PageCache:
+    """Rendered pages keyed by the store entry they show.
+
+    ``get(key, data, render, version)`` returns the cached page for ``key`` as
+    long as ``data`` is the same object it was rendered from. The store hands
+    out one shared dict per entry and replaces it whenever the entry is
+    written (here or, after a refresh, by another worker), so a write
+    invalidates the page without any bookkeeping. Pages are dicts with the
+    ``body``, an ``etag`` (a hash of the body, so every worker agrees on it)
+    and ``last_modified`` in seconds: the entry's ``version`` when it has one,
+    otherwise the time it was rendered. The least recently used pages are
+    dropped beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._pages = {}
+
+    def get(self, key, data, render, version=None) -> dict:
+
+        with self._lock:
+
+            page = self._pages.pop(key, None)
+
+            if page is not None and page["data"] is data:
+
+                self._pages[key] = page
+                self.hits += 1
+
+                return page
+
+        body = render()
+        page = {
+            "data": data,
+            "body": body,
+            "etag": hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest(),
+            # Backend versions are nanosecond timestamps.
+            "last_modified": version / 1e9 if version is not None else time.time(),
+        }
+
+        with self._lock:
+
+            self.misses += 1
+            self._pages[key] = page
+
+            while len(self._pages) > self.max_entries:
+
+                del self._pages[next(iter(self._pages))]
+
+        return page
+
+    def clear(self):
+
+        with self._lock:
+
+            self._pages.clear()
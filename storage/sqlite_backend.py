@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from storage.store import clean_filename, unique_recipes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    updated_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dishes (
+    query TEXT NOT NULL REFERENCES queries (query) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    dish TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (query, position)
+);
+
+CREATE INDEX IF NOT EXISTS dishes_dish ON dishes (dish);
+
+CREATE TABLE IF NOT EXISTS recipes (
+    dish TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    position INTEGER,
+    data TEXT NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (dish, variant)
+);
+
+CREATE INDEX IF NOT EXISTS recipes_variant ON recipes (variant, position);
+"""
+
+
+def dumps(data) -> str:
+
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SqliteBackend:
+    """Recipes and results in a single SQLite file.
+
+    ``queries`` has one row per query, ``dishes`` the diversified dishes of
+    each query in order, and ``recipes`` one row per (dish, variant) where the
+    variant is the query that found it. A query result references its recipes
+    through ``recipes.position`` instead of holding a second copy of them.
+    Versions are ``updated_at`` timestamps in nanoseconds.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path):
+
+        self.path = Path(path)
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None or self._local.pid != os.getpid():
+
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def scan(self):
+        """Return ``({dish: {variant: version}}, {query: version})``."""
+
+        conn = self._connect()
+        dishes = {}
+
+        for dish, variant, updated_at in conn.execute(
+            "SELECT dish, variant, updated_at FROM recipes"
+        ):
+
+            dishes.setdefault(dish, {})[variant] = updated_at
+
+        results = dict(conn.execute("SELECT query, updated_at FROM queries"))
+
+        return dishes, results
+
+    def scan_dish(self, dish: str) -> dict:
+        """Return ``{variant: version}`` for one dish."""
+
+        return dict(
+            self._connect().execute(
+                "SELECT variant, updated_at FROM recipes WHERE dish = ?", (dish,)
+            )
+        )
+
+    def result_version(self, query: str):
+
+        row = (
+            self._connect()
+            .execute("SELECT updated_at FROM queries WHERE query = ?", (query,))
+            .fetchone()
+        )
+
+        return row[0] if row else None
+
+    def load_recipe(self, dish: str, variant: str):
+
+        row = (
+            self._connect()
+            .execute(
+                "SELECT data FROM recipes WHERE dish = ? AND variant = ?",
+                (dish, variant),
+            )
+            .fetchone()
+        )
+
+        return json.loads(row[0]) if row else None
+
+    def _save_recipe(self, conn, dish: str, variant: str, recipe: dict, now: int):
+
+        conn.execute(
+            "INSERT INTO recipes (dish, variant, data, updated_at)"
+            " VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (dish, variant) DO UPDATE"
+            " SET data = excluded.data, updated_at = excluded.updated_at",
+            (dish, variant, dumps(recipe), now),
+        )
+
+    def save_recipe(self, dish: str, variant: str, recipe: dict) -> int:
+
+        now = time.time_ns()
+
+        with self._connect() as conn:
+
+            self._save_recipe(conn, dish, variant, recipe, now)
+
+        return now
+
+    def load_result(self, query: str):
+
+        conn = self._connect()
+
+        if conn.execute(
+            "SELECT 1 FROM queries WHERE query = ?", (query,)
+        ).fetchone() is None:
+
+            return None
+
+        dishes = [
+            json.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM dishes WHERE query = ? ORDER BY position", (query,)
+            )
+        ]
+        recipes = [
+            json.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM recipes WHERE variant = ? AND position IS NOT NULL"
+                " ORDER BY position",
+                (query,),
+            )
+        ]
+
+        return {"dishes": dishes, "recipes": recipes}
+
+    def _save_result(self, conn, query: str, result: dict, now: int):
+
+        dishes = result.get("dishes") or []
+        recipes = result.get("recipes") or []
+
+        if isinstance(dishes, str):
+
+            dishes = json.loads(dishes)
+
+        if isinstance(recipes, str):
+
+            recipes = json.loads(recipes)
+
+        recipes = unique_recipes(recipes)
+
+        conn.execute(
+            "INSERT INTO queries (query, updated_at) VALUES (?, ?)"
+            " ON CONFLICT (query) DO UPDATE SET updated_at = excluded.updated_at",
+            (query, now),
+        )
+        conn.execute("DELETE FROM dishes WHERE query = ?", (query,))
+        conn.executemany(
+            "INSERT INTO dishes (query, position, dish, data) VALUES (?, ?, ?, ?)",
+            [
+                (query, i, clean_filename(d.get("dish_name", "")), dumps(d))
+                for i, d in enumerate(dishes)
+            ],
+        )
+        conn.execute("UPDATE recipes SET position = NULL WHERE variant = ?", (query,))
+        conn.executemany(
+            "INSERT INTO recipes (dish, variant, position, data, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (dish, variant) DO UPDATE"
+            " SET position = excluded.position, data = excluded.data,"
+            " updated_at = excluded.updated_at",
+            [
+                (clean_filename(r["dish_name"]), query, i, dumps(r), now)
+                for i, r in enumerate(recipes)
+            ],
+        )
+
+    def save_result(self, query: str, result: dict) -> int:
+
+        now = time.time_ns()
+
+        with self._connect() as conn:
+
+            self._save_result(conn, query, result, now)
+
+        return now
+
+    def save_batch(self, ops: list) -> list:
+        """Save ``("recipe", (dish, variant), data)`` and ``("result", query,
+        data)`` ops in one transaction; return their versions."""
+
+        now = time.time_ns()
+
+        with self._connect() as conn:
+
+            for kind, key, data in ops:
+
+                if kind == "recipe":
+
+                    self._save_recipe(conn, key[0], key[1], data, now)
+
+                else:
+
+                    self._save_result(conn, key, data, now)
+
+        return [now] * len(ops)
@@ -0,0 +1,392 @@
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from pathvalidate import sanitize_filename
+
+from telemetry import get_logger, warning
+
+
+# Pure and slow (pathvalidate), and called on every page view.
+@lru_cache(maxsize=4096)
+def clean_filename(name: str) -> str:
+    return sanitize_filename(name.replace(" ", "_").lower())
+
+
+def unique_recipes(recipes: list) -> list:
+    """``recipes`` less those whose dish name cleans to that of an earlier
+    one: every backend keeps a single recipe per (dish, query)."""
+
+    seen = set()
+    unique = []
+
+    for recipe in recipes:
+
+        dish = clean_filename(recipe.get("dish_name", ""))
+
+        if dish not in seen:
+
+            seen.add(dish)
+            unique.append(recipe)
+
+    return unique
+
+
+class RecipeStore:
+    """In-memory index in front of a storage backend.
+
+    Recipes are keyed by (dish, variant), where the variant is the query that
+    found the recipe; results are keyed by query. All keys are cleaned names.
+
+    The backend is indexed lazily on first use (names and versions only) and
+    each entry is loaded at most once, so repeated page views are served from
+    memory. Writes go through the store and update the index immediately.
+    Every ``refresh_interval`` seconds a background thread rescans the backend
+    so entries written by other worker processes are picked up; pass ``None``
+    to disable this. A lookup that misses the index asks the backend directly
+    once; the miss is then remembered until the next refresh.
+
+    ``backend`` is a ``JsonBackend``/``SqliteBackend``, or a path to a
+    ``data/db`` JSON tree. Returned dicts are shared between callers and must
+    not be mutated.
+    """
+
+    def __init__(self, backend, refresh_interval: float = 5.0):
+
+        if isinstance(backend, (str, Path)):
+
+            from storage.json_backend import JsonBackend
+
+            backend = JsonBackend(backend)
+
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+
+        self.logger = get_logger(f"storage.{self.__class__.__name__}")
+
+        self._lock = threading.RLock()
+        self._indexed = False
+        self._thread = None
+        self._pid = None
+
+        # dish -> {variant: version} and query -> version
+        self._dishes = {}
+        self._results = {}
+
+        # Loaded entries, keyed like the indexes above.
+        self._recipe_cache = {}
+        self._result_cache = {}
+
+        # Staged ops not yet written by the backend, by (kind, key).
+        self._pending = {}
+
+        # Keys the backend lacked when last asked, until the next refresh.
+        self._missing_dishes = set()
+        self._missing_results = set()
+
+    def refresh(self):
+        """Rescan the backend, dropping loaded entries whose version changed."""
+
+        dishes, results = self.backend.scan()
+
+        with self._lock:
+
+            for dish, variant in list(self._recipe_cache):
+
+                if ("recipe", (dish, variant)) in self._pending:
+
+                    continue
+
+                if dishes.get(dish, {}).get(variant) != self._dishes.get(dish, {}).get(
+                    variant
+                ):
+
+                    del self._recipe_cache[(dish, variant)]
+
+            for query in list(self._result_cache):
+
+                if ("result", query) in self._pending:
+
+                    continue
+
+                if results.get(query) != self._results.get(query):
+
+                    del self._result_cache[query]
+
+            for kind, key in self._pending:
+
+                if kind == "recipe":
+
+                    dishes.setdefault(key[0], {})[key[1]] = None
+
+                else:
+
+                    results[key] = None
+
+            self._dishes = dishes
+            self._results = results
+            self._missing_dishes = set()
+            self._missing_results = set()
+            self._indexed = True
+
+    def _ensure_index(self):
+
+        if not self._indexed:
+
+            self.refresh()
+
+        # Started lazily, and again after a fork, so each worker has its own.
+        if self.refresh_interval is None or self._pid == os.getpid():
+
+            return
+
+        with self._lock:
+
+            if self._pid != os.getpid():
+
+                self._thread = threading.Thread(
+                    target=self._run, name="store-refresh", daemon=True
+                )
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+
+        while True:
+
+            time.sleep(self.refresh_interval)
+
+            try:
+
+                self.refresh()
+
+            except Exception as e:
+
+                warning(self.logger, e, "Failed to rescan the storage backend")
+
+    # Recipes
+
+    def _dish_variants(self, dish: str) -> dict:
+
+        self._ensure_index()
+
+        variants = self._dishes.get(dish)
+
+        if variants is None and dish and dish not in self._missing_dishes:
+
+            # Possibly written by another worker since the last refresh.
+            variants = self.backend.scan_dish(dish)
+
+            with self._lock:
+
+                if variants:
+
+                    self._dishes.setdefault(dish, {}).update(variants)
+
+                else:
+
+                    self._missing_dishes.add(dish)
+
+        return variants or {}
+
+    def variants(self, dish: str) -> list:
+        """Sorted variant names stored for a (cleaned) dish name."""
+
+        return sorted(self._dish_variants(dish))
+
+    def has_dish(self, dish: str) -> bool:
+
+        return bool(self._dish_variants(dish))
+
+    def get_recipe(self, dish: str, variant: str):
+
+        key = (dish, variant)
+        recipe = self._recipe_cache.get(key)
+
+        if recipe is None and variant in self._dish_variants(dish):
+
+            recipe = self.backend.load_recipe(dish, variant)
+
+            if recipe is not None:
+
+                with self._lock:
+
+                    self._recipe_cache[key] = recipe
+
+        return recipe
+
+    def recipe_version(self, dish: str, variant: str):
+        """Backend version of a recipe; ``None`` while its write is pending."""
+
+        return self._dish_variants(dish).get(variant)
+
+    def find_recipe(self, dish_name: str):
+        """Return any stored recipe for a dish, whichever query found it."""
+
+        dish = clean_filename(dish_name)
+
+        for variant in self.variants(dish):
+
+            recipe = self.get_recipe(dish, variant)
+
+            if recipe is not None:
+
+                return recipe
+
+        return None
+
+    def put_recipe(self, dish_name: str, query: str, recipe: dict):
+
+        dish = clean_filename(dish_name)
+        variant = clean_filename(query)
+
+        version = self.backend.save_recipe(dish, variant, recipe)
+
+        self._ensure_index()
+
+        with self._lock:
+
+            self._dishes.setdefault(dish, {})[variant] = version
+            self._recipe_cache[(dish, variant)] = recipe
+
+    # Results
+
+    def _result_known(self, key: str, recheck: bool = False) -> bool:
+
+        self._ensure_index()
+
+        if key in self._results:
+
+            return True
+
+        if not key or (key in self._missing_results and not recheck):
+
+            return False
+
+        version = self.backend.result_version(key)
+
+        with self._lock:
+
+            if version is not None:
+
+                self._results.setdefault(key, version)
+
+            else:
+
+                self._missing_results.add(key)
+
+        return version is not None
+
+    def has_result(self, query: str) -> bool:
+
+        return self._result_known(clean_filename(query))
+
+    def get_result(self, query: str):
+
+        key = clean_filename(query)
+        result = self._result_cache.get(key)
+
+        # Rechecked: a finished job redirects here, maybe from another worker.
+        if result is None and self._result_known(key, recheck=True):
+
+            result = self.backend.load_result(key)
+
+            if result is not None:
+
+                with self._lock:
+
+                    self._result_cache[key] = result
+
+        return result
+
+    def result_version(self, query: str):
+        """Backend version of a result; ``None`` while its write is pending."""
+
+        key = clean_filename(query)
+
+        return self._results.get(key) if self._result_known(key) else None
+
+    def put_result(self, query: str, dishes, recipes):
+
+        key = clean_filename(query)
+        result = {"dishes": dishes, "recipes": unique_recipes(recipes)}
+
+        version = self.backend.save_result(key, result)
+
+        self._ensure_index()
+
+        with self._lock:
+
+            self._results[key] = version
+            self._result_cache[key] = result
+
+    # Deferred writes
+
+    def query_ops(self, query: str, dishes, recipes) -> list:
+        """Backend ops that persist a whole query: each recipe under
+        ``<dish>/<query>`` plus the query result."""
+
+        variant = clean_filename(query)
+        recipes = unique_recipes(recipes)
+        ops = [
+            ("recipe", (clean_filename(recipe["dish_name"]), variant), recipe)
+            for recipe in recipes
+        ]
+        ops.append(("result", variant, {"dishes": dishes, "recipes": recipes}))
+
+        return ops
+
+    def stage(self, ops: list):
+        """Serve ``ops`` from memory ahead of their write.
+
+        Staged entries survive refreshes until ``commit`` is called for them.
+        """
+
+        self._ensure_index()
+
+        with self._lock:
+
+            for op in ops:
+
+                kind, key, data = op
+                self._pending[(kind, key)] = op
+
+                if kind == "recipe":
+
+                    self._dishes.setdefault(key[0], {})[key[1]] = None
+                    self._recipe_cache[key] = data
+
+                else:
+
+                    self._results[key] = None
+                    self._result_cache[key] = data
+
+    def commit(self, ops: list, versions: list):
+        """Record the backend versions of staged ops once they are written."""
+
+        with self._lock:
+
+            for op, version in zip(ops, versions):
+
+                kind, key, _ = op
+
+                # A newer op for the same key may have been staged meanwhile.
+                if self._pending.get((kind, key)) is not op:
+
+                    continue
+
+                del self._pending[(kind, key)]
+
+                if kind == "recipe":
+
+                    self._dishes.setdefault(key[0], {})[key[1]] = version
+
+                else:
+
+                    self._results[key] = version
+
+    def pending_count(self) -> int:
+
+        return len(self._pending)
@@ -0,0 +1,145 @@
+import json
+from collections.abc import Mapping
+
+
+def dish_key(name) -> str:
+    """Normalized key that matches a dish to its recipe: case and runs of
+    whitespace are ignored."""
+
+    return " ".join(name.casefold().split()) if isinstance(name, str) else ""
+
+
+def _decoded(value) -> list:
+
+    if isinstance(value, str):
+
+        try:
+
+            value = json.loads(value)
+
+        except ValueError:
+
+            return []
+
+    return value if isinstance(value, list) else []
+
+
+class DishCard:
+    """One dish on the results page, with its recipe if one was found."""
+
+    __slots__ = ("dish", "recipe")
+
+    def __init__(self, dish: dict, recipe: dict = None):
+
+        self.dish = dish
+        self.recipe = recipe
+
+    def _field(self, name: str):
+
+        value = self.dish.get(name)
+
+        if value is None and self.recipe is not None:
+
+            value = self.recipe.get(name)
+
+        return value
+
+    @property
+    def dish_name(self) -> str:
+
+        return self._field("dish_name") or ""
+
+    @property
+    def local_name(self) -> str:
+
+        return self._field("local_name") or ""
+
+    @property
+    def similarity_score(self) -> float:
+
+        return self._field("similarity_score") or 0.0
+
+    @property
+    def image_url(self):
+
+        return self.recipe.get("image_url") if self.recipe is not None else None
+
+
+class ResultsView:
+    """A stored query result joined for display.
+
+    ``with_recipe`` and ``without_recipe`` partition the diversified dishes, in
+    their original order; recipes whose dish is not in the list (e.g. when the
+    diversification was lost) are shown at the end of ``with_recipe``.
+    """
+
+    __slots__ = ("query", "with_recipe", "without_recipe")
+
+    def __init__(self, query: str, with_recipe: list, without_recipe: list):
+
+        self.query = query
+        self.with_recipe = with_recipe
+        self.without_recipe = without_recipe
+
+    @property
+    def total(self) -> int:
+
+        return len(self.with_recipe) + len(self.without_recipe)
+
+    @classmethod
+    def empty(cls, query: str) -> "ResultsView":
+
+        return cls(query, [], [])
+
+    @classmethod
+    def from_result(cls, query: str, data: dict) -> "ResultsView":
+        """Build the view from a stored ``{"dishes": ..., "recipes": ...}``
+        result; either list may also be a JSON string."""
+
+        return cls(
+            query,
+            *join_results(_decoded(data.get("dishes")), _decoded(data.get("recipes")))
+        )
+
+
+def join_results(dishes: list, recipes: list):
+    """Attach each recipe to its dish by normalized name, in one pass over
+    each list; return ``(with_recipe, without_recipe)`` lists of cards."""
+
+    by_key = {}
+
+    for recipe in recipes:
+
+        if isinstance(recipe, Mapping):
+
+            by_key.setdefault(dish_key(recipe.get("dish_name")), recipe)
+
+    with_recipe = []
+    without_recipe = []
+    matched = set()
+
+    for dish in dishes:
+
+        if not isinstance(dish, Mapping):
+
+            continue
+
+        key = dish_key(dish.get("dish_name"))
+        recipe = by_key.get(key) if key else None
+
+        if recipe is None:
+
+            without_recipe.append(DishCard(dish))
+
+        else:
+
+            matched.add(key)
+            with_recipe.append(DishCard(dish, recipe))
+
+    for key, recipe in by_key.items():
+
+        if key not in matched:
+
+            with_recipe.append(DishCard(recipe, recipe))
+
+    return with_recipe, without_recipe
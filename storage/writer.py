@@ -0,0 +1,129 @@
+import atexit
+import os
+import queue
+import threading
+
+from telemetry import get_logger, metrics, warning
+
+
+class PersistenceWriter:
+    """Background writer that takes storage off the request path.
+
+    ``put_query`` stages a query's recipes and result in the store (so this
+    worker serves them from memory at once) and queues the backend writes. A
+    single daemon thread drains the queue, saving up to ``max_batch`` ops per
+    ``backend.save_batch`` call. ``flush`` waits for everything queued so far;
+    it is registered with ``atexit`` so a worker that shuts down cleanly has
+    written all of its data first.
+    """
+
+    def __init__(self, store, max_batch: int = 256):
+
+        self.store = store
+        self.max_batch = max_batch
+        self.module_name = self.__class__.__name__
+        self.logger = get_logger(f"storage.{self.module_name}")
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+
+        # Started lazily, and again after a fork, so each worker has its own.
+        if self._thread is not None and self._pid == os.getpid():
+
+            return
+
+        with self._lock:
+
+            if self._thread is None or self._pid != os.getpid():
+
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, name="persistence-writer", daemon=True
+                )
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, ops: list):
+
+        self._ensure_thread()
+        self.store.stage(ops)
+        self._queue.put(ops)
+
+    def put_query(self, query: str, dishes, recipes):
+
+        self.submit(self.store.query_ops(query, dishes, recipes))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until every submitted op has been written (or failed)."""
+
+        if self._thread is None or self._pid != os.getpid():
+
+            return True
+
+        done = threading.Event()
+        self._queue.put(done)
+
+        return done.wait(timeout)
+
+    def _run(self):
+
+        while True:
+
+            item = self._queue.get()
+            ops = []
+            waiters = []
+
+            while True:
+
+                if isinstance(item, threading.Event):
+
+                    waiters.append(item)
+
+                else:
+
+                    ops += item
+
+                if len(ops) >= self.max_batch:
+
+                    break
+
+                try:
+
+                    item = self._queue.get_nowait()
+
+                except queue.Empty:
+
+                    break
+
+            if ops:
+
+                self._write(ops)
+
+            for waiter in waiters:
+
+                waiter.set()
+
+    def _write(self, ops: list):
+
+        try:
+
+            with metrics.span("persist"):
+
+                versions = self.store.backend.save_batch(ops)
+
+        except Exception as e:
+
+            warning(
+                self.logger,
+                e,
+                f"Failed to persist {len(ops)} ops; they stay in memory only",
+            )
+            return
+
+        self.store.commit(ops, versions)
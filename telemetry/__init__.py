@@ -0,0 +1,2 @@
+from telemetry.logs import get_logger, quote, warning
+from telemetry.metrics import REGISTRY, Registry, observe, render, span
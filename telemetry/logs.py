@@ -0,0 +1,51 @@
+import logging
+import os
+import sys
+
+LOG_FORMAT = "| FROM %(name)s | %(levelname)s: %(message)s"
+
+# LOG_LEVEL=DEBUG also shows the agents' per-batch log lines.
+DEFAULT_LEVEL = "INFO"
+
+# Longest model reply quoted in a log line.
+MAX_QUOTED_CHARS = 500
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return the logger ``name``, writing ``LOG_FORMAT`` lines to stderr at
+    the level set by ``LOG_LEVEL``."""
+
+    logger = logging.getLogger(name)
+
+    if not logger.handlers:
+
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        level = os.environ.get("LOG_LEVEL", DEFAULT_LEVEL).upper()
+
+        if not isinstance(logging.getLevelName(level), int):
+
+            level = DEFAULT_LEVEL
+
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+    return logger
+
+
+def quote(text: str, limit: int = MAX_QUOTED_CHARS) -> str:
+    """``text`` for a log line: repr'd, and cut to its first ``limit``
+    characters if longer."""
+
+    if len(text) <= limit:
+
+        return repr(text)
+
+    return f"{text[:limit]!r}... ({len(text) - limit} more characters)"
+
+
+def warning(logger: logging.Logger, e: Exception, extra: str = ""):
+    """Log ``e`` the way every module's ``warn`` does."""
+
+    logger.warning("%s | %s", e, extra)
@@ -0,0 +1,544 @@
+import atexit
+import bisect
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# Upper bounds in seconds; wide enough for a template render (ms) and a whole
+# diversifier request (tens of seconds).
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Upper bounds in tokens, for per-item prompt and completion sizes.
+TOKEN_BUCKETS = (50, 100, 250, 500, 750, 1000, 1500, 2000, 4000, 8000)
+
+# Where server worker processes leave their counters and histograms to be
+# summed at scrape time; METRICS_DIR overrides it.
+SHARED_DIR = Path(
+    os.environ.get("METRICS_DIR", Path(__file__).parent.parent / "data" / "metrics")
+)
+
+# Kinds summed across processes; the others (gauges) describe the process
+# that answers the scrape.
+SUMMED_KINDS = ("counter", "histogram")
+
+
+def format_labels(labels: dict) -> str:
+
+    if not labels:
+
+        return ""
+
+    pairs = []
+
+    for key, value in labels.items():
+
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{key}="{value}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value) -> str:
+
+    if value == float("inf"):
+
+        return "+Inf"
+
+    if isinstance(value, float) and value.is_integer():
+
+        return str(int(value))
+
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+
+        if set(labels) != set(self.labelnames):
+
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+
+        with self._lock:
+
+            self._values = {}
+
+    def series(self) -> dict:
+        """``{label values: value}`` for every sample of this family."""
+
+        with self._lock:
+
+            return dict(self._values)
+
+    def samples(self):
+        """Yield ``(suffix, labels, value)`` for the exposition format."""
+
+        for key, value in sorted(self.series().items()):
+
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+
+        key = self._key(labels)
+
+        with self._lock:
+
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+
+        with self._lock:
+
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram of observed values (seconds for spans)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+
+        super().__init__(name, help, labelnames)
+
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+
+        key = self._key(labels)
+
+        with self._lock:
+
+            series = self._values.get(key)
+
+            if series is None:
+
+                series = self._values[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, **labels) -> dict:
+
+        with self._lock:
+
+            series = self._values.get(self._key(labels))
+
+            if series is None:
+
+                return {"count": 0, "sum": 0.0, "counts": [0] * (len(self.buckets) + 1)}
+
+            return {
+                "count": series["count"],
+                "sum": series["sum"],
+                "counts": list(series["counts"]),
+            }
+
+    def samples(self):
+
+        for key, series in sorted(self.series().items()):
+
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+
+                cumulative += count
+                yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+
+            yield "_sum", labels, series["sum"]
+            yield "_count", labels, series["count"]
+
+
+class CallbackMetric(Metric):
+    """A counter or gauge read from ``collect()`` at scrape time.
+
+    ``collect`` returns a number, or ``{label values: number}`` when the
+    metric has labels; it is how counters kept elsewhere (the LLM cache,
+    the transport) are exposed without counting everything twice.
+    """
+
+    def __init__(self, name: str, help: str, collect, kind="gauge", labelnames=()):
+
+        super().__init__(name, help, labelnames)
+
+        self.kind = kind
+        self.collect = collect
+
+    def series(self) -> dict:
+
+        values = self.collect()
+
+        if not isinstance(values, dict):
+
+            return {(): values}
+
+        return {
+            key if isinstance(key, tuple) else (key,): value
+            for key, value in values.items()
+        }
+
+
+class Registry:
+    """The process's metrics, rendered in the Prometheus text format.
+
+    Every worker process keeps its own registry. After ``share(directory)``
+    it also writes its counters and histograms to a file there every
+    ``interval`` seconds (and at exit), and renders them summed over every
+    file in the directory, so a scrape answered by any worker sees the same
+    totals. Files of workers that have exited are kept, so the totals never
+    go down while the server runs.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.shared_dir = None
+        self._file = None
+        self._pid = None
+        self._dump_lock = threading.Lock()
+
+    def _add(self, metric: Metric) -> Metric:
+
+        with self._lock:
+
+            existing = self._metrics.get(metric.name)
+
+            if existing is not None and not isinstance(metric, CallbackMetric):
+
+                return existing
+
+            self._metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(
+        self, name: str, help: str, collect, kind="gauge", labelnames=()
+    ) -> CallbackMetric:
+        """Register (or replace) a metric read from ``collect()``."""
+
+        return self._add(CallbackMetric(name, help, collect, kind, labelnames))
+
+    def get(self, name: str):
+
+        return self._metrics.get(name)
+
+    def reset(self):
+        """Zero every counter and histogram (callback metrics are kept)."""
+
+        for metric in list(self._metrics.values()):
+
+            metric.reset()
+
+    def share(self, directory: Path, interval: float = 5.0):
+        """Sum counters and histograms with the other processes that share
+        ``directory``; call it in each process, after any fork."""
+
+        if self._pid == os.getpid():
+
+            return
+
+        self.shared_dir = Path(directory)
+        self.shared_dir.mkdir(parents=True, exist_ok=True)
+        self._file = self.shared_dir / f"{os.getpid()}-{uuid.uuid4().hex}.json"
+        self._pid = os.getpid()
+
+        def flush():
+
+            while True:
+
+                time.sleep(interval)
+                self.dump()
+
+        threading.Thread(target=flush, name="metrics-flush", daemon=True).start()
+        atexit.register(self.dump)
+
+    def families(self, kinds=None) -> list:
+        """``(name, kind, help, samples)`` for each metric of ``kinds``
+        (default all), with ``samples`` the exception if it could not be
+        read."""
+
+        families = []
+
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+
+            if kinds is not None and metric.kind not in kinds:
+
+                continue
+
+            try:
+
+                samples = list(metric.samples())
+
+            except Exception as e:
+
+                samples = e
+
+            families.append((metric.name, metric.kind, metric.help, samples))
+
+        return families
+
+    def dump(self):
+        """Write this process's counters and histograms to its shared file;
+        a write that fails is left to the next one."""
+
+        if self._pid != os.getpid():
+
+            return
+
+        families = [
+            family
+            for family in self.families(SUMMED_KINDS)
+            if not isinstance(family[3], Exception)
+        ]
+        partial = self._file.with_suffix(".tmp")
+
+        with self._dump_lock:
+
+            try:
+
+                partial.write_text(json.dumps(families), encoding="utf-8")
+                os.replace(partial, self._file)
+
+            except OSError:
+
+                pass
+
+    def summed(self) -> list:
+        """The counters and histograms of every shared file, summed, as
+        ``families()`` gives them."""
+
+        summed = {}
+
+        for path in sorted(self.shared_dir.glob("*.json")):
+
+            try:
+
+                families = json.loads(path.read_text(encoding="utf-8"))
+
+            except (OSError, ValueError):
+
+                continue
+
+            for name, kind, help, samples in families:
+
+                values = summed.setdefault(name, (kind, help, {}))[2]
+
+                for suffix, labels, value in samples:
+
+                    key = (suffix, tuple(labels.items()))
+                    values[key] = values.get(key, 0) + value
+
+        return [
+            (
+                name,
+                kind,
+                help,
+                [(s, dict(labels), v) for (s, labels), v in values.items()],
+            )
+            for name, (kind, help, values) in summed.items()
+        ]
+
+    def render(self) -> str:
+
+        families = self.families()
+
+        if self._pid == os.getpid():
+
+            self.dump()
+            families = [f for f in families if f[1] not in SUMMED_KINDS]
+            families += self.summed()
+
+        lines = []
+
+        for name, kind, help, samples in sorted(families, key=lambda f: f[0]):
+
+            if isinstance(samples, Exception):
+
+                lines.append(f"# {name} unavailable: {type(samples).__name__}")
+                continue
+
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for suffix, labels, value in samples:
+
+                lines.append(
+                    f"{name}{suffix}{format_labels(labels)} {format_value(value)}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def clear_shared(directory: Path = SHARED_DIR):
+    """Remove the files ``Registry.share`` left in ``directory``; the server
+    calls it once at start-up, before its workers share it."""
+
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def prune_shared(directory: Path = SHARED_DIR):
+    """Remove the files in ``directory`` of processes that have exited.
+
+    For servers with no hook that runs once before the workers start (uvicorn
+    runs the ASGI lifespan in each worker): live workers keep their files, a
+    previous run's are dropped.
+    """
+
+    for path in Path(directory).glob("*.json"):
+
+        try:
+
+            os.kill(int(path.name.split("-", 1)[0]), 0)
+
+        except ProcessLookupError:
+
+            path.unlink(missing_ok=True)
+
+        except (ValueError, OSError):
+
+            pass
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds",
+    "Wall time of each pipeline stage (diversifier_request, json_parse, "
+    "recipes_batch, persist, render).",
+    ("stage",),
+)
+STAGE_FAILURES = REGISTRY.counter(
+    "pipeline_stage_failures_total", "Pipeline stages that raised.", ("stage",)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total",
+    "Tokens sent to and received from the LLM API, from the reply's usage "
+    "field or estimated at 4 characters per token when it has none.",
+    ("model", "kind"),
+)
+LLM_RETRIES = REGISTRY.counter(
+    "llm_retries_total",
+    "LLM requests sent again after a failure (a status, an exception name, "
+    "or 'parse' when the reply is re-asked for).",
+    ("agent", "reason"),
+)
+LLM_HEDGES = REGISTRY.counter(
+    "llm_hedges_total",
+    "Duplicate LLM requests sent because the first was slower than the "
+    "agent's p95, by which one answered first (primary or hedge).",
+    ("agent", "winner"),
+)
+LLM_FAILURES = REGISTRY.counter(
+    "llm_failures_total",
+    "LLM requests that failed: the HTTP status, the exception name, or "
+    "'parse' for a reply that was not the expected JSON.",
+    ("agent", "reason"),
+)
+LLM_ROUTES = REGISTRY.counter(
+    "llm_routes_total",
+    "Models chosen for LLM requests: 'preferred' (first healthy in priority "
+    "order), 'failover' (an earlier model was unhealthy or failed this "
+    "call), 'hedge' (a duplicate request) or 'default' (agent not routed).",
+    ("agent", "model", "reason"),
+)
+LLM_TOKENS_PER_ITEM = REGISTRY.histogram(
+    "llm_tokens_per_item",
+    "Tokens of each answered batch divided by the items (e.g. recipes) in "
+    "it, estimated at 4 characters per token.",
+    ("agent", "kind"),
+    buckets=TOKEN_BUCKETS,
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block into ``pipeline_stage_seconds{stage=...}``; count it in
+    ``pipeline_stage_failures_total`` if it raises."""
+
+    started = time.perf_counter()
+
+    try:
+
+        yield
+
+    except Exception:
+
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+
+    finally:
+
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def observe(stage: str, seconds: float):
+    """Record a stage timed elsewhere (e.g. a recipes batch's ``elapsed_s``)."""
+
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def render() -> str:
+
+    return REGISTRY.render()